@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+backend_pool.py
+
+多 key / 多端点的后端池（FinalScript v7 使用），把单元请求分散到多个账号上，吞吐随 key 数近似线性增长：
+- 每个后端 = (名称, base_url, api_key, 模型名映射, 权重, RPM, TPM)，各自一个 Common/rate_limiter.py 的共享令牌桶
+  （scope 默认 "<RATE_LIMIT_SCOPE>:<名称>"），429 冷却只影响收到 429 的那个后端
+- 选择策略：
+  - "least_outstanding"（默认）：选 (在途请求数 + 1) / 权重 最小的后端，慢后端自然少分活
+  - "weighted_rr"：平滑加权轮询（nginx 算法），严格按权重比例分配
+- 健康跟踪：连接失败 / 超时 / 5xx 连续 FAIL_THRESHOLD 次，或 401/403（key 失效）一次，就熔断一段时间
+  （BREAKER_BASE * 2^(熔断次数-1)，最多 BREAKER_MAX 秒）；冷却 / 熔断中的后端不参与选择，
+  全部不可用时选最早恢复的那个，不会卡死；成功一次即恢复并清零计数
+- 解析失败、提前中止流式输出、取消等与后端无关的异常不计入健康状态
+
+配置（JSON 列表，文件路径或直接写 JSON，放在环境变量 YPROGRAM_BACKENDS 或脚本的 BACKENDS_PATH）：
+    [{"name": "ds-a", "base_url": "https://api.deepseek.com", "api_key_env": "DEEPSEEK_API_KEY_A",
+      "model": "deepseek-reasoner", "weight": 2, "rpm": 120, "tpm": 400000},
+     {"name": "ds-b", "base_url": "https://api.deepseek.com", "api_key": "sk-...", "weight": 1,
+      "models": {"deepseek-chat": "deepseek-v3"}, "json_mode": false}]
+"model" 是脚本主模型在该后端上的名字；"models" 把其他逻辑模型名（如模型级联的低档模型）映射到该后端上的名字，
+没写的模型名原样发送；"json_mode": false 表示该端点不接受 response_format（JSON mode），脚本对它只靠 prompt 约束格式。
+未配置时退化为单后端（脚本原来的 key / base_url / 限流 scope），行为与之前一致。
+
+用法：
+    pool = BackendPool(load_backends(path, default=Backend("default", base_url, key, scope="deepseek"), primary_model=MODEL))
+    with pool.lease() as backend:      # 选后端 + 在途计数；with 块的异常决定健康状态（异步用 async with）
+        backend.limiter.acquire(est)
+        resp = clients[backend.name].chat.completions.create(model=backend.model_for(MODEL), ...)
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from openai import APIConnectionError
+
+from rate_limiter import SharedRateLimiter, DEFAULT_RPM, DEFAULT_TPM, is_rate_limited, retry_after_seconds
+
+FAIL_THRESHOLD = 3
+BREAKER_BASE = 5.0
+BREAKER_MAX = 120.0
+STRATEGIES = ("least_outstanding", "weighted_rr")
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+def is_backend_failure(exc: BaseException) -> bool:
+    """连接失败 / 超时 / 5xx / 401 / 403 算后端故障；模型输出不合格之类的异常不算。"""
+    status = _status_code(exc)
+    if status is not None:
+        return status >= 500 or status in (401, 403)
+    return isinstance(exc, (APIConnectionError, asyncio.TimeoutError, TimeoutError, ConnectionError))
+
+
+class Backend:
+    def __init__(self, name: str, base_url: str, api_key: str, weight: float = 1.0,
+                 rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM, scope: Optional[str] = None,
+                 models: Optional[Dict[str, str]] = None, json_mode: bool = True):
+        if weight <= 0:
+            raise ValueError(f"后端 {name} 的 weight 必须大于 0")
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.models = dict(models or {})
+        self.json_mode = bool(json_mode)
+        self.weight = float(weight)
+        self.rpm = int(rpm)
+        self.tpm = int(tpm)
+        self.scope = scope or name
+        self._limiter: Optional[SharedRateLimiter] = None
+        # 以下由 BackendPool 在锁内维护
+        self.outstanding = 0
+        self.current_weight = 0.0
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.unavailable_until = 0.0
+        self.stats = {"requests": 0, "ok": 0, "failures": 0, "rate_limited": 0, "latency_sec": 0.0}
+
+    def model_for(self, model: str) -> str:
+        """逻辑模型名 -> 该后端上的实际模型名。"""
+        return self.models.get(model, model)
+
+    @property
+    def limiter(self) -> SharedRateLimiter:
+        if self._limiter is None:
+            self._limiter = SharedRateLimiter(scope=self.scope, rpm=self.rpm, tpm=self.tpm)
+        return self._limiter
+
+    def __repr__(self) -> str:
+        return f"Backend({self.name!r}, {self.base_url!r}, weight={self.weight:g})"
+
+
+def load_backends(source: Optional[str], default: Backend, scope_prefix: str = "",
+                  primary_model: Optional[str] = None) -> List[Backend]:
+    """
+    source 为 JSON 文件路径或 JSON 文本（None / 空时读环境变量 YPROGRAM_BACKENDS）；都没有时返回 [default]。
+    未写的字段取 default 的值；api_key_env 指定从哪个环境变量读 key，避免把 key 写进文件；
+    "model" 等价于 "models": {primary_model: ...}。
+    """
+    source = source or os.environ.get("YPROGRAM_BACKENDS", "")
+    if not source:
+        return [default]
+    text = str(source).strip()
+    if not text.startswith("["):
+        text = Path(text).read_text(encoding="utf-8")
+    backends = []
+    for i, item in enumerate(json.loads(text)):
+        name = item.get("name") or f"backend{i + 1}"
+        api_key = item.get("api_key") or os.environ.get(item.get("api_key_env", ""), "")
+        if not api_key:
+            raise RuntimeError(f"后端 {name} 没有 api_key（或 api_key_env 指向的环境变量为空）")
+        models = dict(item.get("models") or {})
+        if item.get("model") and primary_model:
+            models[primary_model] = item["model"]
+        backends.append(Backend(
+            name=name,
+            base_url=item.get("base_url", default.base_url),
+            api_key=api_key,
+            weight=item.get("weight", 1.0),
+            rpm=item.get("rpm", default.rpm),
+            tpm=item.get("tpm", default.tpm),
+            scope=item.get("scope") or (f"{scope_prefix}:{name}" if scope_prefix else name),
+            models=models,
+            json_mode=item.get("json_mode", default.json_mode),
+        ))
+    if len({b.name for b in backends}) != len(backends):
+        raise ValueError("后端名称重复")
+    return backends
+
+
+class BackendLease:
+    """pool.lease() 的返回值：进入时选定后端，退出时按异常类型更新健康状态与在途计数（同步 / 异步 with 均可）。"""
+
+    def __init__(self, pool: "BackendPool"):
+        self.pool = pool
+        self.backend: Optional[Backend] = None
+        self.started = 0.0
+
+    def __enter__(self) -> Backend:
+        self.backend = self.pool._pick()
+        self.started = time.perf_counter()
+        return self.backend
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        if exc is None:
+            self.pool._report(self.backend, elapsed, None)
+        elif isinstance(exc, Exception):
+            self.pool._report(self.backend, elapsed, exc)
+        else:
+            self.pool._release(self.backend)  # 取消 / Ctrl-C：不计入健康状态
+        return False
+
+    async def __aenter__(self) -> Backend:
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # 只有 429 需要写共享限流库，放到线程里做，其余情况纯内存更新
+        if isinstance(exc, Exception) and is_rate_limited(exc):
+            return await asyncio.to_thread(self.__exit__, exc_type, exc, tb)
+        return self.__exit__(exc_type, exc, tb)
+
+
+class BackendPool:
+    def __init__(self, backends: List[Backend], strategy: str = "least_outstanding"):
+        if not backends:
+            raise ValueError("后端池为空")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"未知的调度策略：{strategy}（可选 {', '.join(STRATEGIES)}）")
+        self.backends = list(backends)
+        self.strategy = strategy
+        self._rr = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.backends)
+
+    def lease(self) -> BackendLease:
+        return BackendLease(self)
+
+    # ---------- 选择 ----------
+    def _pick(self) -> Backend:
+        now = time.time()
+        with self._lock:
+            candidates = [b for b in self.backends if b.unavailable_until <= now] \
+                or [min(self.backends, key=lambda b: b.unavailable_until)]
+            if self.strategy == "weighted_rr":
+                backend = self._pick_weighted_rr(candidates)
+            else:
+                backend = self._pick_least_outstanding(candidates)
+            backend.outstanding += 1
+            backend.stats["requests"] += 1
+            return backend
+
+    def _pick_weighted_rr(self, candidates: List[Backend]) -> Backend:
+        total = sum(b.weight for b in candidates)
+        for b in candidates:
+            b.current_weight += b.weight
+        best = max(candidates, key=lambda b: b.current_weight)
+        best.current_weight -= total
+        return best
+
+    def _pick_least_outstanding(self, candidates: List[Backend]) -> Backend:
+        # 负载相同时轮流选，避免总是压在列表第一个后端上
+        self._rr += 1
+        n = len(candidates)
+        order = [candidates[(self._rr + i) % n] for i in range(n)]
+        return min(order, key=lambda b: (b.outstanding + 1) / b.weight)
+
+    # ---------- 结果回报 ----------
+    def _release(self, backend: Backend):
+        with self._lock:
+            backend.outstanding -= 1
+
+    def _report(self, backend: Backend, elapsed: float, exc: Optional[BaseException]):
+        cooldown = None
+        if exc is not None and is_rate_limited(exc):
+            # 共享限流器的冷却是跨进程的；池内同步记一份，选择时不用每次查 SQLite
+            cooldown = backend.limiter.report_rate_limited(retry_after_seconds(exc))
+        with self._lock:
+            backend.outstanding -= 1
+            if exc is None:
+                backend.stats["ok"] += 1
+                backend.stats["latency_sec"] += elapsed
+                if backend.consecutive_failures or backend.trips:
+                    backend.consecutive_failures = 0
+                    backend.trips = 0
+                return
+            if cooldown is not None:
+                backend.stats["rate_limited"] += 1
+                backend.unavailable_until = max(backend.unavailable_until, time.time() + cooldown)
+                return
+            if not is_backend_failure(exc):
+                return
+            backend.stats["failures"] += 1
+            backend.consecutive_failures += 1
+            status = _status_code(exc)
+            if backend.consecutive_failures < FAIL_THRESHOLD and status not in (401, 403):
+                return
+            backend.trips += 1
+            backend.consecutive_failures = 0
+            pause = min(BREAKER_MAX, BREAKER_BASE * (2 ** (backend.trips - 1)))
+            backend.unavailable_until = time.time() + pause
+        print(f"[POOL] 后端 {backend.name} 连续失败（最近一次：{type(exc).__name__}），熔断 {pause:.0f}s")
+
+    # ---------- 汇总 ----------
+    def summary(self) -> dict:
+        now = time.time()
+        with self._lock:
+            out = {"strategy": self.strategy, "backends": {}}
+            for b in self.backends:
+                s = dict(b.stats)
+                latency = s.pop("latency_sec")
+                s["mean_latency_sec"] = round(latency / s["ok"], 3) if s["ok"] else None
+                s["weight"] = b.weight
+                s["available"] = b.unavailable_until <= now
+                out["backends"][b.name] = s
+            return out
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+cancellation.py
+
+生成脚本的协作式取消（FinalScript v7 / converter 共用）：
+- CancelToken：线程安全的取消标志，worker 在开始单元前、重试等待中、流式读取的每个 chunk 之间检查
+- install_sigint_handler：第一次 Ctrl-C 只设置取消标志——不再调度新单元、在途请求尽快中止、
+  已完成的单元照常落盘并写出运行汇总；第二次 Ctrl-C 恢复默认行为立即退出
+- http_timeout：按 连接 / 读取 / 写入 超时构造 httpx.Timeout，传给 OpenAI 客户端；
+  读取超时是两次收到数据之间的最长间隔，整次调用的总时长另由脚本的 CALL_TIMEOUT 兜底
+
+用法：
+    CANCEL = CancelToken()
+    install_sigint_handler(CANCEL)
+    CANCEL.raise_if_cancelled()
+    if CANCEL.wait(backoff):   # 代替 time.sleep，取消时立即返回 True
+        break
+"""
+import signal
+import threading
+from typing import Optional
+
+import httpx
+
+
+class Cancelled(Exception):
+    """取消标志已设置时由 raise_if_cancelled 抛出。"""
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+    def wait(self, timeout: float) -> bool:
+        """最多睡 timeout 秒；期间被取消则立即返回 True。"""
+        return self._event.wait(timeout)
+
+
+def install_sigint_handler(token: CancelToken, message: str = "收到中断信号：不再调度新单元，正在收尾（再按一次 Ctrl-C 立即退出）"):
+    """只能在主线程调用；返回原来的处理函数。"""
+    previous = signal.getsignal(signal.SIGINT)
+
+    def _handler(signum, frame):
+        if token.cancelled:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            raise KeyboardInterrupt
+        print(f"\n[CANCEL] {message}")
+        token.cancel("SIGINT")
+
+    signal.signal(signal.SIGINT, _handler)
+    return previous
+
+
+def http_timeout(connect: float, read: float, write: float = 30.0) -> httpx.Timeout:
+    return httpx.Timeout(connect=connect, read=read, write=write, pool=connect)
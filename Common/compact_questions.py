@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+compact_questions.py
+
+题目的紧凑输出格式（FinalScript v7 的 OUTPUT_FORMAT="compact" 使用），在本地展开为标准结构：
+- 模型输出的 token 数决定了 reasoner 的大部分耗时；标准格式里重复的字段名和
+  {"type":"code_inline","parts":[{"type":"code","value":...},{"type":"slot","index":0}]} 这样的嵌套占了很大比例
+- 紧凑格式中每道题是一个按位置排列的数组，第一个元素是题型标记：
+    选择题：["c", id, title, content, options, answer, hints, explanation, example]
+    填空题：["f", id, title, content, input, output, code, options, answer, explanation, example]
+- 填空题的 code 是字符串数组，一项一行；行内用 __0__、__1__ …… 表示挖空（数字即 slot 的 index）：
+  - 不含挖空的连续行展开为一个 code_block（每行一个 code_line）
+  - 含挖空的行展开为一个 code_inline，按挖空切成 code / slot 片段（不产生空的 code 片段）
+  - 以下两种写法只在标准结构无法用上面的规则还原时由 compact_question 产生，模型一般不需要输出：
+    null 项结束当前 code_block（两个相邻的 code_block 写成 [...行, null, ...行]，前端每个块带下边距，合并会改变排版）；
+    数组项是逐个片段写出的 code_inline，字符串为 code 片段、整数为 slot（没有挖空、含空片段或相邻 code 片段的行）
+- expand_question / expand_questions：紧凑数组 -> 标准题目 dict（已经是 dict 的题目原样返回，两种格式可以混在一个数组里）；
+  展开结果与 normalize_fill_code_field、question_validator、SQL 导出期望的结构完全一致
+- compact_question：标准题目 -> 紧凑数组（mock 服务与回归检查使用）；无法无损表示的题目（如 code_block 里混入 slot）抛 CompactFormatError
+
+两种格式的等价关系：标准结构经过 compact_question -> expand_question 一次来回后完全相同
+（tests/test_compact_questions.py 对语料逐题检查）；只有结构校验本来就不接受的写法
+（code_block 里混入 slot / code_inline 等）无法写成紧凑格式，抛 CompactFormatError。
+
+命令行：python compact_questions.py <json 文件或目录>...，对已有题目做来回检查并估算输出 token 的节省。
+"""
+import re
+import sys
+import json
+import argparse
+from pathlib import Path
+from typing import Any, List
+
+from question_validator import CODE_KEYS
+from rate_limiter import estimate_tokens
+
+CHOICE_FIELDS = ("id", "title", "content", "options", "answer", "hints", "explanation", "example")
+FILL_FIELDS = ("id", "title", "content", "input", "output", "code", "options", "answer", "explanation", "example")
+TAGS = {"c": "choice", "f": "fill", "choice": "choice", "fill": "fill"}
+FIELDS = {"choice": CHOICE_FIELDS, "fill": FILL_FIELDS}
+SLOT_RE = re.compile(r"__(\d+)__")
+COMPACT_PROMPT_MARKER = "紧凑格式"   # 紧凑格式的 system prompt 必须包含这个词（mock 服务据此切换输出格式）
+
+
+class CompactFormatError(ValueError):
+    """紧凑格式无法展开，或标准结构无法无损写成紧凑格式。"""
+
+
+def is_compact(item: Any) -> bool:
+    return isinstance(item, list) and bool(item) and isinstance(item[0], str) and item[0] in TAGS
+
+
+# ----------------------------
+# ========== 展开 ==========
+# ----------------------------
+def expand_code(lines: Any) -> dict:
+    """["for i in range(3):", "    print(__0__)"] -> {"segments": [code_block, code_inline]}。"""
+    if isinstance(lines, str):
+        lines = lines.split("\n")
+    if not isinstance(lines, list):
+        raise CompactFormatError(f"code 必须是字符串数组，实际为 {type(lines).__name__}")
+    segments = []
+    block = None
+    for line in lines:
+        if line is None:
+            block = None
+            continue
+        if isinstance(line, list):
+            block = None
+            segments.append({"type": "code_inline", "parts": [_expand_part(p) for p in line]})
+            continue
+        if not isinstance(line, str):
+            raise CompactFormatError(f"code 的每一项必须是字符串，实际为 {type(line).__name__}")
+        pieces = SLOT_RE.split(line)
+        if len(pieces) == 1:
+            if block is None:
+                block = {"type": "code_block", "lines": []}
+                segments.append(block)
+            block["lines"].append({"type": "code_line", "value": line})
+            continue
+        block = None
+        parts = []
+        for k, piece in enumerate(pieces):
+            if k % 2:
+                parts.append({"type": "slot", "index": int(piece)})
+            elif piece:
+                parts.append({"type": "code", "value": piece})
+        segments.append({"type": "code_inline", "parts": parts})
+    return {"segments": segments}
+
+def _expand_part(part: Any) -> dict:
+    if isinstance(part, bool) or not isinstance(part, (str, int)):
+        raise CompactFormatError(f"code_inline 片段必须是字符串或整数，实际为 {type(part).__name__}")
+    return {"type": "code", "value": part} if isinstance(part, str) else {"type": "slot", "index": part}
+
+def expand_question(item: Any) -> Any:
+    """紧凑数组 -> 标准题目 dict；dict 原样返回。缺少的尾部字段不补，交给校验器报告。"""
+    if isinstance(item, dict):
+        return item
+    if not is_compact(item):
+        raise CompactFormatError("不是紧凑格式的题目数组")
+    q_type = TAGS[item[0]]
+    fields = FIELDS[q_type]
+    values = item[1:]
+    if len(values) > len(fields):
+        raise CompactFormatError(f"{q_type} 题应有 {len(fields)} 个字段，实际 {len(values)} 个")
+    q = {"id": values[0] if values else None, "type": q_type}
+    for name, value in zip(fields[1:], values[1:]):
+        if name == "code":
+            q["code_segments"] = None if value is None else expand_code(value)
+        else:
+            q[name] = value
+    return q
+
+def expand_questions(items: List[Any]) -> List[Any]:
+    """逐题展开；单题展开失败时保留原样，由结构校验把它当作坏题交给逐题修复。"""
+    out = []
+    for item in items:
+        try:
+            out.append(expand_question(item) if is_compact(item) else item)
+        except CompactFormatError:
+            out.append(item)
+    return out
+
+
+# ----------------------------
+# ========== 压缩 ==========
+# ----------------------------
+def _segments(code: Any) -> list:
+    if isinstance(code, str):
+        try:
+            code = json.loads(code)
+        except ValueError:
+            raise CompactFormatError("code_segments 是无法解析的字符串")
+    if isinstance(code, dict) and "segments" not in code and "type" in code:
+        code = {"segments": [code]}
+    if isinstance(code, list):
+        code = {"segments": code}
+    if not (isinstance(code, dict) and isinstance(code.get("segments"), list)):
+        raise CompactFormatError("code_segments 不是 {segments: [...]} 结构")
+    return code["segments"]
+
+def _plain(value: Any) -> str:
+    if not isinstance(value, str):
+        raise CompactFormatError(f"代码片段必须是字符串，实际为 {type(value).__name__}")
+    if SLOT_RE.search(value):
+        raise CompactFormatError(f"代码中本身含有挖空标记：{value!r}")
+    return value
+
+def _compact_inline(seg: dict) -> Any:
+    """能由一行字符串原样展开回来时写成字符串，否则逐个片段写成数组。"""
+    raw = []
+    for part in seg.get("parts") or []:
+        part_type = part.get("type") if isinstance(part, dict) else None
+        if part_type == "code" and isinstance(part.get("value"), str):
+            raw.append(part["value"])
+        elif part_type == "slot" and isinstance(part.get("index"), int) and not isinstance(part["index"], bool):
+            raw.append(part["index"])
+        else:
+            raise CompactFormatError(f"code_inline 中出现了无法识别的片段：{part!r}")
+    line = "".join(p if isinstance(p, str) else f"__{p}__" for p in raw)
+    if expand_code([line])["segments"] == [{"type": "code_inline", "parts": [_expand_part(p) for p in raw]}]:
+        return line
+    return raw
+
+def compact_code(code: Any) -> List[Any]:
+    lines = []
+    previous = None
+    for seg in _segments(code):
+        seg_type = seg.get("type") if isinstance(seg, dict) else None
+        if seg_type == "code_block":
+            if previous == "code_block":
+                lines.append(None)
+            for line in seg.get("lines") or []:
+                if not (isinstance(line, dict) and line.get("type") == "code_line"):
+                    raise CompactFormatError("code_block 的 lines 中出现了 code_line 以外的元素")
+                lines.append(_plain(line.get("value")))
+        elif seg_type == "code_inline":
+            lines.append(_compact_inline(seg))
+        else:
+            raise CompactFormatError(f"未知的 segment 类型：{seg_type!r}")
+        previous = seg_type
+    return lines
+
+def compact_question(q: dict) -> list:
+    q_type = str(q.get("type") or "").strip().lower()
+    if q_type == "choice":
+        return ["c"] + [q.get(name) for name in CHOICE_FIELDS]
+    if q_type == "fill":
+        code = next((q[k] for k in CODE_KEYS if k in q), None)
+        return ["f"] + [compact_code(code) if name == "code" else q.get(name) for name in FILL_FIELDS]
+    raise CompactFormatError(f"未知题型 type={q.get('type')!r}")
+
+def dumps_compact(questions: List[dict]) -> str:
+    """紧凑格式的输出文本：一道题一行（与提示词中的示例排版一致）。"""
+    return "[\n" + ",\n".join(json.dumps(compact_question(q), ensure_ascii=False) for q in questions) + "\n]"
+
+
+# ----------------------------
+# ========== 命令行 ==========
+# ----------------------------
+def _same_question(q: dict, back: dict) -> bool:
+    for name in FIELDS.get(str(q.get("type")), ()):
+        if name == "code":
+            if _segments(next((q[k] for k in CODE_KEYS if k in q), None)) != back["code_segments"]["segments"]:
+                return False
+        elif q.get(name) != back.get(name):
+            return False
+    return True
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="紧凑格式来回检查：标准题目 -> 紧凑 -> 标准，并估算输出 token 的节省")
+    ap.add_argument("paths", nargs="+", help="JSON 文件或目录（目录下递归查找 *.json）")
+    args = ap.parse_args(argv)
+
+    files: List[Path] = []
+    for p in map(Path, args.paths):
+        files.extend(sorted(p.rglob("*.json")) if p.is_dir() else [p])
+    total = skipped = mismatched = 0
+    verbose_tokens = compact_tokens = 0
+    for f in files:
+        with open(f, "r", encoding="utf-8") as fh:
+            data = json.load(fh)
+        questions = data.get("questions", data) if isinstance(data, dict) else data
+        if not isinstance(questions, list):
+            continue
+        kept = []
+        for q in questions:
+            if not isinstance(q, dict):
+                continue
+            total += 1
+            try:
+                back = expand_question(json.loads(json.dumps(compact_question(q), ensure_ascii=False)))
+            except CompactFormatError as e:
+                skipped += 1
+                print(f"⏭️ {f} 第 {q.get('id')} 题无法写成紧凑格式：{e}")
+                continue
+            if not _same_question(q, back):
+                mismatched += 1
+                print(f"❌ {f} 第 {q.get('id')} 题来回后不一致")
+            kept.append(q)
+        if kept:
+            verbose_tokens += estimate_tokens(json.dumps(kept, ensure_ascii=False, indent=2))
+            compact_tokens += estimate_tokens(dumps_compact(kept))
+    print(f"检查 {total} 道题：{mismatched} 道来回不一致，{skipped} 道无法写成紧凑格式")
+    if verbose_tokens:
+        print(f"估算输出 token：标准格式 {verbose_tokens}，紧凑格式 {compact_tokens}"
+              f"（{compact_tokens / verbose_tokens:.0%}）")
+    return 1 if mismatched else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
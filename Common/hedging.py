@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+hedging.py
+
+asyncio 请求对冲（hedged requests），用于压低 reasoner 等慢模型的尾延迟：
+- HedgePolicy 记录本次运行中已完成调用的耗时，实时计算第 P 百分位作为对冲阈值
+  （样本少于 min_samples 时不对冲，避免用几条样本拍脑袋）
+- 主请求超过阈值仍未返回时再发一份副本，两者谁先“成功”（由调用方的协程自己保证结果合法，
+  例如 JSON 能解析）就用谁，另一份立即取消；先结束的那份如果失败，继续等另一份
+- 额外请求数受 max_extra_fraction 限制：对冲次数不超过已发主请求数 × 该比例
+
+用法：
+    policy = HedgePolicy(percentile=90, max_extra_fraction=0.1)
+    result, info = await run_hedged(lambda copy: call_and_parse(copy), policy)
+    if not info["hedged"] and not cached:
+        policy.observe(info["elapsed"])
+"""
+import time
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from llm_metrics import percentile
+
+
+class HedgePolicy:
+    def __init__(self, percentile: float = 90, min_samples: int = 5, max_extra_fraction: float = 0.1,
+                 min_delay: float = 1.0, window: int = 200):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_extra_fraction = max_extra_fraction
+        self.min_delay = min_delay
+        self.window = window
+        self.samples: List[float] = []
+        self.primaries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed: float):
+        """记录一次正常完成（未命中缓存）的调用耗时；只保留最近 window 条。"""
+        with self._lock:
+            self.samples.append(elapsed)
+            if len(self.samples) > self.window:
+                del self.samples[0]
+
+    def delay(self) -> Optional[float]:
+        """当前对冲阈值（秒）；样本不足时为 None（不对冲）。"""
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            return max(self.min_delay, percentile(self.samples, self.percentile))
+
+    def try_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.max_extra_fraction * self.primaries:
+                return False
+            self.hedges += 1
+            return True
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {"primaries": self.primaries, "hedges": self.hedges, "hedge_wins": self.hedge_wins,
+                    "extra_fraction": round(self.hedges / self.primaries, 3) if self.primaries else 0.0,
+                    "threshold_sec": None if len(self.samples) < self.min_samples
+                    else round(max(self.min_delay, percentile(self.samples, self.percentile)), 3)}
+
+
+async def _cancel_all(tasks):
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run_hedged(make_call: Callable[[int], Awaitable[Any]], policy: Optional[HedgePolicy]) -> Tuple[Any, dict]:
+    """
+    make_call(copy) 返回协程：copy=0 为主请求，copy=1 为对冲副本。
+    返回 (先成功的结果, {"hedged", "winner", "elapsed"})；两份都失败时抛出先失败那份的异常。
+    """
+    started = time.perf_counter()
+    if policy is None:
+        return await make_call(0), {"hedged": False, "winner": 0, "elapsed": time.perf_counter() - started}
+
+    with policy._lock:
+        policy.primaries += 1
+    primary = asyncio.ensure_future(make_call(0))
+    tasks = {primary: 0}
+    try:
+        # 阈值随运行实时变化：样本不足时每 min_delay 秒重新看一次，超过阈值且预算允许才发副本
+        while not primary.done():
+            delay = policy.delay()
+            remaining = policy.min_delay if delay is None else delay - (time.perf_counter() - started)
+            if remaining <= 0:
+                if policy.try_hedge():
+                    tasks[asyncio.ensure_future(make_call(1))] = 1
+                break
+            await asyncio.wait({primary}, timeout=remaining)
+        errors = []
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    await _cancel_all(pending)
+                    winner = tasks[t]
+                    if winner:
+                        with policy._lock:
+                            policy.hedge_wins += 1
+                    return t.result(), {"hedged": len(tasks) > 1, "winner": winner,
+                                        "elapsed": time.perf_counter() - started}
+                errors.append(t.exception())
+        raise errors[0]
+    except asyncio.CancelledError:
+        await _cancel_all([t for t in tasks if not t.done()])
+        raise
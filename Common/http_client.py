@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+http_client.py
+
+所有生成脚本共用的 HTTP 客户端工厂（FinalScript / generate_questions / converter / transformer / library_generate）：
+- 每个 (base_url, api_key, 连接池大小, HTTP/2) 组合在进程内只建一个客户端，之后复用同一个 keep-alive 连接池：
+  DNS 解析与 TLS 握手只在建立连接时发生一次，不再出现在每次请求的耗时里
+- 连接池大小跟随脚本配置的并发数（线程数 / 异步并发上限），keep-alive 连接数与之相同，空闲连接保留 KEEPALIVE_EXPIRY 秒
+- http2=True 时需要安装 h2（pip install httpx[http2]）；没装时打印一次提示并回退到 HTTP/1.1
+- AsyncOpenAI 的连接池绑定事件循环，不做缓存：每次 asyncio.run 内用 async_openai_client() 新建、结束时 close()
+- 默认 max_retries=0：SDK 不自行重试，429 与 5xx / 连接中断等瞬时故障由 SharedRateLimiter.call
+  或脚本自己的重试循环（FinalScript 的 RetryBudget）统一处理，避免两层重试叠加、绕过共享冷却
+- requests_session()：给仍用 requests 的脚本一个带同样大小连接池的 Session（requests 为可选依赖，调用时才导入）
+
+用法：
+    client = openai_client(API_KEY, BASE_URL, max_connections=MAX_WORKERS, timeout=http_timeout(10, 300))
+    aclient = async_openai_client(API_KEY, BASE_URL, max_connections=ASYNC_MAX_CONCURRENCY)
+"""
+import threading
+import importlib.util
+from typing import Optional, Union
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+KEEPALIVE_EXPIRY = 60.0
+DEFAULT_TIMEOUT = httpx.Timeout(connect=10.0, read=300.0, write=30.0, pool=10.0)
+
+_clients = {}
+_sessions = {}
+_lock = threading.Lock()
+_http2_warned = False
+
+
+def _http2_available(http2: bool) -> bool:
+    global _http2_warned
+    if not http2:
+        return False
+    if importlib.util.find_spec("h2") is not None:
+        return True
+    if not _http2_warned:
+        print("[HTTP] 未安装 h2（pip install httpx[http2]），回退到 HTTP/1.1")
+        _http2_warned = True
+    return False
+
+def _limits(max_connections: int) -> httpx.Limits:
+    n = max(1, int(max_connections))
+    return httpx.Limits(max_connections=n, max_keepalive_connections=n, keepalive_expiry=KEEPALIVE_EXPIRY)
+
+Timeout = Union[httpx.Timeout, float, None]
+
+
+def openai_client(api_key: str, base_url: str, max_connections: int = 10, timeout: Timeout = None,
+                  http2: bool = False, max_retries: int = 0) -> OpenAI:
+    """进程内共享的同步 OpenAI 客户端（线程安全，可被线程池中所有 worker 共用）。"""
+    key = ("openai", base_url, api_key, int(max_connections), bool(http2))
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            http_client = httpx.Client(limits=_limits(max_connections), http2=_http2_available(http2),
+                                       timeout=timeout or DEFAULT_TIMEOUT)
+            client = OpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries,
+                            timeout=timeout or DEFAULT_TIMEOUT, http_client=http_client)
+            _clients[key] = client
+        return client
+
+
+def async_openai_client(api_key: str, base_url: str, max_connections: int = 50, timeout: Timeout = None,
+                        http2: bool = False, max_retries: int = 0) -> AsyncOpenAI:
+    """新建一个带连接池的 AsyncOpenAI 客户端；调用方负责在同一事件循环里 await client.close()。"""
+    http_client = httpx.AsyncClient(limits=_limits(max_connections), http2=_http2_available(http2),
+                                    timeout=timeout or DEFAULT_TIMEOUT)
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries,
+                       timeout=timeout or DEFAULT_TIMEOUT, http_client=http_client)
+
+
+def requests_session(max_connections: int = 10, headers: Optional[dict] = None):
+    """进程内共享的 requests.Session，连接池大小 = max_connections。"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    n = max(1, int(max_connections))
+    key = (n, tuple(sorted((headers or {}).items())))
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=n, pool_maxsize=n, pool_block=True)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update(headers or {})
+            _sessions[key] = session
+        return session
+
+
+def close_all():
+    """关闭所有共享的同步客户端 / Session（脚本结束时可选调用）。"""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        for session in _sessions.values():
+            session.close()
+        _clients.clear()
+        _sessions.clear()
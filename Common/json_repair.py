@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+json_repair.py
+
+模型输出 JSON 的本地修复（FinalScript v7 / converter / TXTtoJSONscript 共用）：
+- repair_json：逐字符扫描一遍（线性时间，不做整段正则替换），按所在位置（键 / 对象的值 / 数组元素）修复常见缺陷，
+  返回 (修复后的文本, {修复类别: 次数})：
+  - "fence" / "leading_text" / "trailing_text"：``` 围栏、JSON 前后的说明文字（从第一个 { 或 [ 开始，到与之配对的括号结束；
+    从这里开始的结构不像 JSON 时（见 bare_word），改从其后的下一个 { 或 [ 开始）
+  - "comment"：字符串外的 // 、/* */ 与 # 注释
+  - "trailing_comma" / "extra_comma" / "missing_comma" / "missing_colon"：多余、重复、缺少的逗号与冒号
+  - "fullwidth_quote" / "fullwidth_punct"：字符串外用 “” ‘’ 作引号、用全角冒号 / 逗号作分隔符
+  - "single_quote" / "python_literal" / "unquoted_key" / "bare_word"：Python 风格的单引号字符串、True/False/None、
+    没有引号的键、没有引号的字符串值。没有引号的词只在所在的对象 / 数组里已经有 JSON 成分（带引号的字符串、数字、
+    true/false/null、键值对或合法的子结构）时才加引号：说明文字里的“[注意]”不会被当成 ["注意"]
+  - "inner_quote"：字符串里未转义的双引号。引号后面（跳过空白）紧跟的字符符合当前位置的结束方式时才算字符串结束
+    （键后面是冒号；对象的值后面是 } 或“逗号 + 下一个键”；数组元素后面是 ] 或“逗号 + 下一个值”），否则视为内容并转义。
+    值以 { 或 [ 开头、内部用裸引号（如提示词示例里写成字符串的 code_segment）时按内嵌 JSON 处理：
+    括号配对结束之前的引号都是内容，内嵌文本原样保留（引号与反斜杠转义），之后仍由 normalize_fill_code_field 解析
+  - "control_char" / "bad_escape"：字符串里的原始换行 / 制表符、JSON 不认识的反斜杠转义（如 \\d、\\'）
+  - "unterminated_string" / "unclosed_bracket" / "mismatched_bracket" / "stray_bracket" / "missing_value" / "stray_char"：
+    输入在字符串或括号内结束时补齐、括号不配对、键后面缺少值、无法识别的字符
+  每个字符串的 inner_quote / control_char / bad_escape 只计一次
+- parse_json_tolerant：先直接 json.loads（合法 JSON 没有额外开销），失败再修复后解析；返回 (对象, 修复记录)，
+  修复后仍无法解析、或截取的 JSON 不到全文（不计空白与围栏）的 MIN_SPAN_FRACTION 时抛 JSONRepairError
+  （ValueError 的子类，带修复记录）。例如 "d = {'a': 1}\nprint(d)" 是代码而不是带说明文字的 JSON
+- format_fixes：修复记录 -> “inner_quote=1, trailing_comma=2”
+- EXTRACTION_FIXES：只是截取了 JSON 前后文字的修复类别（用于区分“截取”和“修复”）
+
+命令行：python json_repair.py <文件或目录>...，统计 *.json / *.txt 中直接可解析、修复后可解析与仍失败的文件数及各类修复次数。
+"""
+import re
+import sys
+import json
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+EXTRACTION_FIXES = frozenset({"fence", "leading_text", "trailing_text"})
+
+# 截取的 JSON（不计空白）至少占全文的比例，低于此值视为“文字里顺带出现了括号”而不是带说明文字的 JSON
+MIN_SPAN_FRACTION = 0.5
+
+_CLOSERS = {'"': '"', "'": "'", "“": "”\"", "‘": "’'"}
+_WORD_RE = re.compile(r"[\w.+\-]+")
+_NUMBER_RE = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+\-]?\d+)?")
+_KEY_AHEAD_RE = re.compile(r"\s*(?:\"[^\"\n]*\"|'[^'\n]*'|“[^”\n]*”|[A-Za-z_]\w*)\s*[:：]")
+_HEX4_RE = re.compile(r"[0-9a-fA-F]{4}")
+_LITERALS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+_VALUE_START = set("\"'“‘{[-0123456789")
+_WHITESPACE = " \t\r\n﻿"
+
+
+class JSONRepairError(ValueError):
+    """修复后仍不是合法 JSON；fixes 为已做的修复。"""
+
+    def __init__(self, message: str, fixes: Dict[str, int]):
+        super().__init__(message)
+        self.fixes = fixes
+
+
+class _Repairer:
+    def __init__(self, text: str, start: int):
+        self.s = text
+        self.n = len(text)
+        self.start = start
+        self.end = self.n                  # 截取的 JSON 在原文中的结束位置
+        self.out: List[str] = []
+        self.fixes: Dict[str, int] = {}
+        self.stack: List[List[str]] = []   # [开括号, 状态]；对象：key / colon / value / after，数组：value / after
+        self.marks: List[List[bool]] = []  # 与 stack 对应：[有 JSON 成分, 有无引号的值]
+        self.comma_at: Optional[int] = None  # 还没确认的逗号在 out 中的位置（遇到右括号时删掉）
+        self.done = False
+        self.rejected = False              # 某个对象 / 数组只有无引号的值：从 start 开始的不是 JSON
+
+    def fix(self, kind: str, n: int = 1):
+        self.fixes[kind] = self.fixes.get(kind, 0) + n
+
+    # ---------- 位置 ----------
+    def _skip_ws(self, j: int) -> int:
+        while j < self.n and self.s[j] in _WHITESPACE:
+            j += 1
+        return j
+
+    def _ctx(self) -> str:
+        if not self.stack:
+            return "top"
+        kind, state = self.stack[-1]
+        if kind == "[":
+            return "item"
+        return "key" if state == "key" else "value"
+
+    def _closes(self, j: int) -> bool:
+        """j 为候选结束引号之后的位置：后面的内容符合当前位置的结束方式时引号才算结束字符串。"""
+        ctx = self._ctx()
+        k = self._skip_ws(j)
+        if ctx == "top" or k >= self.n:
+            return True
+        c = self.s[k]
+        if ctx == "key":
+            return c in ":："
+        if c == "/" and self.s.startswith(("//", "/*"), k):
+            return True
+        if c in "}]":
+            if c != ("}" if ctx == "value" else "]"):
+                return False
+            k2 = self._skip_ws(k + 1)
+            return k2 >= self.n or self.s[k2] in ",，}]`#/"
+        if c in ",，":
+            k2 = self._skip_ws(k + 1)
+            if k2 >= self.n:
+                return True
+            if ctx == "value":
+                return self.s[k2] == "}" or bool(_KEY_AHEAD_RE.match(self.s, k + 1))
+            return self.s[k2] in "]" or self.s[k2] in _VALUE_START or self.s[k2].isalpha()
+        # 缺逗号：换行之后紧跟下一个键 / 元素
+        if "\n" in self.s[j:k] and c in "\"“'":
+            return ctx == "item" or bool(_KEY_AHEAD_RE.match(self.s, k))
+        return False
+
+    # ---------- 结构 ----------
+    def _before_value(self):
+        if not self.stack:
+            return
+        frame = self.stack[-1]
+        if frame[1] == "after":
+            self.fix("missing_comma")
+            self.out.append(",")
+            frame[1] = "key" if frame[0] == "{" else "value"
+        elif frame[1] == "colon":
+            self.fix("missing_colon")
+            self.out.append(":")
+            frame[1] = "value"
+        self.comma_at = None
+
+    def _after_value(self):
+        if not self.stack:
+            self.done = True
+            return
+        frame = self.stack[-1]
+        frame[1] = "colon" if frame[0] == "{" and frame[1] == "key" else "after"
+
+    def _comma(self, c: str):
+        if c != ",":
+            self.fix("fullwidth_punct")
+        if self.stack and self.stack[-1][1] == "after":
+            frame = self.stack[-1]
+            frame[1] = "key" if frame[0] == "{" else "value"
+            self.comma_at = len(self.out)
+            self.out.append(",")
+        else:
+            self.fix("extra_comma")
+
+    def _colon(self, c: str):
+        if c != ":":
+            self.fix("fullwidth_punct")
+        if self.stack and self.stack[-1] == ["{", "colon"]:
+            self.stack[-1][1] = "value"
+            self.marks[-1][0] = True
+            self.out.append(":")
+        else:
+            self.fix("stray_char")
+
+    def _evidence(self):
+        """当前对象 / 数组里出现了真正的 JSON 成分。"""
+        if self.marks:
+            self.marks[-1][0] = True
+
+    def _pop(self):
+        kind, state = self.stack.pop()
+        evidence, bare = self.marks.pop()
+        if bare and not evidence:
+            self.rejected = True
+        if kind == "{" and state in ("colon", "value"):
+            self.fix("missing_value")
+            self.out.append(":null" if state == "colon" else "null")
+        self.out.append("}" if kind == "{" else "]")
+        self._evidence()
+        self._after_value()
+
+    def _close(self, c: str):
+        if self.comma_at is not None:
+            self.out[self.comma_at] = ""
+            self.comma_at = None
+            self.fix("trailing_comma")
+        opener = "{" if c == "}" else "["
+        if not any(kind == opener for kind, _ in self.stack):
+            self.fix("stray_bracket")
+            return
+        while self.stack[-1][0] != opener:
+            self.fix("mismatched_bracket")
+            self._pop()
+        self._pop()
+
+    # ---------- 记号 ----------
+    def _comment(self, i: int) -> int:
+        self.fix("comment")
+        if self.s.startswith("/*", i):
+            end = self.s.find("*/", i + 2)
+            return self.n if end == -1 else end + 2
+        end = self.s.find("\n", i)
+        return self.n if end == -1 else end
+
+    def _word(self, i: int) -> int:
+        word = _WORD_RE.match(self.s, i).group()
+        ctx = self._ctx()
+        if ctx == "key" or (self.stack and self.stack[-1] == ["{", "after"]):
+            self._before_value()
+            self.fix("unquoted_key")
+            self.out.append(json.dumps(word, ensure_ascii=False))
+            self.marks[-1][1] = True
+        else:
+            self._before_value()
+            if word in _LITERALS:
+                if word != _LITERALS[word]:
+                    self.fix("python_literal")
+                self.out.append(_LITERALS[word])
+                self._evidence()
+            elif _NUMBER_RE.fullmatch(word):
+                self.out.append(word)
+                self._evidence()
+            else:
+                self.fix("bare_word")
+                self.out.append(json.dumps(word, ensure_ascii=False))
+                if self.marks:
+                    self.marks[-1][1] = True
+        self._after_value()
+        return i + len(word)
+
+    def _string(self, i: int) -> int:
+        s, n, out = self.s, self.n, self.out
+        opener = s[i]
+        closers = _CLOSERS[opener]
+        if opener in "“‘":
+            self.fix("fullwidth_quote")
+        elif opener == "'":
+            self.fix("single_quote")
+        ctx = self._ctx()
+        embedded = ctx != "key" and i + 1 < n and s[i + 1] in "{["
+        bare: Optional[bool] = None   # 内嵌 JSON 用裸引号（True）还是 \" （False）作引号；见到第一个引号时确定
+        depth, inner = 0, False
+        seen = set()
+        out.append('"')
+        j = i + 1
+        while j < n:
+            ch = s[j]
+            if ch == "\\":
+                nxt = s[j + 1] if j + 1 < n else ""
+                if embedded and bare:
+                    out.append("\\\\")   # 内嵌文本中的反斜杠原样保留
+                    if nxt == '"':
+                        out.append('\\"')
+                        j += 1
+                    j += 1
+                    continue
+                if nxt == '"' and embedded and depth > 0:
+                    bare = False if bare is None else bare
+                    inner = not inner
+                if nxt and nxt in "\"\\/bfnrt":
+                    out.append(ch + nxt)
+                    j += 2
+                elif nxt == "u" and _HEX4_RE.match(s, j + 2):
+                    out.append(s[j:j + 6])
+                    j += 6
+                elif nxt == "'":
+                    seen.add("bad_escape")
+                    out.append("'")
+                    j += 2
+                else:
+                    seen.add("bad_escape")
+                    out.append("\\\\")
+                    j += 1
+                continue
+            if embedded and not inner:
+                if ch in "{[":
+                    depth += 1
+                elif ch in "}]":
+                    depth = max(0, depth - 1)
+            if ch == '"' and embedded and depth > 0:
+                if bare is None:
+                    bare = True
+                if bare:
+                    inner = not inner
+                    if opener == '"':
+                        seen.add("inner_quote")
+                    out.append('\\"')
+                    j += 1
+                    continue
+            if ch in closers and not inner and self._closes(j + 1):
+                for kind in seen:
+                    self.fix(kind)
+                out.append('"')
+                return j + 1
+            if ch == '"':
+                if opener == '"':
+                    seen.add("inner_quote")
+                out.append('\\"')
+            elif ch == "\n":
+                seen.add("control_char")
+                out.append("\\n")
+            elif ch == "\t":
+                seen.add("control_char")
+                out.append("\\t")
+            elif ch == "\r":
+                seen.add("control_char")
+                out.append("\\r")
+            elif ord(ch) < 0x20:
+                seen.add("control_char")
+                out.append(f"\\u{ord(ch):04x}")
+            else:
+                out.append(ch)
+            j += 1
+        for kind in seen:
+            self.fix(kind)
+        self.fix("unterminated_string")
+        out.append('"')
+        return n
+
+    # ---------- 主循环 ----------
+    def run(self) -> Tuple[str, Dict[str, int]]:
+        """从 start 处的 { 或 [ 开始扫描；rejected 时 end 为被拒绝的结构之后的位置。"""
+        s, n = self.s, self.n
+        i = self.start
+        self._skipped(s[:i], "leading_text")
+        while i < n:
+            c = s[i]
+            if self.rejected:
+                self.end = i
+                return s, self.fixes
+            if c in _WHITESPACE:
+                if c != "﻿":
+                    self.out.append(c)
+                i += 1
+            elif self.done:
+                self.end = i
+                self._skipped(s[i:], "trailing_text")
+                break
+            elif c == "/" and s.startswith(("//", "/*"), i) or c == "#":
+                i = self._comment(i)
+            elif c in ",，":
+                self._comma(c)
+                i += 1
+            elif c in ":：":
+                self._colon(c)
+                i += 1
+            elif c in "}]":
+                self._close(c)
+                i += 1
+            elif c in "{[":
+                self._before_value()
+                self.stack.append([c, "key" if c == "{" else "value"])
+                self.marks.append([False, False])
+                self.out.append(c)
+                i += 1
+            elif c in _CLOSERS:
+                self._before_value()
+                i = self._string(i)
+                self._evidence()
+                self._after_value()
+            elif c == "-" or c.isalnum() or c == "_":
+                i = self._word(i)
+            elif c == "`":
+                self.fix("fence")
+                end = s.find("\n", i)
+                i = n if end == -1 else end
+            else:
+                self.fix("stray_char")
+                i += 1
+        if self.stack:
+            if self.comma_at is not None:
+                self.out[self.comma_at] = ""
+            self.fix("unclosed_bracket", len(self.stack))
+            while self.stack:
+                self._pop()
+        return "".join(self.out), self.fixes
+
+    def _skipped(self, text: str, kind: str):
+        if "```" in text:
+            self.fix("fence")
+            text = re.sub(r"```\w*", "", text)
+        if text.strip(_WHITESPACE):
+            self.fix(kind)
+
+
+def _repair(text: str) -> Optional[_Repairer]:
+    """从第一个 { 或 [ 开始修复；该处的结构被拒绝时从其后的下一个 { 或 [ 重新开始。找不到时返回 None。"""
+    pos = 0
+    while True:
+        starts = [p for p in (text.find("{", pos), text.find("[", pos)) if p != -1]
+        if not starts:
+            return None
+        rep = _Repairer(text, min(starts))
+        rep.run()
+        if not rep.rejected:
+            return rep
+        pos = rep.end
+
+def _solid_len(text: str) -> int:
+    """不计空白与 ``` 围栏的字符数。"""
+    return sum(1 for c in re.sub(r"```\w*", "", text) if c not in _WHITESPACE)
+
+def repair_json(text: str) -> Tuple[str, Dict[str, int]]:
+    """一遍扫描修复常见缺陷；返回 (修复后的文本, {修复类别: 次数})。找不到像 JSON 的 { 或 [ 时原样返回。"""
+    rep = _repair(text)
+    return ("".join(rep.out), rep.fixes) if rep else (text, {})
+
+def parse_json_tolerant(text: str) -> Tuple[Any, Dict[str, int]]:
+    """合法 JSON 直接解析（修复记录为空）；否则修复后解析，仍失败或截取部分太少时抛 JSONRepairError。"""
+    if not isinstance(text, str):
+        raise JSONRepairError(f"输入不是字符串（{type(text).__name__}）", {})
+    try:
+        return json.loads(text), {}
+    except ValueError:
+        pass
+    rep = _repair(text)
+    if rep is None:
+        raise JSONRepairError("找不到 JSON（没有像 JSON 的 { 或 [）", {})
+    repaired, fixes = "".join(rep.out), rep.fixes
+    total = _solid_len(text)
+    if total and _solid_len(text[rep.start:rep.end]) < MIN_SPAN_FRACTION * total:
+        raise JSONRepairError(f"截取的 JSON 只占全文 {_solid_len(text[rep.start:rep.end]) / total:.0%}，"
+                              f"不像带说明文字的 JSON", fixes)
+    try:
+        return json.loads(repaired), fixes
+    except ValueError as e:
+        raise JSONRepairError(f"修复后仍无法解析 JSON（{format_fixes(fixes) or '未做修复'}）：{e}", fixes) from e
+
+def format_fixes(fixes: Dict[str, int]) -> str:
+    return ", ".join(f"{kind}={n}" for kind, n in sorted(fixes.items()))
+
+
+# ----------------------------
+# ========== 命令行 ==========
+# ----------------------------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="统计 JSON 文件直接可解析 / 修复后可解析 / 仍失败的数量与各类修复次数")
+    ap.add_argument("paths", nargs="+", help="文件或目录（目录下递归查找 *.json 与 *.txt）")
+    ap.add_argument("-v", "--verbose", action="store_true", help="逐个打印修复过的文件")
+    args = ap.parse_args(argv)
+
+    files: List[Path] = []
+    for p in map(Path, args.paths):
+        files.extend(sorted(f for f in p.rglob("*") if f.suffix in (".json", ".txt")) if p.is_dir() else [p])
+    clean = repaired = failed = 0
+    totals: Dict[str, int] = {}
+    for f in files:
+        text = f.read_text(encoding="utf-8")
+        try:
+            _, fixes = parse_json_tolerant(text)
+        except JSONRepairError as e:
+            failed += 1
+            print(f"❌ {f}：{e}")
+            continue
+        if not fixes:
+            clean += 1
+            continue
+        repaired += 1
+        for kind, n in fixes.items():
+            totals[kind] = totals.get(kind, 0) + n
+        if args.verbose:
+            print(f"🩹 {f}：{format_fixes(fixes)}")
+    print(f"{len(files)} 个文件：{clean} 个直接可解析，{repaired} 个修复后可解析，{failed} 个仍失败")
+    if totals:
+        print(f"修复：{format_fixes(totals)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+llm_batch.py
+
+批量推理（Batch API）的请求文件与结果文件读写（FinalScript v7 / library_generate 共用）：
+- 提交：每个单元一行 {"custom_id", "method": "POST", "url": "/v1/chat/completions", "body": {...}}，
+  custom_id 稳定可读（如 "unit-017"、"lb-76-90"），同一批次重复生成得到逐字节相同的文件
+- 请求文件旁写一份 <name>.meta.json：custom_id -> 脚本自己的元数据（主题、单元号……），
+  以及 messages 的缓存键；收集结果时不用重新推导主题顺序
+- 收集：读取供应商返回的结果 JSONL（{"custom_id", "response": {"status_code", "body"}, "error"}），
+  每行转成 llm_cache 统一格式的 record，交回脚本走正常的解析 / 校验 / SQL 流程；
+  成功的结果同时写进响应缓存，之后用普通模式重跑同一单元直接命中
+- 整个收集过程不访问网络，可以直接拿本地结果文件离线测试
+
+用法：
+    entries = [BatchEntry("unit-001", MODEL, messages, params, {"global_unit": 1, "theme": theme}), ...]
+    write_batch_requests(path, entries)
+    for item in collect_batch_results(requests_path, results_path, cache):
+        item.custom_id, item.meta, item.record, item.error
+"""
+import os
+import json
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional
+
+from llm_cache import ResponseCache, completion_record, make_cache_key
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+
+class BatchEntry(NamedTuple):
+    custom_id: str
+    model: str
+    messages: List[dict]
+    params: dict
+    meta: dict
+
+
+class BatchResult(NamedTuple):
+    custom_id: str
+    meta: dict
+    record: Optional[dict]   # llm_cache 格式；失败时为 None
+    error: Optional[str]
+
+
+def meta_path_for(requests_path: Path) -> Path:
+    requests_path = Path(requests_path)
+    return requests_path.with_name(requests_path.stem + ".meta.json")
+
+def _atomic_write(path: Path, text: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+# ----------------------------
+# ========== 提交 ==========
+# ----------------------------
+def write_batch_requests(requests_path: Path, entries: List[BatchEntry]) -> Path:
+    """写出请求 JSONL 与 meta 文件；custom_id 重复时直接报错（结果无法一一对应）。"""
+    seen = set()
+    lines = []
+    meta = {}
+    for e in entries:
+        if e.custom_id in seen:
+            raise ValueError(f"custom_id 重复：{e.custom_id}")
+        seen.add(e.custom_id)
+        body = {"model": e.model, "messages": e.messages, **(e.params or {})}
+        lines.append(json.dumps({"custom_id": e.custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body},
+                                ensure_ascii=False, separators=(",", ":")))
+        meta[e.custom_id] = {**e.meta, "cache_key": make_cache_key(e.model, e.messages, e.params)}
+    requests_path = Path(requests_path)
+    _atomic_write(requests_path, "\n".join(lines) + "\n" if lines else "")
+    _atomic_write(meta_path_for(requests_path), json.dumps(meta, ensure_ascii=False, indent=2))
+    print(f"[BATCH] 写出 {len(lines)} 条请求 -> {requests_path}")
+    return requests_path
+
+
+# ----------------------------
+# ========== 收集 ==========
+# ----------------------------
+def _result_error(line: dict) -> Optional[str]:
+    error = line.get("error")
+    if error:
+        return error.get("message") if isinstance(error, dict) and error.get("message") else json.dumps(error, ensure_ascii=False)
+    response = line.get("response") or {}
+    status = response.get("status_code")
+    if status is not None and status != 200:
+        return f"HTTP {status}: {json.dumps(response.get('body'), ensure_ascii=False)[:300]}"
+    if not isinstance(response.get("body"), dict):
+        return "结果缺少 response.body"
+    return None
+
+def read_batch_meta(requests_path: Path) -> dict:
+    """{custom_id: 提交时写下的元数据}，按提交顺序。"""
+    with open(meta_path_for(requests_path), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def collect_batch_results(requests_path: Path, results_path: Path,
+                          cache: Optional[ResponseCache] = None) -> Iterator[BatchResult]:
+    """按结果文件顺序逐行产出 BatchResult；请求文件里有、结果文件里没有的 custom_id 最后以“缺少结果”产出。"""
+    pending = read_batch_meta(requests_path)
+    with open(results_path, "r", encoding="utf-8") as f:
+        for lineno, text in enumerate(f, 1):
+            text = text.strip()
+            if not text:
+                continue
+            try:
+                line = json.loads(text)
+            except ValueError as e:
+                print(f"[BATCH][WARN] 结果第 {lineno} 行不是合法 JSON，已跳过：{e}")
+                continue
+            custom_id = line.get("custom_id")
+            if custom_id not in pending:
+                print(f"[BATCH][WARN] 结果第 {lineno} 行 custom_id={custom_id!r} 不在本批请求中（或重复），已跳过")
+                continue
+            item_meta = pending.pop(custom_id)
+            error = _result_error(line)
+            record = None
+            if error is None:
+                record = completion_record(line["response"]["body"])
+                record["cached"] = False
+                if cache is not None and record.get("raw_text") is not None:
+                    cache.put(item_meta["cache_key"], record)
+            yield BatchResult(custom_id, item_meta, record, error)
+    for custom_id, item_meta in pending.items():
+        yield BatchResult(custom_id, item_meta, None, "结果文件中缺少该请求")
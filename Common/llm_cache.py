@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+llm_cache.py
+
+内容寻址的 LLM 响应缓存（FinalScript / converter / transformer / library_generate 共用）：
+- 缓存键 = sha256(实际发出的模型名 + 完整 messages（含 system prompt）+ 采样参数)，任何一处 prompt 改动都会自然失效；
+  经后端池发送时以选定后端上的实际模型名 / 参数为键，不同后端映射到不同模型的结果不会互相顶替
+- 保存原始返回文本、usage、finish_reason，命中时不再请求 API、也不占用限流额度
+- SQLite 单文件存储，按最近访问时间做 LRU 淘汰，同时限制总字节数与条目数；
+  总量由触发器维护在 totals 表里，超限时按 last_access 索引成批淘汰到低水位，写入不再扫全表
+- 改了转义 / SQL 生成逻辑之后重跑，只要 prompt 没变就全部走本地缓存，等于纯本地重算
+
+用法：
+    cache = ResponseCache()
+    record = cached_completion(cache, MODEL_NAME, messages, {"temperature": 0.1},
+                               lambda: client.chat.completions.create(model=MODEL_NAME, messages=messages, temperature=0.1))
+    raw_text = record["raw_text"]   # record["cached"] 表示是否命中
+"""
+import os
+import time
+import json
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+# ----------------------------
+# ========== 配置区 ==========
+# ----------------------------
+DEFAULT_CACHE_PATH = Path(os.environ.get("YPROGRAM_LLM_CACHE", "")
+                          or Path(__file__).resolve().parent / ".runtime" / "llm_cache.sqlite3")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024   # 缓存文本总量上限
+DEFAULT_MAX_ENTRIES = 20000             # 条目数上限
+EVICT_LOW_WATER = 0.9                   # 超限后一次淘汰到上限的这个比例，之后若干次写入都不必再淘汰
+EVICT_BATCH = 256                       # 每批按最近访问时间取出的候选条目数
+
+# 环境变量 YPROGRAM_LLM_CACHE_DISABLE=1 时所有脚本都绕过缓存（get 永远不命中，但仍会写入）
+CACHE_READ_DISABLED = os.environ.get("YPROGRAM_LLM_CACHE_DISABLE", "") == "1"
+
+
+# ----------------------------
+# ========== 辅助函数 ==========
+# ----------------------------
+def make_cache_key(model: str, messages: List[dict], params: Optional[dict] = None) -> str:
+    """对 (model, messages, params) 做规范化 JSON 后取 sha256。"""
+    payload = {
+        "model": model,
+        "messages": [{"role": m.get("role"), "content": m.get("content")} for m in messages],
+        "params": params or {},
+    }
+    canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _to_plain(obj: Any) -> Any:
+    if obj is None or isinstance(obj, (dict, list, str, int, float, bool)):
+        return obj
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    return str(obj)
+
+def completion_record(resp: Any) -> dict:
+    """把 SDK 返回对象 / 原始 dict 统一成 {raw_text, usage, finish_reason, model}。"""
+    if isinstance(resp, dict):
+        choices = resp.get("choices") or [{}]
+        first = choices[0] if isinstance(choices[0], dict) else {}
+        msg = first.get("message") or {}
+        raw_text = msg.get("content") if isinstance(msg, dict) else None
+        if raw_text is None:
+            raw_text = first.get("text")
+        return {
+            "raw_text": raw_text,
+            "usage": resp.get("usage"),
+            "finish_reason": first.get("finish_reason"),
+            "model": resp.get("model"),
+        }
+    try:
+        choice = resp.choices[0]
+        raw_text = choice.message.content
+        finish_reason = choice.finish_reason
+    except Exception:
+        raw_text, finish_reason = None, None
+    return {
+        "raw_text": raw_text,
+        "usage": _to_plain(getattr(resp, "usage", None)),
+        "finish_reason": finish_reason,
+        "model": getattr(resp, "model", None),
+    }
+
+
+# ----------------------------
+# ========== 缓存 ==========
+# ----------------------------
+class ResponseCache:
+    def __init__(self, path: Optional[Path] = None, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = Path(path or DEFAULT_CACHE_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, model TEXT, raw_text TEXT, usage TEXT, finish_reason TEXT,"
+            " size INTEGER NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+        self._init_totals()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_totals(self):
+        """totals 表记录总字节数与条目数，由 responses 上的插入 / 删除触发器维护（旧库首次打开时按现有数据补算）。"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS totals ("
+                         " id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL, entries INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO totals (id, bytes, entries)"
+                         " SELECT 0, COALESCE(SUM(size), 0), COUNT(*) FROM responses")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN"
+                         " UPDATE totals SET bytes = bytes + NEW.size, entries = entries + 1 WHERE id = 0; END")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN"
+                         " UPDATE totals SET bytes = bytes - OLD.size, entries = entries - 1 WHERE id = 0; END")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, key: str) -> Optional[dict]:
+        if CACHE_READ_DISABLED:
+            return None
+        conn = self._conn()
+        row = conn.execute("SELECT model, raw_text, usage, finish_reason, created FROM responses WHERE key = ?",
+                           (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        model, raw_text, usage, finish_reason, created = row
+        return {
+            "raw_text": raw_text,
+            "usage": json.loads(usage) if usage else None,
+            "finish_reason": finish_reason,
+            "model": model,
+            "created": created,
+            "cached": True,
+        }
+
+    def put(self, key: str, record: dict):
+        raw_text = record.get("raw_text")
+        if raw_text is None:
+            return
+        usage = json.dumps(record.get("usage"), ensure_ascii=False) if record.get("usage") is not None else None
+        size = len(raw_text.encode("utf-8")) + (len(usage) if usage else 0)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 先删后插而不是 INSERT OR REPLACE：REPLACE 隐式删除旧行时不触发删除触发器，totals 会算错
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.execute(
+                "INSERT INTO responses (key, model, raw_text, usage, finish_reason, size, created, last_access, hits)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, record.get("model"), raw_text, usage, record.get("finish_reason"), size, now, now),
+            )
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def _evict(self, conn: sqlite3.Connection):
+        """未超限时只读一行 totals；超限时按 last_access 索引成批删最旧的条目，直到降到低水位。"""
+        total_bytes, count = conn.execute("SELECT bytes, entries FROM totals WHERE id = 0").fetchone()
+        if total_bytes <= self.max_bytes and count <= self.max_entries:
+            return
+        target_bytes = int(self.max_bytes * EVICT_LOW_WATER)
+        target_entries = int(self.max_entries * EVICT_LOW_WATER)
+        while total_bytes > target_bytes or count > target_entries:
+            rows = conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC LIMIT ?",
+                                (EVICT_BATCH,)).fetchall()
+            if not rows:
+                break
+            victims = []
+            for key, size in rows:
+                if total_bytes <= target_bytes and count <= target_entries:
+                    break
+                victims.append((key,))
+                total_bytes -= size
+                count -= 1
+            conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        total_bytes, count = conn.execute("SELECT bytes, entries FROM totals WHERE id = 0").fetchone()
+        hits = conn.execute("SELECT COALESCE(SUM(hits), 0) FROM responses").fetchone()[0]
+        return {"entries": count, "bytes": total_bytes, "hits": hits}
+
+
+def _lookup_keys(model: str, messages: List[dict], params: Optional[dict],
+                 candidates: Optional[List[Tuple[str, Optional[dict]]]]) -> List[str]:
+    return [make_cache_key(m, messages, p) for m, p in (candidates or [(model, params)])]
+
+def _sent_key(result: Any, messages: List[dict], keys: List[str]) -> Tuple[Any, str]:
+    """call() 返回 (响应, 实际模型名, 实际参数) 时按实际发出的请求算键，否则用第一个候选键。"""
+    if isinstance(result, tuple):
+        resp, sent_model, sent_params = result
+        return resp, make_cache_key(sent_model, messages, sent_params)
+    return result, keys[0]
+
+def cached_completion(cache: Optional[ResponseCache], model: str, messages: List[dict], params: Optional[dict],
+                      call: Callable[[], Any], use_cached: bool = True,
+                      candidates: Optional[List[Tuple[str, Optional[dict]]]] = None) -> dict:
+    """
+    先查缓存，未命中再执行 call()（真正的 API 请求），并把结果写回缓存。
+    use_cached=False 用于“上次结果解析失败、需要重新请求”的重试：跳过读取，但新结果会覆盖旧条目。
+    经后端池发送时，实际模型名 / 参数要等选定后端才知道：candidates 列出各后端实际会发出的 (模型名, 参数)，
+    查缓存时逐个尝试；call() 返回 (响应, 实际模型名, 实际参数)，写回时以实际发出的请求为键。
+    """
+    keys = _lookup_keys(model, messages, params, candidates)
+    if cache is not None and use_cached:
+        for key in keys:
+            hit = cache.get(key)
+            if hit is not None:
+                return hit
+    resp, key = _sent_key(call(), messages, keys)
+    record = completion_record(resp)
+    record["cached"] = False
+    if cache is not None:
+        cache.put(key, record)
+    return record
+
+
+async def cached_completion_async(cache: Optional[ResponseCache], model: str, messages: List[dict],
+                                  params: Optional[dict], call: Callable[[], Awaitable[Any]],
+                                  use_cached: bool = True,
+                                  candidates: Optional[List[Tuple[str, Optional[dict]]]] = None) -> dict:
+    """cached_completion 的 asyncio 版本：SQLite 读写放到线程里，call 为协程函数。"""
+    keys = _lookup_keys(model, messages, params, candidates)
+    if cache is not None and use_cached:
+        for key in keys:
+            hit = await asyncio.to_thread(cache.get, key)
+            if hit is not None:
+                return hit
+    resp, key = _sent_key(await call(), messages, keys)
+    record = completion_record(resp)
+    record["cached"] = False
+    if cache is not None:
+        await asyncio.to_thread(cache.put, key, record)
+    return record
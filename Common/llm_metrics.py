@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+llm_metrics.py
+
+LLM 调用埋点（FinalScript / converter / transformer / library_generate 共用）：
+- 每次 completions 调用写一行 JSONL：脚本名、运行标识、单元、第几次尝试、结果（ok / cached / batch / error / rate_limited / aborted / cancelled）、
+  排队时间、请求耗时、首 token 时间（流式时）、prompt / completion / reasoning token、服务端 prompt 缓存命中 / 未命中 token
+- 每个单元结束写一行 kind="unit" 的事件（状态 + 合格题目数），用于计算“每道合格题目消耗的 token”
+- 解析结果写 kind="parse" 的事件（json = 整体就是合法 JSON / extracted = 需要从前后文字中截取 /
+  repaired = 经 json_repair 本地修复后解析 / salvaged = 只捞回部分题目 / truncated = 输出被截断 / failed = 解析失败），
+  报告中给出解析失败率与重试率
+- 运行结束用 report() 汇总：调用数、各结果计数、重试次数、耗时与首 token 的 p50/p95/p99、token 总量、
+  前缀缓存命中率、token/合格题目；python llm_metrics.py <metrics.jsonl> [--run RUN] 可对历史文件重新出报告
+- 写文件由后台线程批量完成，emit 只入队、不做阻塞 IO（asyncio 事件循环里也可直接调用）；
+  print_report / flush 和进程退出时等队列写完
+
+用法：
+    METRICS = MetricsRecorder("converter")
+    with METRICS.track(unit=unit_id) as call:
+        record = cached_completion(..., lambda: RATE_LIMITER.call(call.attempt(lambda: client.chat.completions.create(...)), est))
+        call.finish(record)
+    METRICS.unit(unit_id, "ok", questions=15)
+    METRICS.print_report()
+"""
+import os
+import sys
+import json
+import math
+import time
+import queue
+import atexit
+import argparse
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+DEFAULT_METRICS_DIR = Path(os.environ.get("YPROGRAM_METRICS_DIR", "")
+                           or Path(__file__).resolve().parent / ".runtime" / "metrics")
+
+
+# ----------------------------
+# ========== 辅助函数 ==========
+# ----------------------------
+def _get(obj: Any, key: str) -> Any:
+    if obj is None:
+        return None
+    return obj.get(key) if isinstance(obj, dict) else getattr(obj, key, None)
+
+def usage_fields(usage: Any) -> Dict[str, Optional[int]]:
+    """统一 DeepSeek / OpenAI 两种 usage 结构，缺失的字段为 None。"""
+    completion_details = _get(usage, "completion_tokens_details")
+    prompt_details = _get(usage, "prompt_tokens_details")
+    prompt_tokens = _get(usage, "prompt_tokens")
+    cache_hit = _get(usage, "prompt_cache_hit_tokens")
+    cache_miss = _get(usage, "prompt_cache_miss_tokens")
+    if cache_hit is None:
+        cache_hit = _get(prompt_details, "cached_tokens")
+        if cache_hit is not None and prompt_tokens is not None:
+            cache_miss = prompt_tokens - cache_hit
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": _get(usage, "completion_tokens"),
+        "reasoning_tokens": _get(completion_details, "reasoning_tokens"),
+        "cache_hit_tokens": cache_hit,
+        "cache_miss_tokens": cache_miss,
+        "total_tokens": _get(usage, "total_tokens"),
+    }
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """最近秩法百分位；空列表返回 None。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(p / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+# ----------------------------
+# ========== 单次调用 ==========
+# ----------------------------
+class CallTracker:
+    """一次逻辑调用的计时器；with 块内抛出的异常会被记为失败事件（异常照常向外抛）。"""
+
+    def __init__(self, recorder: "MetricsRecorder", fields: dict):
+        self.recorder = recorder
+        self.fields = {"attempt": 0, **fields}
+        self.created = self.started = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished = False
+
+    def begin(self):
+        """限流 / 并发闸门放行、真正发出请求的时刻；之前的时间记为 queue_sec，不计入 latency。"""
+        self.started = time.perf_counter()
+
+    def attempt(self, fn: Callable[[], Any]) -> Callable[[], Any]:
+        """包装真正发请求的函数，统计被执行的次数（限流器内部的 429 重排队也算一次尝试）。"""
+        def _wrapped():
+            self.fields["attempt"] += 1
+            return fn()
+        return _wrapped
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def finish(self, record: Optional[dict] = None, outcome: Optional[str] = None, error: Optional[str] = None):
+        if self.finished:
+            return
+        self.finished = True
+        record = record or {}
+        if outcome is None:
+            outcome = "cached" if record.get("cached") else "ok"
+        event = {
+            **self.fields,
+            "attempt": self.fields["attempt"] or 1,
+            "outcome": outcome,
+            "latency_sec": round(time.perf_counter() - self.started, 4),
+            "queue_sec": round(self.started - self.created, 4),
+            "ttft_sec": round(self.first_token_at - self.started, 4) if self.first_token_at else None,
+            "finish_reason": record.get("finish_reason"),
+            "error": error,
+        }
+        if outcome != "cached":
+            event.update(usage_fields(record.get("usage")))
+        self.recorder.emit("call", event)
+
+    def __enter__(self) -> "CallTracker":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            if _status_code(exc) == 429:
+                outcome = "rate_limited"
+            elif exc_type.__name__ == "StreamAbort":
+                outcome = "aborted"
+            elif exc_type.__name__ == "CancelledError":
+                outcome = "cancelled"  # 对冲中落败被取消的一方
+            else:
+                outcome = "error"
+            self.finish(outcome=outcome, error=f"{exc_type.__name__}: {exc}")
+        else:
+            self.finish()
+        return False
+
+
+# ----------------------------
+# ========== 记录器 ==========
+# ----------------------------
+class MetricsRecorder:
+    def __init__(self, script: str, path: Optional[Path] = None, run: Optional[str] = None):
+        self.script = script
+        self.run = run or f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.path = Path(path or DEFAULT_METRICS_DIR / f"{script}.jsonl")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.events: List[dict] = []
+        self._lock = threading.Lock()
+        self._pending: "queue.Queue[str]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        atexit.register(self.flush)
+
+    def emit(self, kind: str, fields: dict):
+        event = {"ts": round(time.time(), 3), "script": self.script, "run": self.run, "kind": kind, **fields}
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            self.events.append(event)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name=f"metrics-{self.script}", daemon=True)
+                self._writer.start()
+        self._pending.put(line)
+
+    def _write_loop(self):
+        """后台写线程：一次取走队列里积压的所有行，合并成一次追加写。"""
+        while True:
+            lines = [self._pending.get()]
+            while True:
+                try:
+                    lines.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(line + "\n" for line in lines))
+            except OSError as e:
+                print(f"[METRICS] 写入 {self.path} 失败，丢弃 {len(lines)} 条事件: {e}")
+            finally:
+                for _ in lines:
+                    self._pending.task_done()
+
+    def flush(self):
+        """等后台线程把已记录的事件全部写入文件。"""
+        self._pending.join()
+
+    def track(self, **fields) -> CallTracker:
+        return CallTracker(self, fields)
+
+    def unit(self, unit: Any, status: str, questions: int = 0, **fields):
+        """单元级结果：questions 为该单元最终合格的题目（条目）数。"""
+        self.emit("unit", {"unit": unit, "status": status, "questions": questions, **fields})
+
+    def parse(self, unit: Any, outcome: str, **fields):
+        """一次模型输出的解析结果（outcome 见模块说明）。"""
+        self.emit("parse", {"unit": unit, "outcome": outcome, **fields})
+
+    def report(self) -> dict:
+        with self._lock:
+            return summarize(self.events)
+
+    def print_report(self) -> dict:
+        summary = self.report()
+        self.flush()
+        print(format_report(summary, title=f"{self.script} 运行 {self.run}"))
+        print(f"[METRICS] 明细 -> {self.path}")
+        return summary
+
+
+def summarize(events: List[dict]) -> dict:
+    calls = [e for e in events if e.get("kind") == "call"]
+    units = [e for e in events if e.get("kind") == "unit"]
+    parses = [e for e in events if e.get("kind") == "parse"]
+    live = [e for e in calls if e.get("outcome") != "cached"]
+    outcomes: Dict[str, int] = {}
+    for e in calls:
+        outcomes[e["outcome"]] = outcomes.get(e["outcome"], 0) + 1
+    # 批量结果（outcome=batch）的 token 照常计入，但没有有意义的请求耗时
+    timed = [e for e in live if e.get("outcome") != "batch"]
+    latencies = [e["latency_sec"] for e in timed if e.get("latency_sec") is not None]
+    ttfts = [e["ttft_sec"] for e in live if e.get("ttft_sec") is not None]
+
+    def _sum(key):
+        return sum(int(e.get(key) or 0) for e in live)
+
+    total_tokens = _sum("total_tokens")
+    cache_hit, cache_miss = _sum("cache_hit_tokens"), _sum("cache_miss_tokens")
+    questions = sum(int(u.get("questions") or 0) for u in units)
+    retries = sum(max(0, int(e.get("attempt") or 1) - 1) for e in calls)
+    # 重试率只看主请求（没有 phase 的脚本全部算主请求）：第 2 次及以后的尝试数 / 首次尝试数
+    primary = [int(e.get("attempt") or 1) for e in calls if e.get("phase", "unit") == "unit"]
+    first_tries = sum(1 for a in primary if a <= 1)
+    parse_outcomes: Dict[str, int] = {}
+    for e in parses:
+        parse_outcomes[e["outcome"]] = parse_outcomes.get(e["outcome"], 0) + 1
+    return {
+        "calls": len(calls),
+        "outcomes": outcomes,
+        "retries": retries,
+        "retry_rate": round((len(primary) - first_tries) / first_tries, 3) if first_tries else None,
+        "parses": parse_outcomes,
+        "parse_failure_rate": round(parse_outcomes.get("failed", 0) / len(parses), 3) if parses else None,
+        "latency_sec": {f"p{p}": percentile(latencies, p) for p in (50, 95, 99)},
+        "ttft_sec": {f"p{p}": percentile(ttfts, p) for p in (50, 95, 99)},
+        "prompt_tokens": _sum("prompt_tokens"),
+        "completion_tokens": _sum("completion_tokens"),
+        "reasoning_tokens": _sum("reasoning_tokens"),
+        "cache_hit_tokens": cache_hit,
+        "cache_miss_tokens": cache_miss,
+        "cache_hit_ratio": round(cache_hit / (cache_hit + cache_miss), 3) if cache_hit + cache_miss else None,
+        "total_tokens": total_tokens,
+        "units": len(units),
+        "valid_questions": questions,
+        "tokens_per_valid_question": round(total_tokens / questions, 1) if questions else None,
+    }
+
+def format_report(summary: dict, title: str = "") -> str:
+    def _pcts(d):
+        return " / ".join("-" if d[k] is None else f"{d[k]:.2f}s" for k in ("p50", "p95", "p99"))
+
+    outcomes = ", ".join(f"{k}={v}" for k, v in sorted(summary["outcomes"].items())) or "-"
+    lines = [
+        f"==== 调用统计 {title} ====",
+        f"调用 {summary['calls']} 次（{outcomes}），重试 {summary['retries']} 次",
+        f"耗时 p50/p95/p99：{_pcts(summary['latency_sec'])}",
+        f"首 token p50/p95/p99：{_pcts(summary['ttft_sec'])}",
+        f"token：prompt {summary['prompt_tokens']} + completion {summary['completion_tokens']}"
+        f"（reasoning {summary['reasoning_tokens']}）= {summary['total_tokens']}",
+        f"前缀缓存：命中 {summary['cache_hit_tokens']} / 未命中 {summary['cache_miss_tokens']} token，"
+        f"命中率 {'-' if summary['cache_hit_ratio'] is None else format(summary['cache_hit_ratio'], '.1%')}",
+        f"单元 {summary['units']} 个，合格题目 {summary['valid_questions']} 道，"
+        f"每道合格题目 {summary['tokens_per_valid_question'] or '-'} token",
+    ]
+    if summary.get("parses"):
+        parses = ", ".join(f"{k}={v}" for k, v in sorted(summary["parses"].items()))
+        lines.insert(2, f"解析 {sum(summary['parses'].values())} 次（{parses}），解析失败率 "
+                        f"{summary['parse_failure_rate']:.1%}，重试率 {(summary['retry_rate'] or 0):.1%}")
+    return "\n".join(lines)
+
+def load_events(path: Path, run: Optional[str] = None) -> List[dict]:
+    events = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            if run is None or event.get("run") == run:
+                events.append(event)
+    return events
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="对 metrics JSONL 重新出报告")
+    ap.add_argument("path")
+    ap.add_argument("--run", default=None, help="只统计某次运行（默认最后一次）")
+    args = ap.parse_args()
+    all_events = load_events(Path(args.path))
+    if not all_events:
+        sys.exit("没有任何事件")
+    run = args.run or all_events[-1].get("run")
+    print(format_report(summarize([e for e in all_events if e.get("run") == run]), title=f"运行 {run}"))
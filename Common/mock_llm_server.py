@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+mock_llm_server.py
+
+本地 OpenAI 兼容的假 LLM 服务（只用标准库），用于在没有 DeepSeek key 的机器上回归测试和压测生成流水线：
+- POST /chat/completions 与 /v1/chat/completions，支持 stream=True（SSE，含 stream_options.include_usage 的末尾 usage 块）
+- 返回内容取自 QuestionsFinal/Questions_v7/json_parsed 下的真实单元 JSON；同一 messages 总是得到同一单元（可用 --seed 打散）
+- 逐题修复请求（“请只重新生成下列题号”）、截断续写请求（“请继续生成下列题号”）与按题型拆分的子请求（“本次只生成题号 …… 的”）只返回被点名的题号；
+  JSON 修复请求（system prompt 含“JSON 语法修复”）返回片段中 "id" 对应的题目
+- system prompt 要求“紧凑格式”时按 Common/compact_questions.py 的紧凑数组输出（无法无损压缩的坏题照旧输出为对象）
+- system prompt 中出现 {"questions": [...]} 包装对象时把题目数组包进该对象输出；请求带 response_format=json_object 时
+  不注入“开头夹散文”“字符串里未转义的引号”故障（与真实 JSON mode 一致，截断仍可能发生）
+- 延迟分布：fixed:秒 / uniform:下限,上限 / lognormal:中位数,sigma；流式时首 token 占总耗时的 --ttft-ratio；
+  --tokens-per-sec 给出时再按输出 token 数加上解码时间（输出越长越慢，便于比较拆分请求 / 精简输出的效果）
+- 故障注入：--rate-429（带 Retry-After）、--rate-5xx、--rate-malformed（开头夹散文 / 中途截断 / 把 slot 塞进 code_block / 第二道题标题里未转义的引号）
+- usage 按 rate_limiter.estimate_tokens 估算；同一 system prompt 第二次出现起记为 prompt_cache_hit_tokens，
+  便于验证 llm_metrics 的前缀缓存统计
+- GET /stats 返回请求 / 注入故障计数
+
+用法：
+    python mock_llm_server.py --port 8765 --latency lognormal:2,0.6 --rate-429 0.05 --rate-malformed 0.1
+    export DEEPSEEK_BASE_URL=http://127.0.0.1:8765 DEEPSEEK_API_KEY=mock
+    python "../QuestionsFinal/FinalScript v7.py"
+
+在测试 / 压测脚本中也可以直接 start_mock_server(port=0, ...) 在后台线程启动，用 server.base_url 取地址。
+"""
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional
+
+from rate_limiter import estimate_tokens
+from compact_questions import COMPACT_PROMPT_MARKER, CompactFormatError, compact_question
+
+DEFAULT_CORPUS_DIR = Path(__file__).resolve().parents[1] / "QuestionsFinal" / "Questions_v7" / "json_parsed"
+MALFORMED_KINDS = ("prose", "truncated", "slot_in_block", "bad_json")
+JSON_ONLY_KINDS = ("prose", "bad_json")   # JSON mode 下不会出现的故障
+
+_REPAIR_TARGET_RE = re.compile(r"^- 第(\d+)题", re.M)
+_SPLIT_TARGET_RE = re.compile(r"本次只生成题号 ([\d、，,\s]+) 的")
+_FRAGMENT_ID_RE = re.compile(r'"id"\s*:\s*(\d+)')
+JSON_FIX_MARKER = "JSON 语法修复"   # QuestionsFinal/question_repair.py 的 JSON 修复 system prompt
+OBJECT_WRAPPER_MARKER = '{"questions": [...]}'   # 结构化输出的 system prompt 中包装对象的写法
+
+
+# ----------------------------
+# ========== 配置解析 ==========
+# ----------------------------
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """"fixed:0.5" / "uniform:0.2,2" / "lognormal:1.5,0.6"（中位数秒, sigma）-> 采样函数。"""
+    kind, _, args = spec.partition(":")
+    nums = [float(x) for x in args.split(",") if x.strip()] if args else []
+    if kind == "fixed":
+        value = nums[0] if nums else 0.0
+        return lambda rng: value
+    if kind == "uniform" and len(nums) == 2:
+        return lambda rng: rng.uniform(nums[0], nums[1])
+    if kind == "lognormal" and len(nums) == 2:
+        mu = math.log(max(nums[0], 1e-6))
+        return lambda rng: rng.lognormvariate(mu, nums[1])
+    raise ValueError(f"无法解析延迟分布 {spec!r}（fixed:秒 / uniform:下限,上限 / lognormal:中位数,sigma）")
+
+def load_corpus(corpus_dir: Path) -> List[list]:
+    units = []
+    for path in sorted(Path(corpus_dir).rglob("*_parsed.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, list) and data:
+            units.append(data)
+    if not units:
+        raise FileNotFoundError(f"{corpus_dir} 下没有可用的 *_parsed.json 单元")
+    return units
+
+
+def _compact_or_object(q: dict):
+    try:
+        return compact_question(q)
+    except CompactFormatError:
+        return q
+
+
+# ----------------------------
+# ========== 假模型 ==========
+# ----------------------------
+class MockModel:
+    def __init__(self, corpus: List[list], latency: Callable[[random.Random], float], ttft_ratio: float = 0.2,
+                 rate_429: float = 0.0, rate_5xx: float = 0.0, rate_malformed: float = 0.0,
+                 retry_after: float = 1.0, seed: int = 0, chunk_chars: int = 64,
+                 tokens_per_sec: Optional[float] = None):
+        self.corpus = corpus
+        self.latency = latency
+        self.ttft_ratio = ttft_ratio
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.rate_malformed = rate_malformed
+        self.retry_after = retry_after
+        self.seed = seed
+        self.chunk_chars = chunk_chars
+        self.tokens_per_sec = tokens_per_sec
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._seen_prefixes = set()
+        self.stats = {"requests": 0, "streamed": 0, "ok": 0, "429": 0, "5xx": 0, "malformed": 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def draw(self) -> dict:
+        """为一次请求抽取故障类型与延迟（共享 RNG，加锁保证 --seed 下可复现）。"""
+        with self._lock:
+            r = self._rng.random()
+            fault = None
+            if r < self.rate_429:
+                fault = "429"
+            elif r < self.rate_429 + self.rate_5xx:
+                fault = "5xx"
+            malformed = None
+            if fault is None and self._rng.random() < self.rate_malformed:
+                malformed = self._rng.choice(MALFORMED_KINDS)
+            return {"fault": fault, "malformed": malformed, "latency": max(0.0, self.latency(self._rng))}
+
+    def _pick_unit(self, messages: List[dict]) -> list:
+        digest = hashlib.sha256(json.dumps([self.seed, messages], ensure_ascii=False, sort_keys=True).encode("utf-8"))
+        return self.corpus[int(digest.hexdigest()[:8], 16) % len(self.corpus)]
+
+    def content_for(self, messages: List[dict], malformed: Optional[str]) -> str:
+        unit = json.loads(json.dumps(self._pick_unit(messages)))
+        user = (messages[-1].get("content") or "") if messages else ""
+        targets = ([int(x) for x in _REPAIR_TARGET_RE.findall(user)]
+                   if "请只重新生成下列题号" in user or "请继续生成下列题号" in user else [])
+        split = _SPLIT_TARGET_RE.search(user)
+        if split:
+            targets = [int(x) for x in re.findall(r"\d+", split.group(1))]
+        system = next((m.get("content") or "" for m in messages if m.get("role") == "system"), "")
+        if JSON_FIX_MARKER in system:
+            targets = [int(x) for x in _FRAGMENT_ID_RE.findall(user)]
+        if targets:
+            unit = [q for q in unit if q.get("id") in targets]
+        if malformed == "slot_in_block":
+            for q in unit:
+                segs = (q.get("code_segments") or {}).get("segments") if isinstance(q.get("code_segments"), dict) else None
+                block = next((s for s in segs or [] if s.get("type") == "code_block" and s.get("lines")), None)
+                if block is not None:
+                    block["lines"][0] = {"type": "slot", "index": 0}
+                    break
+        if COMPACT_PROMPT_MARKER in system:
+            text = "[\n" + ",\n".join(json.dumps(_compact_or_object(q), ensure_ascii=False) for q in unit) + "\n]"
+        else:
+            text = json.dumps(unit, ensure_ascii=False, indent=2)
+        if OBJECT_WRAPPER_MARKER in system:
+            text = '{"questions": ' + text + "}"
+        if malformed == "prose":
+            text = "好的，下面是为你生成的题目：\n\n" + text
+        elif malformed == "truncated":
+            text = text[:int(len(text) * 0.6)]
+        elif malformed == "bad_json":
+            marks = [m.end() for m in re.finditer(r'"title": "', text)]
+            if len(marks) > 1:
+                text = text[:marks[1]] + '"示例"' + text[marks[1]:]
+        return text
+
+    def latency_for(self, base: float, usage: dict) -> float:
+        if not self.tokens_per_sec:
+            return base
+        return base + usage["completion_tokens"] / self.tokens_per_sec
+
+    def usage_for(self, messages: List[dict], content: str) -> dict:
+        system = next((m.get("content") or "" for m in messages if m.get("role") == "system"), "")
+        prompt_tokens = sum(estimate_tokens(m.get("content")) for m in messages)
+        key = hashlib.sha256(system.encode("utf-8")).hexdigest()
+        with self._lock:
+            hit = estimate_tokens(system) if system and key in self._seen_prefixes else 0
+            self._seen_prefixes.add(key)
+        completion_tokens = estimate_tokens(content)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_cache_hit_tokens": hit, "prompt_cache_miss_tokens": prompt_tokens - hit}
+
+
+# ----------------------------
+# ========== HTTP ==========
+# ----------------------------
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = "YProgramMockLLM/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def model(self) -> MockModel:
+        return self.server.model
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/stats", "/v1/stats"):
+            self._send_json(200, dict(self.model.stats))
+        elif self.path.rstrip("/") in ("/models", "/v1/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "deepseek-chat", "object": "model"},
+                                                              {"id": "deepseek-reasoner", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"未知路径 {self.path}"}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/chat/completions", "/v1/chat/completions"):
+            self._send_json(404, {"error": {"message": f"未知路径 {self.path}"}})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            req = json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError:
+            self._send_json(400, {"error": {"message": "请求体不是合法 JSON"}})
+            return
+        model = self.model
+        model._count("requests")
+        draw = model.draw()
+        if draw["fault"] == "429":
+            model._count("429")
+            time.sleep(min(draw["latency"], 0.05))
+            self._send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}},
+                            {"Retry-After": f"{model.retry_after:g}"})
+            return
+        if draw["fault"] == "5xx":
+            model._count("5xx")
+            time.sleep(draw["latency"] * model.ttft_ratio)
+            self._send_json(503, {"error": {"message": "Service unavailable (mock)", "type": "server_error"}})
+            return
+        if draw["malformed"]:
+            model._count("malformed")
+
+        messages = req.get("messages") or []
+        malformed = draw["malformed"]
+        if malformed in JSON_ONLY_KINDS and (req.get("response_format") or {}).get("type") == "json_object":
+            malformed = None   # JSON mode 下服务端保证输出是合法 JSON，不会夹带散文或语法错误
+        content = model.content_for(messages, malformed)
+        usage = model.usage_for(messages, content)
+        latency = model.latency_for(draw["latency"], usage)
+        finish_reason = "length" if malformed == "truncated" else "stop"
+        completion_id = f"chatcmpl-mock-{hashlib.sha1(content.encode('utf-8')).hexdigest()[:12]}"
+        if req.get("stream"):
+            model._count("streamed")
+            include_usage = bool((req.get("stream_options") or {}).get("include_usage"))
+            self._stream(req.get("model"), completion_id, content, finish_reason, usage if include_usage else None,
+                         latency)
+        else:
+            time.sleep(latency)
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": req.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+        model._count("ok")
+
+    def _stream(self, model_name: str, completion_id: str, content: str, finish_reason: str,
+                usage: Optional[dict], latency: float):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def _chunk(delta: dict, fr: Optional[str] = None, u: Optional[dict] = None, choices: bool = True):
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                       "model": model_name,
+                       "choices": [{"index": 0, "delta": delta, "finish_reason": fr}] if choices else []}
+            if u is not None:
+                payload["usage"] = u
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        step = max(1, self.model.chunk_chars)
+        pieces = [content[i:i + step] for i in range(0, len(content), step)] or [""]
+        time.sleep(latency * self.model.ttft_ratio)
+        gap = latency * (1 - self.model.ttft_ratio) / len(pieces)
+        try:
+            _chunk({"role": "assistant", "content": ""})
+            for piece in pieces:
+                _chunk({"content": piece})
+                if gap:
+                    time.sleep(gap)
+            _chunk({}, finish_reason)
+            if usage is not None:
+                _chunk({}, u=usage, choices=False)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端提前关闭流（StreamAbort）属于正常情况
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, model: MockModel, verbose: bool = False):
+        super().__init__((host, port), MockHandler)
+        self.model = model
+        self.verbose = verbose
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, corpus_dir: Path = DEFAULT_CORPUS_DIR,
+                      latency: str = "fixed:0", verbose: bool = False, **model_kwargs) -> MockLLMServer:
+    """在后台线程启动服务并返回；用完调用 server.shutdown()。"""
+    model = MockModel(load_corpus(corpus_dir), parse_latency(latency), **model_kwargs)
+    server = MockLLMServer(host, port, model, verbose=verbose)
+    threading.Thread(target=server.serve_forever, name="mock-llm-server", daemon=True).start()
+    return server
+
+
+# ----------------------------
+# ========== 命令行 ==========
+# ----------------------------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="本地 OpenAI 兼容假 LLM 服务（离线回归 / 压测用）")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--corpus", default=str(DEFAULT_CORPUS_DIR), help="包含 *_parsed.json 单元的目录")
+    ap.add_argument("--latency", default="lognormal:1.5,0.5", help="fixed:秒 / uniform:下限,上限 / lognormal:中位数,sigma")
+    ap.add_argument("--ttft-ratio", type=float, default=0.2, help="流式时首 token 占总耗时的比例")
+    ap.add_argument("--tokens-per-sec", type=float, default=None, help="解码速度；给出时按输出 token 数追加耗时")
+    ap.add_argument("--rate-429", type=float, default=0.0)
+    ap.add_argument("--rate-5xx", type=float, default=0.0)
+    ap.add_argument("--rate-malformed", type=float, default=0.0)
+    ap.add_argument("--retry-after", type=float, default=1.0, help="429 响应的 Retry-After 秒数")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--verbose", action="store_true", help="打印每个请求的访问日志")
+    args = ap.parse_args(argv)
+
+    model = MockModel(load_corpus(Path(args.corpus)), parse_latency(args.latency), ttft_ratio=args.ttft_ratio,
+                      rate_429=args.rate_429, rate_5xx=args.rate_5xx, rate_malformed=args.rate_malformed,
+                      retry_after=args.retry_after, seed=args.seed, tokens_per_sec=args.tokens_per_sec)
+    server = MockLLMServer(args.host, args.port, model, verbose=args.verbose)
+    print(f"[MOCK] {len(model.corpus)} 个单元，监听 {server.base_url}")
+    print(f"[MOCK] export DEEPSEEK_BASE_URL={server.base_url} DEEPSEEK_API_KEY=mock")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"[MOCK] 统计：{model.stats}")
+
+
+if __name__ == "__main__":
+    main()
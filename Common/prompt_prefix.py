@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+prompt_prefix.py
+
+稳定 prompt 前缀（所有带固定 system prompt 的生成脚本共用）：
+- DeepSeek 等接口对“与之前请求逐字节相同的开头部分”按缓存价计费、且首 token 更快，
+  前提是固定内容放在最前面、每次发送的字节完全一致
+- PromptPrefix 把 system prompt 原样固定下来，所有单元 / 修复请求都用同一份文本作为第一条消息；
+  只随单元变化的内容放在其后的 user 消息里。发送的内容不做任何改写，指纹和漂移比较也按发送的原始文本计算：
+  只改了空白 / 换行同样会让前缀缓存失效，同样会被报告（提示中注明“只改了空白”）
+- user 模板里第一个占位符之前的固定文字同样属于共享前缀；如果模板把大段固定说明放在占位符之后，
+  启动时会提示“这部分无法被前缀缓存”
+- 每个前缀的指纹记录在 Common/.runtime/prompt_prefixes.json；改了 prompt 之后第一次运行会提示
+  从第几个字符开始不同（之前的缓存从这里开始全部失效）
+- 命中情况由 llm_metrics 从 usage 的 prompt_cache_hit_tokens / prompt_cache_miss_tokens 汇总
+
+用法：
+    PROMPT = PromptPrefix("finalscript_v7", SYSTEM_PROMPT, USER_PROMPT_TEMPLATE)
+    PROMPT.check_drift()
+    messages = PROMPT.messages(theme=theme)
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+from rate_limiter import estimate_tokens
+
+DEFAULT_REGISTRY_PATH = Path(os.environ.get("YPROGRAM_PROMPT_REGISTRY", "")
+                             or Path(__file__).resolve().parent / ".runtime" / "prompt_prefixes.json")
+
+# user 模板中占位符之后的固定文字超过这个字符数就提示挪到前面
+MAX_STATIC_TAIL_CHARS = 200
+
+_PLACEHOLDER_RE = re.compile(r"(?<!\{)\{[A-Za-z_][A-Za-z0-9_]*\}(?!\})")
+_registry_lock = threading.Lock()
+
+
+def canonicalize(text: str) -> str:
+    """统一换行为 \\n、去掉每行行尾空白和首尾空行；只用于判断两次 prompt 是否只差空白，不改变发送的内容。"""
+    lines = [ln.rstrip() for ln in text.replace("\r\n", "\n").replace("\r", "\n").split("\n")]
+    while lines and not lines[0]:
+        lines.pop(0)
+    while lines and not lines[-1]:
+        lines.pop()
+    return "\n".join(lines)
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+def first_difference(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class PromptPrefix:
+    def __init__(self, name: str, system_prompt: str, user_template: Optional[str] = None,
+                 registry_path: Optional[Path] = None):
+        self.name = name
+        self.system = system_prompt
+        self.user_template = user_template
+        self.fingerprint = fingerprint(system_prompt)
+        self.registry_path = Path(registry_path or DEFAULT_REGISTRY_PATH)
+
+    @property
+    def user_static_head(self) -> str:
+        """user 模板中第一个占位符之前的固定文字（同样是共享前缀的一部分）。"""
+        if not self.user_template:
+            return ""
+        m = _PLACEHOLDER_RE.search(self.user_template)
+        return self.user_template[:m.start()] if m else self.user_template
+
+    @property
+    def shared_prefix_tokens(self) -> int:
+        return estimate_tokens(self.system) + estimate_tokens(self.user_static_head)
+
+    def messages(self, user_content: Optional[str] = None, **template_vars) -> List[dict]:
+        """system 固定为原样的 system prompt；user 为 user_content 或用 template_vars 格式化的模板。"""
+        if user_content is None:
+            user_content = self.user_template.format(**template_vars)
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": user_content},
+        ]
+
+    def _static_tail_chars(self) -> int:
+        if not self.user_template:
+            return 0
+        matches = list(_PLACEHOLDER_RE.finditer(self.user_template))
+        if not matches:
+            return 0
+        return len(_PLACEHOLDER_RE.sub("", self.user_template[matches[0].end():]).strip())
+
+    def check_drift(self) -> List[str]:
+        """与上次运行记录的前缀比较并更新记录；返回（并打印）所有提示。"""
+        warnings = []
+        tail = self._static_tail_chars()
+        if tail > MAX_STATIC_TAIL_CHARS:
+            warnings.append(f"user 模板在第一个占位符之后还有约 {tail} 字的固定说明，这部分无法参与前缀缓存，"
+                            f"建议挪到 system prompt 或模板开头")
+        with _registry_lock:
+            registry = {}
+            if self.registry_path.exists():
+                try:
+                    registry = json.loads(self.registry_path.read_text(encoding="utf-8"))
+                except ValueError:
+                    registry = {}
+            prev = registry.get(self.name)
+            if prev and prev.get("fingerprint") != self.fingerprint:
+                prev_text = prev.get("text", "")
+                pos = first_difference(prev_text, self.system)
+                shared = estimate_tokens(self.system[:pos])
+                what = "只改了空白 / 换行" if canonicalize(prev_text) == canonicalize(self.system) else "已修改"
+                warnings.append(f"system prompt 自上次运行（{time.strftime('%Y-%m-%d %H:%M', time.localtime(prev.get('updated', 0)))}）"
+                                f"{what}，从第 {pos} 个字符起不同：之前的前缀缓存只剩约 {shared} token 可复用，"
+                                f"其余约 {self.shared_prefix_tokens - shared} token 需要重新计费")
+            if not prev or prev.get("fingerprint") != self.fingerprint:
+                registry[self.name] = {"fingerprint": self.fingerprint, "text": self.system, "updated": time.time()}
+                self.registry_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.registry_path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(registry, ensure_ascii=False, indent=2), encoding="utf-8")
+                os.replace(tmp, self.registry_path)
+        for w in warnings:
+            print(f"[PROMPT][WARN] {self.name}: {w}")
+        print(f"[PROMPT] {self.name} 共享前缀 {self.fingerprint}，约 {self.shared_prefix_tokens} token")
+        return warnings
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+question_validator.py
+
+题目结构校验器（FinalScript v7 / jsontosql2 生成 SQL 前共用）：
+- 把提示词里的硬性规则写成代码：
+  - 每单元 15 题，按 3 选择 + 2 填空 ×3 排列（题号 1–3、6–8、11–13 选择，4–5、9–10、14–15 填空）
+  - 选择题 4 个选项、answer 为 A–D
+  - 填空题 code_segments 为 {"segments": [...]}，code_block 的 lines 里只能是 code_line，
+    slot 只能出现在 code_inline 的 parts 里，slot 的 index 从 0 开始连续编号
+  - 填空题 answer 非空，且每个答案都能对应到 options
+- compile_unit_validator() 只在导入 / 配置时把规则“编译”成一组闭包，校验时不再解析任何 schema，
+  整个题库（150 单元）校验远低于 1 秒，可以直接放在生成与重建的热路径上
+- 返回机器可读的问题列表：[{"path": "$[3].code_segments.segments[1].lines[0].type", "code": "...", "message": "..."}]
+
+两种题目布局：
+- container="list"：FinalScript 的题目数组，options 为数组，填空 answer 为 0-based 选项下标
+- container="grouped"：QuestionsNew 的 {"choice_questions": [...], "fill_questions": [...]}，
+  选择题 options 为 {"A": ..., "D": ...}，填空 answer 为选项内容本身
+
+命令行：python question_validator.py <json 文件或目录>... [--grouped]，打印问题与耗时。
+"""
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+NUM_QUESTIONS_PER_UNIT = 15
+FILL_IDS = frozenset((4, 5, 9, 10, 14, 15))
+CHOICE_LETTERS = frozenset("ABCD")
+CODE_KEYS = ("code_segments", "code_segment", "code")
+
+Issue = Dict[str, str]
+Check = Callable[[Any, str, List[Issue]], None]
+
+
+def expected_type(qid: int) -> str:
+    return "fill" if qid in FILL_IDS else "choice"
+
+def _issue(out: List[Issue], path: str, code: str, message: str):
+    out.append({"path": path, "code": code, "message": message})
+
+def issues_by_question(issues: List[Issue]) -> Dict[str, List[Issue]]:
+    """按题目前缀（如 "$[3]"、"$.fill_questions[0]"）分组，供逐题修复 / 报告使用。"""
+    grouped: Dict[str, List[Issue]] = {}
+    for it in issues:
+        path = it["path"]
+        end = path.find("]")
+        key = path[:end + 1] if end != -1 else path
+        grouped.setdefault(key, []).append(it)
+    return grouped
+
+
+# ----------------------------
+# ========== 规则编译 ==========
+# ----------------------------
+def _compile_choice(options_style: str) -> Check:
+    if options_style == "dict":
+        def check_options(options, path, out):
+            if not isinstance(options, dict) or set(options) != CHOICE_LETTERS:
+                _issue(out, path, "choice.options", "选择题 options 必须是键为 A–D 的对象")
+    else:
+        def check_options(options, path, out):
+            if not isinstance(options, list) or len(options) != 4:
+                _issue(out, path, "choice.options", "选择题 options 必须是 4 个选项的数组")
+
+    def check(q, path, out):
+        check_options(q.get("options"), path + ".options", out)
+        answer = q.get("answer")
+        if not isinstance(answer, str) or answer.strip() not in CHOICE_LETTERS:
+            _issue(out, path + ".answer", "choice.answer", "选择题 answer 必须是 A–D 中的一个大写字母")
+    return check
+
+
+def _check_segments(code: Any, path: str, out: List[Issue]) -> List[int]:
+    """检查 code_segments 结构，返回按出现顺序收集到的 slot index。"""
+    slots: List[int] = []
+    segments = code.get("segments") if isinstance(code, dict) else None
+    if not isinstance(segments, list) or not segments:
+        _issue(out, path, "fill.code_segments", "code_segments 必须是带非空 segments 数组的 JSON 对象")
+        return slots
+    for si, seg in enumerate(segments):
+        spath = f"{path}.segments[{si}]"
+        seg_type = seg.get("type") if isinstance(seg, dict) else None
+        if seg_type == "code_block":
+            lines = seg.get("lines")
+            if not isinstance(lines, list):
+                _issue(out, spath + ".lines", "fill.code_block_lines", "code_block 必须带 lines 数组")
+                continue
+            for li, line in enumerate(lines):
+                if not isinstance(line, dict) or line.get("type") != "code_line":
+                    _issue(out, f"{spath}.lines[{li}].type", "fill.code_block_line_type",
+                           "code_block 的 lines 中只能出现 code_line（slot/code 必须放在 code_inline 里）")
+        elif seg_type == "code_inline":
+            parts = seg.get("parts")
+            if not isinstance(parts, list) or not parts:
+                _issue(out, spath + ".parts", "fill.code_inline_parts", "code_inline 必须带非空 parts 数组")
+                continue
+            for pi, part in enumerate(parts):
+                part_type = part.get("type") if isinstance(part, dict) else None
+                if part_type == "slot":
+                    index = part.get("index")
+                    if isinstance(index, int) and not isinstance(index, bool):
+                        slots.append(index)
+                    else:
+                        _issue(out, f"{spath}.parts[{pi}].index", "fill.slot_index", "slot 的 index 必须是整数")
+                elif part_type != "code":
+                    _issue(out, f"{spath}.parts[{pi}].type", "fill.code_inline_part_type",
+                           "code_inline 的 parts 中只能出现 code 或 slot")
+        else:
+            _issue(out, spath + ".type", "fill.segment_type", f"未知 segment 类型 {seg_type!r}")
+    return slots
+
+
+def _compile_fill(answer_style: str, normalize_code: Optional[Callable[[Any], Any]]) -> Check:
+    if answer_style == "value":
+        def answer_ok(a, options):
+            return a in options
+    else:
+        def answer_ok(a, options):
+            return isinstance(a, int) and not isinstance(a, bool) and 0 <= a < len(options)
+
+    def check(q, path, out):
+        key = next((k for k in CODE_KEYS if q.get(k) is not None), CODE_KEYS[0])
+        code = q.get(key)
+        if normalize_code is not None:
+            code = normalize_code(code)
+        elif isinstance(code, str):
+            try:
+                code = json.loads(code)
+            except ValueError:
+                pass
+        slots = _check_segments(code, f"{path}.{key}", out)
+        if not slots:
+            _issue(out, f"{path}.{key}", "fill.no_slot", "填空题至少需要一个 slot")
+        elif sorted(set(slots)) != list(range(max(slots) + 1)):
+            _issue(out, f"{path}.{key}", "fill.slot_index",
+                   f"slot 的 index 必须从 0 开始连续编号，实际为 {sorted(set(slots))}")
+
+        options = q.get("options")
+        if not isinstance(options, list) or not options:
+            _issue(out, path + ".options", "fill.options", "填空题 options 必须是非空数组")
+            options = []
+        answer = q.get("answer")
+        if not isinstance(answer, list) or not answer:
+            _issue(out, path + ".answer", "fill.answer", "填空题 answer 必须是非空数组")
+            return
+        for ai, a in enumerate(answer):
+            if not answer_ok(a, options):
+                _issue(out, f"{path}.answer[{ai}]", "fill.answer_range", f"答案 {a!r} 不在 options 范围内")
+    return check
+
+
+class UnitValidator:
+    """编译好的单元校验器：validator(unit) -> 问题列表；validator.question(q, qid, path) 校验单题。"""
+
+    def __init__(self, container: str, choice_check: Check, fill_check: Check, num_questions: int):
+        self.container = container
+        self.num_questions = num_questions
+        self._checks = {"choice": choice_check, "fill": fill_check}
+
+    def question(self, q: Any, qid: int, path: str = "$", expect: Optional[str] = None) -> List[Issue]:
+        out: List[Issue] = []
+        self._check_question(q, path, expect or expected_type(qid), out)
+        return out
+
+    def _check_question(self, q: Any, path: str, expect: str, out: List[Issue]):
+        if not isinstance(q, dict):
+            _issue(out, path, "question.not_object", "题目不是 JSON 对象")
+            return
+        q_type = q.get("type")
+        if q_type is None and self.container == "grouped":
+            q_type = expect  # 分组格式的题型由所在数组决定
+        q_type = str(q_type or "").strip().lower()
+        if q_type != expect:
+            _issue(out, path + ".type", "question.type", f"题型应为 {expect}，实际为 {q_type or '空'}")
+            return
+        for field in ("title", "content"):
+            if not isinstance(q.get(field), str) or not q[field].strip():
+                _issue(out, f"{path}.{field}", "question.text", f"{field} 必须是非空文本")
+        self._checks[expect](q, path, out)
+
+    def __call__(self, unit: Any) -> List[Issue]:
+        out: List[Issue] = []
+        if self.container == "grouped":
+            if not isinstance(unit, dict):
+                _issue(out, "$", "unit.container", "单元内容必须是带 choice_questions / fill_questions 的对象")
+                return out
+            n_fill = len(FILL_IDS) * self.num_questions // NUM_QUESTIONS_PER_UNIT
+            for key, expect, count in (("choice_questions", "choice", self.num_questions - n_fill),
+                                       ("fill_questions", "fill", n_fill)):
+                items = unit.get(key)
+                if not isinstance(items, list) or len(items) != count:
+                    got = len(items) if isinstance(items, list) else "无"
+                    _issue(out, f"$.{key}", "unit.count", f"{key} 应有 {count} 道，实际 {got}")
+                    items = items if isinstance(items, list) else []
+                for i, q in enumerate(items):
+                    self._check_question(q, f"$.{key}[{i}]", expect, out)
+            return out
+
+        if not isinstance(unit, list):
+            _issue(out, "$", "unit.container", "单元内容必须是题目数组")
+            return out
+        if len(unit) != self.num_questions:
+            _issue(out, "$", "unit.count", f"应有 {self.num_questions} 道题，实际 {len(unit)}")
+        for i, q in enumerate(unit):
+            self._check_question(q, f"$[{i}]", expected_type(i + 1), out)
+        return out
+
+
+def compile_unit_validator(container: str = "list", normalize_code: Optional[Callable[[Any], Any]] = None,
+                           num_questions: int = NUM_QUESTIONS_PER_UNIT) -> UnitValidator:
+    """按题目布局一次性构造校验器；normalize_code 用于先把字符串形式的 code_segments 规范化。"""
+    if container == "grouped":
+        return UnitValidator(container, _compile_choice("dict"), _compile_fill("value", normalize_code), num_questions)
+    if container == "list":
+        return UnitValidator(container, _compile_choice("list"), _compile_fill("index", normalize_code), num_questions)
+    raise ValueError(f"未知的 container: {container!r}")
+
+
+def format_issues(issues: List[Issue], limit: int = 10) -> str:
+    lines = [f"  {it['path']}  [{it['code']}] {it['message']}" for it in issues[:limit]]
+    if len(issues) > limit:
+        lines.append(f"  ... 另有 {len(issues) - limit} 个问题")
+    return "\n".join(lines)
+
+
+# ----------------------------
+# ========== 命令行 ==========
+# ----------------------------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="校验题目 JSON 文件（FinalScript 题目数组或 QuestionsNew 分组格式）")
+    ap.add_argument("paths", nargs="+", help="JSON 文件或目录（目录下递归查找 *.json）")
+    ap.add_argument("--grouped", action="store_true", help="按 {choice_questions, fill_questions} 分组格式校验")
+    args = ap.parse_args(argv)
+
+    files: List[Path] = []
+    for p in map(Path, args.paths):
+        files.extend(sorted(p.rglob("*.json")) if p.is_dir() else [p])
+    units = []
+    for f in files:
+        with open(f, "r", encoding="utf-8") as fh:
+            data = json.load(fh)
+        units.append((f, data.get("questions", data) if isinstance(data, dict) and not args.grouped else data))
+
+    validator = compile_unit_validator("grouped" if args.grouped else "list")
+    t0 = time.perf_counter()
+    results = [(f, validator(data)) for f, data in units]
+    elapsed = time.perf_counter() - t0
+
+    bad = 0
+    for f, issues in results:
+        if issues:
+            bad += 1
+            print(f"❌ {f}（{len(issues)} 个问题）\n{format_issues(issues)}")
+    print(f"校验 {len(results)} 个单元，{bad} 个不合格，耗时 {elapsed * 1000:.1f} ms")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
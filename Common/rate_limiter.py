@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+rate_limiter.py
+
+所有生成脚本（FinalScript / generate_questions / converter / transformer / library_generate）共用的限流器：
+- 两个令牌桶：每分钟请求数（RPM）与每分钟 token 数（TPM），按秒匀速回填
+- 桶状态保存在一个 SQLite 文件里，用 BEGIN IMMEDIATE 作跨进程锁，
+  同时运行多个脚本时共享同一份额度，不会各自为政把配额打爆
+- 收到 429 时按 Retry-After（没有则指数退避）写入全局冷却时间，所有进程在冷却结束前都不再发请求
+- acquire() 同步阻塞，供线程池使用；acquire_async() 供 asyncio 引擎使用
+- 请求结束后用 settle() 按 resp.usage 的实际 token 数多退少补
+- call() 供没有自己重试循环的脚本使用：429 登记共享冷却后重排队；5xx / 408 / 连接中断 / 超时等瞬时故障
+  （retry_policy.classify_failure 判为 transport）按带抖动的指数退避重试，客户端因此可以 max_retries=0；
+  失败的尝试退回预扣的 token（请求额度不退）
+
+用法：
+    limiter = SharedRateLimiter(scope="deepseek", rpm=120, tpm=400_000)
+    est = estimate_tokens_for_messages(messages, expected_completion=8000)
+    limiter.acquire(est)
+    try:
+        resp = client.chat.completions.create(...)
+        limiter.settle(est, usage_total_tokens(resp))
+    except Exception as e:
+        if is_rate_limited(e):
+            limiter.report_rate_limited(retry_after_seconds(e))
+"""
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, List, Optional
+
+from retry_policy import classify_failure, jittered_backoff
+
+# ----------------------------
+# ========== 配置区 ==========
+# ----------------------------
+# 所有脚本默认共用同一个数据库文件；可用环境变量 YPROGRAM_RATELIMIT_DB 改到别处
+DEFAULT_DB_PATH = Path(os.environ.get("YPROGRAM_RATELIMIT_DB", "")
+                       or Path(__file__).resolve().parent / ".runtime" / "rate_limiter.sqlite3")
+
+# 账号级额度（按实际套餐修改；两个桶的容量都等于一分钟的额度）
+DEFAULT_RPM = int(os.environ.get("YPROGRAM_RPM", "120"))
+DEFAULT_TPM = int(os.environ.get("YPROGRAM_TPM", "400000"))
+
+# 429 但没有 Retry-After 时的冷却：BASE * 2^(连续次数-1)，最多 MAX 秒
+DEFAULT_429_BACKOFF = 2.0
+MAX_429_BACKOFF = 60.0
+
+# call() 遇到瞬时故障（5xx / 连接中断 / 超时）时的重试次数与退避：full jitter，上限 BASE * FACTOR^(n-1) 与 MAX 取小
+TRANSIENT_RETRIES = 3
+TRANSIENT_BACKOFF_BASE = 1.0
+TRANSIENT_BACKOFF_FACTOR = 2.0
+TRANSIENT_BACKOFF_MAX = 30.0
+
+# 单次等待的最长轮询间隔（秒），避免长时间 sleep 错过其他进程退回的额度
+MAX_POLL_INTERVAL = 2.0
+
+
+# ----------------------------
+# ========== 辅助函数 ==========
+# ----------------------------
+def estimate_tokens(text: Optional[str]) -> int:
+    """粗略估算 token 数：中文字符约 0.6 token，其他字符约 0.3 token。"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    other = len(text) - cjk
+    return int(cjk * 0.6 + other * 0.3) + 1
+
+def estimate_tokens_for_messages(messages: List[dict], expected_completion: int = 0) -> int:
+    """估算一次 chat 请求会消耗的 token（输入 + 预期输出），用于预扣 TPM。"""
+    total = expected_completion
+    for m in messages:
+        total += estimate_tokens(m.get("content")) + 4
+    return total
+
+def usage_total_tokens(resp: Any) -> Optional[int]:
+    """从 OpenAI SDK 对象或原始 dict 中取出 usage.total_tokens；取不到返回 None。"""
+    usage = resp.get("usage") if isinstance(resp, dict) else getattr(resp, "usage", None)
+    if usage is None:
+        return None
+    total = usage.get("total_tokens") if isinstance(usage, dict) else getattr(usage, "total_tokens", None)
+    return int(total) if total is not None else None
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+def is_rate_limited(exc: BaseException) -> bool:
+    """openai.RateLimitError、requests.HTTPError 等只要状态码是 429 都算。"""
+    return _status_code(exc) == 429
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """解析响应头里的 retry-after-ms / Retry-After（秒数或 HTTP 日期）。"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return max(0.0, float(ms) / 1000.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+# ----------------------------
+# ========== 限流器 ==========
+# ----------------------------
+class SharedRateLimiter:
+    """
+    基于 SQLite 的跨进程令牌桶。
+    scope 区分不同账号/端点：同一 scope 的所有进程共享 RPM/TPM 与 429 冷却状态。
+    """
+
+    def __init__(self, scope: str = "deepseek", rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM,
+                 db_path: Optional[Path] = None):
+        self.scope = scope
+        self.rpm = max(1, int(rpm))
+        self.tpm = max(1, int(tpm))
+        self.db_path = Path(db_path or DEFAULT_DB_PATH)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cooldown (scope TEXT PRIMARY KEY, until REAL NOT NULL, strikes INTEGER NOT NULL)")
+
+    # ---------- SQLite ----------
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    class _Txn:
+        def __init__(self, conn: sqlite3.Connection):
+            self.conn = conn
+
+        def __enter__(self) -> sqlite3.Connection:
+            self.conn.execute("BEGIN IMMEDIATE")
+            return self.conn
+
+        def __exit__(self, exc_type, exc, tb):
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+            return False
+
+    def _transaction(self) -> "_Txn":
+        return SharedRateLimiter._Txn(self._conn())
+
+    def _refill(self, conn: sqlite3.Connection, name: str, capacity: float, now: float) -> float:
+        row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return capacity
+        tokens, updated = row
+        return min(capacity, tokens + max(0.0, now - updated) * capacity / 60.0)
+
+    def _store(self, conn: sqlite3.Connection, name: str, tokens: float, now: float):
+        conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (name, tokens, now))
+
+    # ---------- 核心接口 ----------
+    def try_acquire(self, tokens: int = 0) -> float:
+        """尝试取 1 个请求额度 + tokens 个 token；成功返回 0，否则返回建议等待的秒数（不扣额度）。"""
+        tokens = min(max(0, int(tokens)), self.tpm)
+        req_name, tok_name = f"{self.scope}:rpm", f"{self.scope}:tpm"
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT until FROM cooldown WHERE scope = ?", (self.scope,)).fetchone()
+            if row and row[0] > now:
+                return row[0] - now
+            req_avail = self._refill(conn, req_name, self.rpm, now)
+            tok_avail = self._refill(conn, tok_name, self.tpm, now)
+            if req_avail >= 1 and tok_avail >= tokens:
+                self._store(conn, req_name, req_avail - 1, now)
+                self._store(conn, tok_name, tok_avail - tokens, now)
+                return 0.0
+            wait_req = 0.0 if req_avail >= 1 else (1 - req_avail) * 60.0 / self.rpm
+            wait_tok = 0.0 if tok_avail >= tokens else (tokens - tok_avail) * 60.0 / self.tpm
+            return max(wait_req, wait_tok, 0.01)
+
+    def acquire(self, tokens: int = 0, cancel_event: Optional[threading.Event] = None) -> bool:
+        """阻塞直到拿到额度；cancel_event 被置位时提前返回 False。"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return True
+            wait = min(wait, MAX_POLL_INTERVAL)
+            if cancel_event is not None:
+                if cancel_event.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0) -> bool:
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, tokens)
+            if wait <= 0:
+                return True
+            await asyncio.sleep(min(wait, MAX_POLL_INTERVAL))
+
+    def settle(self, estimated: int, actual: Optional[int]):
+        """请求完成后按实际用量修正 TPM 桶：估多了退回，估少了补扣（可为负，后续请求自然等待）。"""
+        if actual is None:
+            return
+        delta = int(estimated) - int(actual)
+        if delta == 0:
+            return
+        name = f"{self.scope}:tpm"
+        now = time.time()
+        with self._transaction() as conn:
+            avail = self._refill(conn, name, self.tpm, now)
+            self._store(conn, name, min(self.tpm, avail + delta), now)
+
+    def report_rate_limited(self, retry_after: Optional[float] = None) -> float:
+        """记录一次 429，设置全局冷却并返回冷却秒数。"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT until, strikes FROM cooldown WHERE scope = ?", (self.scope,)).fetchone()
+            strikes = (row[1] if row else 0) + 1
+            if retry_after is None:
+                retry_after = min(MAX_429_BACKOFF, DEFAULT_429_BACKOFF * (2 ** (strikes - 1)))
+            until = max(now + retry_after, row[0] if row else 0.0)
+            conn.execute("INSERT OR REPLACE INTO cooldown (scope, until, strikes) VALUES (?, ?, ?)",
+                         (self.scope, until, strikes))
+        print(f"[LIMIT] {self.scope} 收到 429，全局冷却 {until - now:.1f}s（连续第 {strikes} 次）")
+        return until - now
+
+    def report_success(self):
+        """成功一次后清零连续 429 计数（不影响尚未结束的冷却）。"""
+        with self._transaction() as conn:
+            conn.execute("UPDATE cooldown SET strikes = 0 WHERE scope = ? AND strikes != 0", (self.scope,))
+
+    def call(self, fn, est_tokens: int = 0, rate_limit_retries: int = 3,
+             transient_retries: int = TRANSIENT_RETRIES):
+        """
+        acquire → fn() → settle 的便捷封装，给没有自己重试循环的脚本用。
+        fn 抛出 429 时登记共享冷却并重新排队，最多 rate_limit_retries 次；
+        瞬时故障（classify_failure 判为 transport）退避后重试，最多 transient_retries 次；其他异常原样抛出。
+        """
+        rate_limited, transient = 0, 0
+        while True:
+            self.acquire(est_tokens)
+            try:
+                resp = fn()
+            except Exception as e:
+                self.settle(est_tokens, 0)
+                if is_rate_limited(e):
+                    self.report_rate_limited(retry_after_seconds(e))
+                    rate_limited += 1
+                    if rate_limited > rate_limit_retries:
+                        raise
+                    continue
+                if classify_failure(e) != "transport" or transient >= transient_retries:
+                    raise
+                transient += 1
+                delay = jittered_backoff(transient, TRANSIENT_BACKOFF_BASE, TRANSIENT_BACKOFF_FACTOR,
+                                         TRANSIENT_BACKOFF_MAX)
+                print(f"[LIMIT] {self.scope} 瞬时故障（{type(e).__name__}: {e}），{delay:.1f}s 后第 {transient} 次重试")
+                time.sleep(delay)
+                continue
+            self.settle(est_tokens, usage_total_tokens(resp))
+            self.report_success()
+            return resp
+
+    def cooldown_remaining(self) -> float:
+        row = self._conn().execute("SELECT until FROM cooldown WHERE scope = ?", (self.scope,)).fetchone()
+        return max(0.0, row[0] - time.time()) if row else 0.0
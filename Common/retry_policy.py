@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+retry_policy.py
+
+按失败类别区分的重试策略（FinalScript v7 的单元请求使用）：
+- classify_failure：把异常归为以下类别
+  - "transport"：连接失败 / 超时 / 5xx / 408，服务端或网络的临时问题 —— 带抖动的指数退避后重发
+  - "rate_limited"：429 —— 冷却交给共享限流器（Common/rate_limiter.py）统一处理，本地不再睡眠，
+    也不消耗重试次数（只受 max_deferrals 约束，防止无限排队）
+  - "parse"：有返回但解析不出题目（JSON 错误、StreamAbort 等）—— 先做本地修复，再只把坏片段交给便宜模型修 JSON，
+    都不行才整单元重发（立即重发，等待没有意义）
+  - "cancelled"：Ctrl-C / 取消 —— 不重试
+  - "other"：其余 4xx 等 —— 按 transport 的退避重发
+  结构校验不合格（"validation"）不是异常，由调用方逐题重新生成，只在账本里计数
+- jittered_backoff：full jitter，延迟在 [0, min(cap, base * factor^(n-1))] 内均匀分布，避免大量单元在同一时刻重试
+- RetryBudget：一次请求循环的预算（第几次尝试、还能不能再试）
+- RetryLedger：线程安全的 {类别: {处理方式: 次数}} 账本，写进运行汇总
+
+用法：
+    budget = RetryBudget(RETRY_ATTEMPTS, RATE_LIMIT_MAX_DEFERRALS)
+    while budget.can_try():
+        attempt = budget.begin()
+        try:
+            ...; break
+        except Exception as e:
+            cls = classify_failure(e)
+            if not budget.failed(cls):
+                break
+            time.sleep(jittered_backoff(attempt, 1.0, 2.0, 30.0) if cls in BACKOFF_CLASSES else 0.0)
+"""
+import asyncio
+import random
+import threading
+from typing import Dict, Optional
+
+from openai import APIConnectionError
+
+from cancellation import Cancelled
+
+FAILURE_CLASSES = ("transport", "rate_limited", "parse", "validation", "truncated", "cancelled", "other")
+BACKOFF_CLASSES = ("transport", "other")   # 需要退避的类别；429 交给限流器，解析失败立即重发
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+def classify_failure(exc: BaseException) -> str:
+    if isinstance(exc, (Cancelled, asyncio.CancelledError)):
+        return "cancelled"
+    status = _status_code(exc)
+    if status == 429:
+        return "rate_limited"
+    if status is not None:
+        return "transport" if status >= 500 or status == 408 else "other"
+    if isinstance(exc, (APIConnectionError, asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return "transport"
+    if isinstance(exc, ValueError) or type(exc).__name__ == "StreamAbort":
+        return "parse"
+    return "other"
+
+def jittered_backoff(attempt: int, base: float, factor: float, cap: float,
+                     rng: Optional[random.Random] = None) -> float:
+    ceiling = min(cap, base * factor ** max(0, attempt - 1))
+    return (rng or random).uniform(0.0, ceiling)
+
+
+class RetryBudget:
+    """max_attempts 为除 429 以外最多失败几次；429 另计，最多 max_deferrals 次。"""
+
+    def __init__(self, max_attempts: int, max_deferrals: int = 10):
+        self.max_attempts = max_attempts
+        self.max_deferrals = max_deferrals
+        self.attempts = 0     # 实际发出的尝试次数
+        self.failures = 0
+        self.deferrals = 0
+        self.stopped = False
+
+    def can_try(self) -> bool:
+        return not self.stopped and self.failures < self.max_attempts
+
+    def begin(self) -> int:
+        self.attempts += 1
+        return self.attempts
+
+    def failed(self, failure_class: str) -> bool:
+        """记一次失败，返回是否还能再试。"""
+        if failure_class == "cancelled":
+            self.stopped = True
+        elif failure_class == "rate_limited" and self.deferrals < self.max_deferrals:
+            self.deferrals += 1
+        else:
+            self.failures += 1
+        return self.can_try()
+
+
+class RetryLedger:
+    def __init__(self):
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, failure_class: str, action: str, n: int = 1):
+        if n <= 0:
+            return
+        with self._lock:
+            actions = self._counts.setdefault(failure_class, {})
+            actions[action] = actions.get(action, 0) + n
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {cls: dict(self._counts[cls]) for cls in FAILURE_CLASSES if cls in self._counts}
+
+    def format(self) -> str:
+        parts = [f"{cls}（{', '.join(f'{a}={n}' for a, n in actions.items())}）"
+                 for cls, actions in self.summary().items()]
+        return "[RETRY] " + ("；".join(parts) if parts else "没有失败")
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+library_llm.py
+
+资料库生成脚本（library_generate / library_generate_cpp）共用的模型调用路径：
+- 稳定 prompt 前缀：固定规则放在 system 里（PROMPT_TEMPLATE 按脚本配置格式化），每个主题只在 user 消息里给出主题与起始 lb_id
+- LibraryLLM：进程内共享的 keep-alive 客户端 + 共享限流（429 / 瞬时故障重排队）+ 响应缓存 + 调用埋点；
+  save_result 做基本格式检查、按 <语言>_<主题>_lb<起始 lb_id>.<格式> 写入输出目录，并记录单元结果与条目数
+
+用法：
+    LLM = LibraryLLM("library_generate", MODEL, library_system_prompt(15, "Python", "intermediate", "sql", 1),
+                     DEEPSEEK_API_KEY, DEEPSEEK_ENDPOINT, OUT_DIR, "Python", "sql")
+    content = LLM.call(LLM.messages(theme, start_lb_id), unit=start_lb_id)
+    LLM.save_result(theme, start_lb_id, content)
+"""
+import re
+import json
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Common"))
+from rate_limiter import SharedRateLimiter, estimate_tokens_for_messages
+from llm_cache import ResponseCache, cached_completion
+from llm_metrics import MetricsRecorder
+from prompt_prefix import PromptPrefix
+from http_client import openai_client
+
+# 共享限流（替代原来的固定 SLEEP_BETWEEN_CALLS）：与其他生成脚本共用同一份 RPM/TPM 额度
+RATE_LIMIT_SCOPE = "deepseek"
+RATE_LIMIT_RPM = 120
+RATE_LIMIT_TPM = 400000
+EXPECTED_COMPLETION_TOKENS = 8000
+
+# 非流式请求，参与缓存键计算
+REQUEST_PARAMS = {"stream": False}
+
+# 固定规则（只随脚本配置变化）放在 system 里作为稳定前缀；每个主题只在最后的 user 消息里给出主题与起始 lb_id
+PROMPT_TEMPLATE = """你是一个严格遵守指示并输出机器可解析格式（SQL/JSON）的助手。
+生成要求：请为我的资料库生成 {count} 条条目，语言为 "{lang}"，主题见最后的用户消息，难度为 "{difficulty}"，放在第 {page} 页，lb_id 从用户消息给出的起始值起按 1 递增。每条为**一个知识点一条**。输出格式选项：如果 {format}="sql"，请输出一条可直接执行的 SQL INSERT 语句（字段顺序严格为：lang, lb_id, difficulty, page, title, tags, summary, content, eg_in, eg_out），VALUES 中每条为一组括号并以逗号分隔，最后以分号结尾；如果 {format}="json"，请输出一个 JSON 数组，数组内每个对象包含字段：lang, lb_id, difficulty, page, title, tags, summary, content, eg_in, eg_out。字段约束和格式要求（必须严格遵守）： 
+- 不要包含 id 和 created_at（id 为自增，created_at 自动生成）。
+- lang 为小写语言名字符串（例如 \"python\"）。
+- lb_id 在同一 lang 下唯一，按要求从起始值开始递增。
+- difficulty 只能是 \"beginner\"、\"intermediate\" 或 \"advanced\" 之一。
+- page 为正整数。
+- title 与 summary 为单行文本（不要换行）；content 可为多行文本（允许换行）。
+- tags 必须是**严格的 JSON 字符串数组**，例如 '[\"变量\",\"数据结构\"]'（注意内层双引号并作为字符串）。
+- eg_in 与 eg_out 必须是**严格的 JSON 字符串数组**，每个元素为示例代码或输出文本；代码中的换行请用两个字符的转义序列 \\n 表示（例如 \"x = 1\\nprint(x)\"）。注意！\n要写成\\n！。
+- 所有字符串内的双引号和反斜杠需正确转义以保证输出为合法 SQL/JSON。
+- 每个条目聚焦单一知识点，title 要简洁明了，summary 为一句话的简短总结，content 给出详尽说明与必要示例解释，eg_in 提供 1~3 个代码样例（使用 \\n 分行），eg_out 给出对应的输出样例。
+- 如果用户未指定起始 lb_id，默认从 1 开始；如果未指定 page，默认 page=1。
+- 生成时不要提出任何澄清问题，若有必要可做合理默认并在输出第一行用注释说明所采用的默认值（仅当 format=sql 时用 SQL 注释 --，format=json 时用单行注释 //）。
+- 重要！！务必检查一遍eg_in和eg_out中\n是否全部变成\\n！（一个杠+字母n要变成两个杠+字母n）
+"""
+USER_TEMPLATE = "主题：\"{theme}\"\nlb_id 起始值：{start_lb_id}"
+
+
+def library_system_prompt(count: int, lang: str, difficulty: str, fmt: str, page: int) -> str:
+    return PROMPT_TEMPLATE.format(count=count, lang=lang, difficulty=difficulty, format=fmt, page=page)
+
+def slugify(name: str) -> str:
+    s = name.strip().lower()
+    s = re.sub(r'[^a-z0-9]+', '_', s)
+    s = re.sub(r'_{2,}', '_', s).strip('_')
+    return s or "theme"
+
+def ensure_sql_semicolon(txt: str) -> str:
+    txt = txt.rstrip()
+    if not txt.endswith(";"):
+        txt = txt + ";"
+    return txt
+
+def count_entries(content: str, fmt: str) -> int:
+    """粗略统计生成的条目数：JSON 取数组长度，SQL 按 VALUES 中 "),(" 分隔计数。"""
+    if fmt == "json":
+        try:
+            parsed = json.loads(content)
+        except Exception:
+            return 0
+        return len(parsed) if isinstance(parsed, list) else 0
+    if "VALUES" not in content.upper():
+        return 0
+    return len(re.findall(r'\)\s*,\s*\(', content)) + 1
+
+def basic_validate(content: str, fmt: str):
+    if fmt == "json":
+        try:
+            _ = json.loads(content)
+            print("  JSON: parse OK")
+        except Exception as e:
+            print("  JSON: parse FAILED:", e)
+    else:
+        if ";" not in content:
+            print("  WARNING: SQL output可能缺少分号 ;")
+        else:
+            print("  SQL: 包含分号 (基本检查)")
+
+def save_output(out_dir: Path, lang: str, fmt: str, theme: str, start_lb_id: int, content: str):
+    slug = slugify(theme)
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    if fmt == "sql":
+        filename = Path(out_dir) / f"{lang}_{slug}_lb{start_lb_id}.sql"
+        content = ensure_sql_semicolon(content)
+    else:
+        filename = Path(out_dir) / f"{lang}_{slug}_lb{start_lb_id}.json"
+        try:
+            parsed = json.loads(content)
+            content = json.dumps(parsed, indent=2, ensure_ascii=False)
+        except Exception:
+            pass
+    filename.write_text(content, encoding="utf-8")
+    print(f"Saved {fmt.upper()} -> {filename}")
+
+
+class LibraryLLM:
+    """一个生成脚本的调用路径：限流器、响应缓存、埋点（Common/.runtime/metrics/<script>.jsonl）、prompt 前缀与输出位置。"""
+
+    def __init__(self, script: str, model: str, system_prompt: str, api_key: str, endpoint: str,
+                 out_dir: Path, lang: str, fmt: str):
+        self.model = model
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.out_dir = out_dir
+        self.lang = lang
+        self.fmt = fmt
+        self.limiter = SharedRateLimiter(scope=RATE_LIMIT_SCOPE, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM)
+        # 同一主题 + 同一 prompt 重跑时直接复用上次的返回（命中时不请求 API）
+        self.cache = ResponseCache()
+        self.metrics = MetricsRecorder(script)
+        self.prompt = PromptPrefix(script, system_prompt, USER_TEMPLATE)
+
+    def messages(self, theme: str, start_lb_id: int) -> List[dict]:
+        return self.prompt.messages(theme=theme, start_lb_id=start_lb_id)
+
+    def call(self, messages: List[dict], unit: Optional[int] = None) -> str:
+        # 进程内共享同一个客户端与 keep-alive 连接，不再每个主题重新握手
+        client = openai_client(self.api_key, self.endpoint, max_connections=1)
+
+        with self.metrics.track(unit=unit, model=self.model) as call:
+            record = cached_completion(
+                self.cache, self.model, messages, REQUEST_PARAMS,
+                lambda: self.limiter.call(
+                    call.attempt(lambda: client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        **REQUEST_PARAMS
+                    )),
+                    estimate_tokens_for_messages(messages, EXPECTED_COMPLETION_TOKENS)
+                )
+            )
+            call.finish(record)
+        if record["cached"]:
+            print("  命中响应缓存，未请求 API")
+        content = record["raw_text"]
+        if content is None:
+            # fallback
+            content = json.dumps(record, ensure_ascii=False)
+        return content
+
+    def save_result(self, theme: str, start_lb_id: int, content: str):
+        """在线与批量结果共用的保存步骤：基本检查 → 写文件 → 记录单元结果（条目数）。"""
+        basic_validate(content, self.fmt)
+        try:
+            save_output(self.out_dir, self.lang, self.fmt, theme, start_lb_id, content)
+            self.metrics.unit(start_lb_id, "ok", questions=count_entries(content, self.fmt), theme=theme)
+        except Exception as e:
+            print("保存文件失败:", e)
+            self.metrics.unit(start_lb_id, "error", theme=theme, error=repr(e))
@@ -13,8 +13,13 @@ import re
 import json
 import ast
 import os
+import sys
+from pathlib import Path
 from typing import Any, Dict, List, Optional
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Common"))
+from json_repair import JSONRepairError, format_fixes, parse_json_tolerant
+
 # ----------------------------
 # CONFIG - 把要处理的 txt 文件路径写在这里
 # ----------------------------
@@ -109,7 +114,7 @@ def parse_text_to_obj(s: str) -> Any:
     尝试多种策略将文本解析为 Python 对象（dict/list）。
     顺序：
       1. json.loads
-      2. json.loads after removing comments/trailing commas
+      2. Common/json_repair.py 一遍扫描修复（围栏、注释、尾随逗号、单引号字符串、True/False/None、未转义的引号等）
       3. ast.literal_eval after normalization
     如果都失败，抛出 ValueError。
     """
@@ -120,13 +125,16 @@ def parse_text_to_obj(s: str) -> Any:
     except Exception:
         pass
 
-    # 2) 先做基本预处理（去注释、尾随逗号）再尝试 JSON
-    cleaned = preprocess_raw_text(raw)
+    # 2) 本地修复后再解析
     try:
-        return json.loads(cleaned)
-    except Exception:
+        obj, fixes = parse_json_tolerant(raw)
+        print(f"[INFO] JSON 已在本地修复：{format_fixes(fixes)}")
+        return obj
+    except JSONRepairError:
         pass
 
+    cleaned = preprocess_raw_text(raw)
+
     # 3) 尝试 ast.literal_eval（把 true/false/null 替换为 Python 词）
     try:
         py_ready = normalize_true_false_null(cleaned)
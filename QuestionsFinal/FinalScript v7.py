@@ -6,33 +6,170 @@ generate_and_export_sql_final_v2.py
 已按用户最新要求做小范围修改：
 - hints 字段写入 SQL 前做反斜杠双重转义（每个 '\' -> '\\'）
 - 若填空题的 code 字段缺少最外层 "segments" 包装，则自动补上：{ "segments": [...] }
-其余逻辑（API 调用、并发、路径、表结构等）保持不变。
+- 单元请求经 Common/ 下的共享限流、后端池、响应缓存与调用埋点发出，可选 asyncio 引擎；
+  各项行为由配置区的常量开关控制（每个常量旁有说明）
+
+用法：
+    python "FinalScript v7.py"                      # 生成 GLOBAL_UNIT_START..GLOBAL_UNIT_END
+    python "FinalScript v7.py" --resume             # 只补跑上次未完成 / 失败 / 被隔离的单元
+    python "FinalScript v7.py" --rebuild            # 从 json_raw 离线重建 sql 目录
+    python "FinalScript v7.py" --batch-submit / --batch-collect RESULTS
+其余逻辑（API 调用、路径、表结构等）保持不变。
 """
 import os
 import json
 import time
+import asyncio
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from typing import Dict, List, Any, Awaitable, Callable, Generator, Optional, Tuple
 import re
+import sys
+import argparse
+import threading
 
 # Requires: pip install openai
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, APITimeoutError, BadRequestError
+from openai.types.chat import ChatCompletion
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Common"))
+from rate_limiter import estimate_tokens_for_messages, usage_total_tokens
+from llm_cache import ResponseCache, cached_completion, cached_completion_async, make_cache_key
+from llm_metrics import MetricsRecorder, CallTracker
+from prompt_prefix import PromptPrefix
+from question_validator import compile_unit_validator, format_issues, issues_by_question, expected_type
+from incremental_json import IncrementalQuestionParser, StreamAbort
+from compact_questions import expand_question, expand_questions
+from hedging import HedgePolicy, run_hedged
+from cancellation import CancelToken, Cancelled, install_sigint_handler, http_timeout
+from http_client import openai_client, async_openai_client
+from backend_pool import Backend, BackendPool, load_backends
+from llm_batch import BatchEntry, BatchResult, write_batch_requests, read_batch_meta, collect_batch_results, meta_path_for
+from run_store import RunStore
+from model_cascade import TierCall, cascade_tiers, escalation_scope, tier_call_dict, summarize_cascade, format_cascade
+from job_ordering import load_unit_history, estimate_unit_costs, lpt_order, simulate_makespan
+from question_repair import (arrange_by_id, find_broken_questions, salvage_with_fragments, salvage_truncated,
+                             build_repair_messages, build_continuation_messages, build_json_fix_messages,
+                             merge_repaired_questions, merge_fixed_questions, merge_group_questions, ordered_questions)
+from review_digest import review_sources, load_unit_digest, format_review_context
+from json_repair import EXTRACTION_FIXES, JSONRepairError, format_fixes, parse_json_tolerant
+from retry_policy import BACKOFF_CLASSES, RetryBudget, RetryLedger, classify_failure, jittered_backoff
 
 # ----------------------------
 # ========== 配置区 ==========
 # ----------------------------
-DEEPSEEK_API_KEY = ""
-DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+# 环境变量 DEEPSEEK_API_KEY / DEEPSEEK_BASE_URL 优先（例如指向 Common/mock_llm_server.py 做离线压测）
+DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
+DEEPSEEK_BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
 MODEL_NAME = "deepseek-reasoner"
 
 STAGES = 5
 UNITS_PER_STAGE = 30
 NUM_QUESTIONS_PER_UNIT = 15
 
-MAX_WORKERS = 5
+MAX_WORKERS = 5  # 每个后端的线程数
+# 重试（Common/retry_policy.py）：RETRY_ATTEMPTS 为 429 以外的失败次数上限；连接失败 / 超时 / 5xx 的退避在
+# [0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_FACTOR^(n-1))] 秒内随机；429 由共享限流器冷却，最多排队 RATE_LIMIT_MAX_DEFERRALS 次
 RETRY_ATTEMPTS = 3
 RETRY_BACKOFF_FACTOR = 2
+RETRY_BACKOFF_MAX = 30
+RATE_LIMIT_MAX_DEFERRALS = 10
+
+# 超时（秒）：建立连接 / 两次收到数据之间的最长间隔 / 单次调用总时长（流式时为整个流）
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 300
+CALL_TIMEOUT = 900
+
+# HTTP/2（需要 pip install httpx[http2]，未安装时自动回退 HTTP/1.1）
+USE_HTTP2 = False
+
+# 异步引擎：True 使用 asyncio（单线程即可保持大量在途请求），False 回退到 ThreadPoolExecutor(MAX_WORKERS)
+USE_ASYNC_ENGINE = True
+ASYNC_INITIAL_CONCURRENCY = 20  # 初始在途请求数（每个后端）
+ASYNC_MIN_CONCURRENCY = 4       # 遇到 429/超时后最多降到这里（每个后端）
+ASYNC_MAX_CONCURRENCY = 50      # 连续成功后最多升到这里（每个后端）
+
+# 共享限流（Common/rate_limiter.py）：同一 scope 的所有脚本/进程共享额度
+RATE_LIMIT_SCOPE = "deepseek"
+RATE_LIMIT_RPM = 120
+RATE_LIMIT_TPM = 400000
+
+# 后端池（Common/backend_pool.py）：JSON 文件路径或 JSON 文本；None 时读环境变量 YPROGRAM_BACKENDS，
+# 都没有则只用上面的 DEEPSEEK_API_KEY / DEEPSEEK_BASE_URL（限流 scope 仍为 RATE_LIMIT_SCOPE）
+BACKENDS_PATH = None
+BACKEND_STRATEGY = "least_outstanding"  # 或 "weighted_rr"
+
+# 模型级联（model_cascade.py）：CASCADE_STAGES 内的单元先用 MODEL_CASCADE 中的模型（由便宜到贵），结构校验不过再升级，
+# 最后一档总是 MODEL_NAME；坏题数 ≤ 题数 × CASCADE_MAX_QUESTION_FRACTION 时只升级坏题，否则整单元升级。
+# 默认 [] 关闭（所有单元只用 MODEL_NAME）；开启会改变由哪个模型生成题目，例如 MODEL_CASCADE = ["deepseek-chat"]
+MODEL_CASCADE = []
+CASCADE_STAGES = [1]  # None = 所有阶段
+CASCADE_MAX_QUESTION_FRACTION = 0.4
+# 每百万 token 单价（元，输入 / 输出），只用于级联的费用节省估计，按当前价格表修改
+MODEL_PRICES = {"deepseek-chat": (2.0, 8.0), "deepseek-reasoner": (4.0, 16.0)}
+
+# 按题型拆分：每个单元拆成几个并发子请求，每组题号必须同一题型（题号 4–5、9–10、14–15 为填空题，其余为选择题）
+SPLIT_UNIT_REQUESTS = False
+SPLIT_GROUPS = [[1, 2, 3, 6, 7, 8, 11, 12, 13], [4, 5, 9, 10, 14, 15]]  # 可再细分，如 [[1, 2, 3, 6, 7, 8, 11, 12, 13], [4, 5, 9], [10, 14, 15]]
+
+# 复习素材（review_digest.py）：复习单元的 user 消息附上被复习单元已出题目的摘要（标题 + 解析首句），
+# 复习单元等本次运行中的被复习单元完成后再开始；REVIEW_CONTEXT_MAX_CHARS 为摘要总字数上限
+USE_REVIEW_DIGESTS = False
+REVIEW_CONTEXT_MAX_CHARS = 2000
+
+# 调度顺序：lpt = 预估耗时最长的单元先提交（job_ordering.py）；sequential = 按单元号
+JOB_ORDER = "lpt"
+EXPECTED_COMPLETION_TOKENS = 8000  # 预扣 TPM 用的单次输出估计（reasoner 含思考链），完成后按 usage 修正
+
+# 响应缓存（Common/llm_cache.py）：命中时不请求 API；重试时跳过读取、用新结果覆盖
+USE_RESPONSE_CACHE = True
+# 调用埋点 JSONL；None 使用 Common/.runtime/metrics/finalscript_v7.jsonl
+METRICS_PATH = None
+SAMPLING_PARAMS = {}  # 传给 chat.completions.create 的采样参数（会参与缓存键计算）
+
+# 请求对冲（仅异步引擎）：慢请求超过实时 P 分位阈值后发副本，先成功者胜出
+ENABLE_HEDGING = False
+HEDGE_PERCENTILE = 90           # 阈值取本次运行已完成单元请求耗时的第几百分位
+HEDGE_MIN_SAMPLES = 5           # 样本不足时不对冲
+HEDGE_MAX_EXTRA_FRACTION = 0.1  # 对冲副本数 / 主请求数 的上限
+
+# 流式输出：逐题增量解析并落盘，异常输出提前中止（与非流式共用同一缓存键）
+USE_STREAMING = True
+
+# 结构化输出：prompt 要求把题目数组包进 {"questions": [...]} 对象；JSON_MODE_MODELS 中的模型再传
+# response_format={"type": "json_object"}，由服务端保证输出是合法 JSON（后端配置 "json_mode": false 或本次运行中
+# 端点拒绝该参数时，对该后端只靠 prompt 约束格式）。
+# 默认关闭：开启后 system prompt 会追加 OBJECT_WRAPPER_RULE（前缀缓存另起一份）。deepseek-reasoner 不接受
+# response_format，不要加进 JSON_MODE_MODELS，否则每次运行的第一批请求都会先收到 400 再回退
+STRUCTURED_OUTPUT = False
+JSON_MODE_MODELS = ["deepseek-chat"]
+
+# 模型输出格式："json" = 标准字段结构；"compact" = 紧凑位置数组（Common/compact_questions.py），本地展开后结果完全相同
+OUTPUT_FORMAT = "json"
+
+# 逐题修复：最多几轮只针对坏题号的补发请求
+ENABLE_QUESTION_REPAIR = True
+REPAIR_ROUNDS = 2
+
+# JSON 修复：本地修复后仍解析不了的题目片段只交给 JSON_FIX_MODEL 修语法（None 关闭）；片段总字数超过
+# JSON_FIX_MAX_CHARS 时不修，直接整单元重发
+JSON_FIX_MODEL = "deepseek-chat"
+JSON_FIX_MAX_CHARS = 6000
+
+# 截断续写：输出达到长度上限（finish_reason == "length"）时保留已完整的题目，在同一对话里只续写剩余题号，最多几轮
+CONTINUE_TRUNCATED = True
+CONTINUATION_ROUNDS = 2
+
+# 生成 SQL 前做结构校验；不合格单元写入 quarantine/ 而不是 sql/（False 时只打印警告仍照常导出）
+VALIDATE_BEFORE_SQL = True
+QUARANTINE_INVALID_UNITS = True
+
+# 运行清单（断点续跑 / 吞吐历史）；RUN_STORE_PATH=None 使用 Common/.runtime/run_store.sqlite3
+USE_RUN_STORE = True
+RUN_STORE_PATH = None
+
+# 批量推理：请求 / 元数据文件默认写到 BASE_OUT_DIR/batch/ 下
+BATCH_REQUESTS_PATH = None
 
 THEMES_TXT_PATH = Path(r"F:\\project\\YProgram\\QuestionsFinal\\Python questions outline.txt")
 BASE_OUT_DIR = Path(r"F:\\project\\YProgram\\QuestionsFinal\\Questions_v7")
@@ -151,6 +288,116 @@ SYSTEM_PROMPT = """
 
 USER_PROMPT_TEMPLATE = "我现在要生成的单元主题是：{theme}"
 
+def _prompt_section(start: str, end: Optional[str] = None) -> str:
+    """按标记从 SYSTEM_PROMPT 切出一段（含 start，不含 end）；标记对不上时导入即报错，提醒同步修改。"""
+    i = SYSTEM_PROMPT.index(start)
+    return SYSTEM_PROMPT[i:SYSTEM_PROMPT.index(end, i)] if end else SYSTEM_PROMPT[i:]
+
+# 按题型拆分时用的精简 system prompt：只保留该题型的字段规则、内容要求与输出示例
+SPLIT_SYSTEM_HEAD = SYSTEM_PROMPT[:SYSTEM_PROMPT.index("每单元题型和难度固定：")] + "本次请求只生成其中一种题型（题号见用户消息），格式要求如下：\n"
+CHOICE_SYSTEM_PROMPT = (SPLIT_SYSTEM_HEAD
+                        + _prompt_section("1.题号 1–3、6–8、11–13", "2.题号 4–5、9–10、14–15")
+                        + _prompt_section("3.题目难度分层", "2.传统选择题：")
+                        + _prompt_section("2.传统选择题：", "3.选择填空题：")
+                        + _prompt_section("4.若有“复习上一单元”", "- 重要！！！请务必检查一遍")
+                        + _prompt_section("输出示例，传统选择题：", "输出示例，选择填空题："))
+FILL_SYSTEM_PROMPT = (SPLIT_SYSTEM_HEAD
+                      + _prompt_section("2.题号 4–5、9–10、14–15", "3.题目难度分层")
+                      + _prompt_section("3.题目难度分层", "2.传统选择题：")
+                      + _prompt_section("3.选择填空题：", "输出示例，传统选择题：")
+                      + _prompt_section("输出示例，选择填空题："))
+SPLIT_USER_PROMPT_TEMPLATE = ("我现在要生成的单元主题是：{theme}\n"
+                              "本次只生成题号 {ids} 的{kind}（共 {count} 道），输出 JSON 数组，每个对象的 id 必须等于对应题号。")
+SPLIT_KIND_LABELS = {"choice": "传统选择题", "fill": "选择填空题"}
+
+# 紧凑格式的 system prompt：字段按位置排列，内容要求沿用 SYSTEM_PROMPT 中的同一段文字
+COMPACT_SYSTEM_HEAD = (SYSTEM_PROMPT[:SYSTEM_PROMPT.index("每单元题型和难度固定：")]
+                       + "每单元题型和难度固定：题号 1–3、6–8、11–13 为传统选择题（多选项 ABCD），"
+                       "题号 4–5、9–10、14–15 为“选择填空题”（在完整代码或语句中挖空，选项为若干代码片段/字符串/符号，可远多于 4 个干扰项）。\n"
+                       "为节省输出，使用紧凑格式：整个单元输出一个 JSON 数组，每道题是一个按位置排列的 JSON 数组，"
+                       "不写字段名，第一个元素是题型标记（\"c\" 或 \"f\"）：\n")
+COMPACT_CHOICE_RULES = """1.传统选择题：["c", id, title, content, options, answer, hints, explanation, example]
+（1）id：题目序号，整数。
+（2）title：简短的标题。
+（3）content：详细的题目内容；使用情景化和幽默的语言；不可多行。
+（4）options：4个选项的内容，字符串数组。
+（5）answer：答案，一个大写字母。
+（6）hints：3个提示，用于答错后显示；提示程度逐渐递增，每项字数在10字左右，字符串数组。
+（7）explanation：对正确答案的解释，用于答对后显示，字数在60字左右，不要换行。
+（8）example：1个示例；用于答对后显示，提升用户举一反三的能力，字数在30字左右。
+"""
+COMPACT_FILL_RULES = """2.选择填空题：["f", id, title, content, input, output, code, options, answer, explanation, example]
+（1）id、title、content：同传统选择题。
+（2）input：题目中的程序运行时的输入；可有可无，根据代码情况决定；null 或字符串数组，一项代表一行。
+（3）output：题目中的程序运行时的输出；可有可无，根据代码情况决定；null 或字符串数组，一项代表一行。
+（4）code：题目的代码；字符串数组，一项就是一行代码（保留行首缩进）；挖空处写 __0__、__1__ ……，
+数字为挖空编号，0-based，按从上到下、从左到右递增；同一行可以有多个挖空；至少要有一个挖空；除挖空外不要出现“__数字__”形式的文本。
+（5）options：可填入挖空的选项；必须有；有干扰项；有多个，数量根据题目情况决定；字符串数组。
+（6）answer：按挖空编号顺序给出每个挖空对应的选项下标（0-based）；每个选项只能使用一次；必须有；整数数组。
+（7）explanation、example：同传统选择题。
+"""
+COMPACT_CONTENT_RULES = _prompt_section("3.题目难度分层", "使用严格标准的JSON格式输出")
+COMPACT_FORMAT_RULES = "使用严格标准的JSON格式输出；每道题占一行；字符串使用标准的转义字符；不需要注释，不要输出数组以外的任何文字。\n"
+COMPACT_EXAMPLES = {
+    "choice": ["c", 1, "print初体验", "阿珍想用Python在控制台点一份‘炸鸡’，下面哪种写法是正确的呢？",
+               ["print(炸鸡)", "print(\"炸鸡\")", "print(‘炸鸡’)", "print炸鸡"], "B",
+               ["想想看，直接写中文‘炸鸡’，计算机会认识它吗？", "在Python中，直接写中文单词（变量名除外）通常需要用引号包起来。",
+                "print是一个函数，调用时需要括号；引号必须是英文半角符号。"],
+               "print是一个函数，用于输出内容。要输出文本（字符串），必须用英文半角引号将其包裹起来。"
+               "选项A缺少引号；选项C使用了中文全角单引号；选项D缺少调用函数的括号。",
+               "正确用法：print(\"Hello World\") 或 print('Hello World')。"],
+    "fill": ["f", 4, "填空问候", "帮助小机器人完成代码，让它说出'Hello, Python!'。", None, ["Hello, Python!"],
+             ["words = \"Hello, Python!\"", "__0__(__1__)"], ["print", "input", "words", "\"words\"", "len"], [0, 2],
+             "先用变量words保存要说的话，再用print函数输出变量的值；写成\"words\"会原样输出这个单词。",
+             "类似地，name = \"Tom\" 之后用 print(name) 输出 Tom。"],
+}
+
+def _compact_system_prompt(kinds: Tuple[str, ...]) -> str:
+    rules = {"choice": COMPACT_CHOICE_RULES, "fill": COMPACT_FILL_RULES}
+    examples = ",\n".join(json.dumps(COMPACT_EXAMPLES[k], ensure_ascii=False) for k in kinds)
+    return (COMPACT_SYSTEM_HEAD + "".join(rules[k] for k in kinds) + "\n" + COMPACT_CONTENT_RULES
+            + COMPACT_FORMAT_RULES + "\n输出示例：\n```\n[\n" + examples + "\n]\n```\n")
+
+COMPACT_SYSTEM_PROMPT = _compact_system_prompt(("choice", "fill"))
+
+# 结构化输出时追加在 system 末尾（逐题修复 / 截断续写要求的数组同样包进该对象）
+OBJECT_WRAPPER_RULE = ('\n最外层输出格式：输出一个 JSON 对象 {"questions": [...]}，把上面要求输出的题目数组'
+                       '（包括只重新生成 / 续写部分题号时的数组）放在 questions 字段中；对象中不要有其他字段，对象以外不要输出任何文字。\n')
+
+def _prompt(name: str, system_prompt: str, user_template: str) -> PromptPrefix:
+    """STRUCTURED_OUTPUT 时 system 加上包装对象的要求，前缀另起名字登记（与数组格式的前缀互不影响）。"""
+    if STRUCTURED_OUTPUT:
+        return PromptPrefix(name + "_object", system_prompt + OBJECT_WRAPPER_RULE, user_template)
+    return PromptPrefix(name, system_prompt, user_template)
+
+# 所有单元（含逐题修复）共用的规范化前缀：system 逐字节一致、单元相关内容只放在最后的 user 消息里
+PROMPTS = {
+    "json": _prompt("finalscript_v7", SYSTEM_PROMPT, USER_PROMPT_TEMPLATE),
+    "compact": _prompt("finalscript_v7_compact", COMPACT_SYSTEM_PROMPT, USER_PROMPT_TEMPLATE),
+}
+PROMPT = PROMPTS[OUTPUT_FORMAT]
+SPLIT_PROMPTS = {
+    "json": {
+        "choice": _prompt("finalscript_v7_choice", CHOICE_SYSTEM_PROMPT, SPLIT_USER_PROMPT_TEMPLATE),
+        "fill": _prompt("finalscript_v7_fill", FILL_SYSTEM_PROMPT, SPLIT_USER_PROMPT_TEMPLATE),
+    },
+    "compact": {
+        "choice": _prompt("finalscript_v7_compact_choice", _compact_system_prompt(("choice",)),
+                          SPLIT_USER_PROMPT_TEMPLATE),
+        "fill": _prompt("finalscript_v7_compact_fill", _compact_system_prompt(("fill",)),
+                        SPLIT_USER_PROMPT_TEMPLATE),
+    },
+}
+
+# 复习单元的复习素材（review_digest.py）：附在 user 消息末尾，system 前缀不变
+REVIEW_CONTEXT_TEMPLATE = ("\n复习素材（之前单元已出过的题目摘要；第6–10题的复习题请围绕这些知识点出新题，不要照抄原题）：\n"
+                           "{context}")
+
+# 离线重建（--rebuild）默认参数：数据来源、输出目录（None 表示写回 BASE_OUT_DIR）、进程数（None 表示 CPU 核数）
+REBUILD_SOURCE = "json_raw"
+REBUILD_OUT_DIR = None
+REBUILD_WORKERS = None
+
 GLOBAL_UNIT_START = 1
 GLOBAL_UNIT_END = 2  # 修改为 150 生成全部（5*30=150）
 
@@ -167,10 +414,75 @@ def read_themes_file(path: str) -> List[str]:
     with open(path, "r", encoding="utf-8") as f:
         return [ln.strip() for ln in f.readlines() if ln.strip()]
 
-def init_client(api_key: str) -> OpenAI:
-    if not api_key:
-        raise RuntimeError("DEEPSEEK_API_KEY 未设置，请在环境变量或脚本顶部填写。")
-    return OpenAI(api_key=api_key, base_url=DEEPSEEK_BASE_URL)
+def client_connections(pool: BackendPool, engine_async: bool) -> int:
+    """
+    每个后端客户端的连接池大小：取全部在途请求的上限，因为熔断 / 冷却时所有请求可能落到同一个健康后端。
+    同步引擎为 单元线程数 × 每单元并发子请求数；异步引擎为并发闸门上限（对冲副本同样经过闸门）。
+    连接池不够时请求会排队等连接，超过 pool 超时即 PoolTimeout 并白白消耗重试次数。
+    """
+    if engine_async:
+        return ASYNC_MAX_CONCURRENCY * len(pool)
+    return MAX_WORKERS * len(pool) * (len(SPLIT_GROUPS) if SPLIT_UNIT_REQUESTS else 1)
+
+def init_clients(pool: BackendPool) -> Dict[str, OpenAI]:
+    """每个后端一个进程内共享的客户端，按后端名索引。"""
+    for b in pool.backends:
+        if not b.api_key:
+            raise RuntimeError(f"后端 {b.name} 的 API key 未设置（DEEPSEEK_API_KEY 或 BACKENDS_PATH），请在环境变量或脚本顶部填写。")
+    # max_retries=0：429 / 重试统一由本脚本与共享限流器处理，避免 SDK 内部重试绕过限流
+    return {b.name: openai_client(b.api_key, b.base_url, max_connections=client_connections(pool, False),
+                                  timeout=http_timeout(CONNECT_TIMEOUT, READ_TIMEOUT), http2=USE_HTTP2)
+            for b in pool.backends}
+
+def init_async_clients(pool: BackendPool) -> Dict[str, AsyncOpenAI]:
+    for b in pool.backends:
+        if not b.api_key:
+            raise RuntimeError(f"后端 {b.name} 的 API key 未设置（DEEPSEEK_API_KEY 或 BACKENDS_PATH），请在环境变量或脚本顶部填写。")
+    return {b.name: async_openai_client(b.api_key, b.base_url, max_connections=client_connections(pool, True),
+                                        timeout=http_timeout(CONNECT_TIMEOUT, READ_TIMEOUT), http2=USE_HTTP2)
+            for b in pool.backends}
+
+_backend_pool = None
+_shared_state_lock = threading.Lock()
+
+# 全局取消标志：Ctrl-C 后各 worker 在单元开始、重试等待、流式 chunk 之间检查
+CANCEL = CancelToken()
+RETRY_LEDGER = RetryLedger()
+
+def get_backend_pool() -> BackendPool:
+    global _backend_pool
+    with _shared_state_lock:
+        if _backend_pool is None:
+            default = Backend("default", DEEPSEEK_BASE_URL, DEEPSEEK_API_KEY,
+                              rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM, scope=RATE_LIMIT_SCOPE)
+            _backend_pool = BackendPool(load_backends(BACKENDS_PATH, default, RATE_LIMIT_SCOPE, primary_model=MODEL_NAME),
+                                        BACKEND_STRATEGY)
+            if len(_backend_pool) > 1:
+                print(f"[POOL] {len(_backend_pool)} 个后端（{BACKEND_STRATEGY}）：{_backend_pool.backends}")
+        return _backend_pool
+
+def backend_label(backend: Backend) -> str:
+    return "" if len(get_backend_pool()) == 1 else f"，后端 {backend.name}"
+
+_response_cache = None
+
+def get_response_cache() -> Optional[ResponseCache]:
+    global _response_cache
+    if not USE_RESPONSE_CACHE:
+        return None
+    with _shared_state_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
+
+_metrics = None
+
+def get_metrics() -> MetricsRecorder:
+    global _metrics
+    with _shared_state_lock:
+        if _metrics is None:
+            _metrics = MetricsRecorder("finalscript_v7", path=METRICS_PATH)
+        return _metrics
 
 def global_to_stage_unit(global_index: int) -> Tuple[int, int]:
     if global_index < 1:
@@ -182,31 +494,14 @@ def global_to_stage_unit(global_index: int) -> Tuple[int, int]:
 def calc_q_id(global_unit_index: int, index_in_unit_one_based: int) -> int:
     return (global_unit_index - 1) * NUM_QUESTIONS_PER_UNIT + index_in_unit_one_based
 
-def extract_json_from_text(text: str) -> Any:
+def extract_json_with_fixes(text: str) -> Tuple[Any, Dict[str, int]]:
+    """截取 JSON 并修复常见语法缺陷（Common/json_repair.py）；返回 (对象, 修复记录)，合法 JSON 的修复记录为空。"""
     if not isinstance(text, str):
         raise ValueError("AI 返回不是字符串")
-    txt = text.strip()
     try:
-        return json.loads(txt)
-    except Exception:
-        pass
-    lb = txt.find('[')
-    rb = txt.rfind(']')
-    if lb != -1 and rb != -1 and rb > lb:
-        candidate = txt[lb:rb+1]
-        try:
-            return json.loads(candidate)
-        except Exception:
-            pass
-    lb = txt.find('{')
-    rb = txt.rfind('}')
-    if lb != -1 and rb != -1 and rb > lb:
-        candidate = txt[lb:rb+1]
-        try:
-            return json.loads(candidate)
-        except Exception:
-            pass
-    raise ValueError("无法从 AI 返回中提取 JSON")
+        return parse_json_tolerant(text.strip())
+    except JSONRepairError as e:
+        raise ValueError(f"无法从 AI 返回中提取 JSON：{e}") from e
 
 # ----------------------------
 # ========== 新增/调整的转义与规范化函数 ==========
@@ -261,7 +556,8 @@ def escape_json_double_backslashes_for_sql(obj: Any) -> str:
 def normalize_fill_code_field(code_field: Any) -> Any:
     """
     规范化填空题的 code 字段：
-    - 若为字符串且内部是 JSON，解析之
+    - 若为字符串且整体是合法 JSON，解析之；否则保留原字符串（不做容错修复：code 字符串本身可能就是代码，
+      例如 "d = {'a': 1}"，修复会把它截成一个 dict）
     - 若返回的是单个 segment（dict 带 type='code_inline' 或 'code_block'）则包装为 {"segments": [segment]}
     - 若返回的是 list（segments 列表），则包装为 {"segments": list}
     - 修复 code_inline 中 {"type":"code","value":""} -> " "
@@ -272,15 +568,10 @@ def normalize_fill_code_field(code_field: Any) -> Any:
     if isinstance(code_field, str):
         txt = code_field.strip()
         try:
-            loaded = json.loads(txt)
-            code_field = loaded
-        except Exception:
-            try:
-                parsed = extract_json_from_text(txt)
-                code_field = parsed
-            except Exception:
-                # 保留原始字符串
-                return code_field
+            code_field = json.loads(txt)
+        except ValueError:
+            # 保留原始字符串
+            return code_field
     # 若是 list（假设这是 segments 列表），包装
     if isinstance(code_field, list):
         code_field = {"segments": code_field}
@@ -341,10 +632,15 @@ def sql_escape_json_field(obj: Any) -> str:
     j_escaped = j.replace("'", "''")
     return f"'{j_escaped}'"
 
+# 结构校验器只在导入时构造一次，生成 / 重建 / 逐题修复共用
+UNIT_VALIDATOR = compile_unit_validator("list", normalize_code=normalize_fill_code_field,
+                                        num_questions=NUM_QUESTIONS_PER_UNIT)
+
 # ----------------------------
 # ========== 单元处理 ==========
 # ----------------------------
-def process_single_unit(client: OpenAI, global_unit_index: int, theme: str, out_base: Path) -> dict:
+def unit_output_paths(global_unit_index: int, out_base: Path) -> dict:
+    """计算单元的各输出目录/文件路径，并确保目录存在。"""
     stage, unit_local = global_to_stage_unit(global_unit_index)
     # 修改：unit_id 从 global_unit_index 开始（1,2,3...）
     unit_id = global_unit_index
@@ -355,82 +651,144 @@ def process_single_unit(client: OpenAI, global_unit_index: int, theme: str, out_
     ensure_dir(parsed_dir)
     ensure_dir(raw_dir)
     ensure_dir(sql_dir)
+    return {
+        "stage": stage,
+        "unit_local": unit_local,
+        "unit_id": unit_id,
+        "parsed_path": parsed_dir / f"unit_{global_unit_index}_parsed.json",
+        "raw_path": raw_dir / f"unit_{global_unit_index}_raw.json",
+        "sql_path": sql_dir / f"unit{unit_id}.sql",
+        "stream_path": parsed_dir / f"unit_{global_unit_index}_stream.jsonl",
+        "digest_path": parsed_dir / f"unit_{global_unit_index}_digest.json",
+        "quarantine_path": out_base / "quarantine" / f"stage{stage}" / f"unit_{global_unit_index}_quarantine.json",
+    }
 
-    user_prompt = USER_PROMPT_TEMPLATE.format(theme=theme)
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": user_prompt}
-    ]
-
-    raw_text = None
-    parsed_questions = None
-    last_exc = None
-
-    sql_out_path = sql_dir / f"unit{unit_id}.sql"
-    if sql_out_path.exists():
-        print(f"⏭️ 已存在，跳过请求 API（第 {global_unit_index} 单元） -> {sql_out_path}")
-        return {
-            "status": "skipped",
-            "global_unit": global_unit_index,
-            "stage": stage,
-            "unit_local": unit_local,
-            "unit_id": unit_id,
-            "sql": str(sql_out_path)
-        }
-
-    for attempt in range(1, RETRY_ATTEMPTS + 1):
-        print(f"🚀尝试请求 API（第 {global_unit_index} 单元）")
-        try:
-            resp = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=messages,
-                stream=False
-            )
-            print(f"✅️成功请求 API（第 {global_unit_index} 单元）")
-            try:
-                raw_text = resp.choices[0].message.content
-            except Exception:
-                raw_text = json.dumps(resp, ensure_ascii=False)
-            parsed = extract_json_from_text(raw_text)
-            if isinstance(parsed, dict) and "questions" in parsed and isinstance(parsed["questions"], list):
-                parsed = parsed["questions"]
-            if not isinstance(parsed, list):
-                raise ValueError("解析得到的 JSON 不是题目数组 (list)。")
-            parsed_questions = parsed
-            break
-        except Exception as e:
-            last_exc = e
-            wait = RETRY_BACKOFF_FACTOR ** (attempt - 1)
-            print(f"❌[WARN] global_unit={global_unit_index} attempt={attempt} failed: {e}. retry in {wait}s")
-            time.sleep(wait)
-
-    raw_record_path = raw_dir / f"unit_{global_unit_index}_raw.json"
-    with open(raw_record_path, "w", encoding="utf-8") as rf:
-        json.dump({
-            "global_unit_index": global_unit_index,
-            "stage": stage,
-            "unit_local": unit_local,
-            "unit_id": unit_id,
-            "theme": theme,
-            "user_prompt": user_prompt,
-            "raw_text": raw_text
-        }, rf, ensure_ascii=False, indent=2)
+def prompt_messages(prompt: PromptPrefix, review: str = "", **template_vars) -> List[dict]:
+    """有复习素材时追加在 user 消息末尾；system 与 user 模板的固定开头不变，前缀缓存照常命中。"""
+    if not review:
+        return prompt.messages(**template_vars)
+    return prompt.messages(user_content=prompt.user_template.format(**template_vars)
+                           + REVIEW_CONTEXT_TEMPLATE.format(context=review))
+
+def build_unit_messages(theme: str, review: str = "") -> Tuple[str, List[dict]]:
+    messages = prompt_messages(PROMPT, review, theme=theme)
+    return messages[-1]["content"], messages
+
+def split_unit_plan() -> List[Tuple[str, List[int]]]:
+    """SPLIT_GROUPS -> [(题型, 题号列表)]；每组必须同一题型，所有组合起来正好覆盖 1..NUM_QUESTIONS_PER_UNIT。"""
+    plan = []
+    for ids in SPLIT_GROUPS:
+        kinds = {expected_type(qid) for qid in ids}
+        if len(kinds) != 1:
+            raise ValueError(f"SPLIT_GROUPS 中的一组混合了选择题与填空题：{ids}")
+        plan.append((kinds.pop(), sorted(ids)))
+    if sorted(qid for _, ids in plan for qid in ids) != list(range(1, NUM_QUESTIONS_PER_UNIT + 1)):
+        raise ValueError(f"SPLIT_GROUPS 必须不重不漏地覆盖题号 1–{NUM_QUESTIONS_PER_UNIT}")
+    return plan
+
+def build_split_messages(theme: str, kind: str, ids: List[int], review: str = "") -> List[dict]:
+    return prompt_messages(SPLIT_PROMPTS[OUTPUT_FORMAT][kind], review, theme=theme, ids="、".join(map(str, ids)),
+                           kind=SPLIT_KIND_LABELS[kind], count=len(ids))
+
+# 本次运行中各复习单元要复习的 [(单元号, 主题)]，由 main 中的 plan_review_units 填写
+_REVIEW_PLAN: Dict[int, List[Tuple[int, str]]] = {}
+
+def plan_review_units(themes: List[str], tasks: List[Tuple[int, str]]) -> Dict[int, List[int]]:
+    """记录复习单元的被复习单元，返回本次运行内的依赖 {复习单元: [本次运行中须先完成的被复习单元]}。"""
+    _REVIEW_PLAN.clear()
+    if not USE_REVIEW_DIGESTS:
+        return {}
+    in_run = {g for g, _ in tasks}
+    deps = {}
+    for gidx, _ in tasks:
+        sources = review_sources(gidx, themes)
+        if sources:
+            _REVIEW_PLAN[gidx] = [(u, themes[u - 1]) for u in sources]
+            deps[gidx] = [u for u in sources if u in in_run]
+    waiting = sum(1 for d in deps.values() if d)
+    print(f"[REVIEW] {len(_REVIEW_PLAN)} 个复习单元带复习素材，其中 {waiting} 个等本次运行中的被复习单元完成后再开始")
+    return deps
+
+def review_context(global_unit_index: int, out_base: Path) -> str:
+    """复习单元的复习素材；不是复习单元，或被复习单元都还没有 json_parsed 时返回空串（照常生成）。"""
+    digests = []
+    for gidx, theme in _REVIEW_PLAN.get(global_unit_index, ()):
+        paths = unit_output_paths(gidx, out_base)
+        digest = load_unit_digest(gidx, theme, paths["parsed_path"], paths["digest_path"])
+        if digest is not None and digest["items"]:
+            digests.append(digest)
+    return format_review_context(digests, REVIEW_CONTEXT_MAX_CHARS) if digests else ""
+
+def split_part_paths(paths: dict, part: int) -> dict:
+    """子请求各自流式落盘到 unit_X_stream.partK.jsonl，互不覆盖。"""
+    return {**paths, "stream_path": paths["stream_path"].with_suffix(f".part{part}.jsonl")}
+
+def merge_split_parts(global_unit_index: int, plan: List[Tuple[str, List[int]]], parts: list, stats: dict,
+                      part_stats: List[dict]) -> Tuple[Optional[str], Optional[List[dict]], Optional[BaseException], int]:
+    """把各子请求的 (原始文本, 题目, 异常, 尝试次数) 按题号拼成整单元结果，统计累加到 stats。"""
+    for s in part_stats:
+        for key, value in s.items():
+            stats[key] = round(stats[key] + value, 3) if key == "request_sec" else stats[key] + value
+    slots = {}
+    raws, last_exc, attempts = [], None, 0
+    for (kind, ids), (raw_text, questions, exc, n) in zip(plan, parts):
+        attempts = max(attempts, n)
+        if raw_text:
+            raws.append(raw_text)
+        if questions is None:
+            last_exc = exc or last_exc
+            print(f"❌[WARN] global_unit={global_unit_index} 子请求（{SPLIT_KIND_LABELS[kind]} {ids}）失败: {exc}")
+            continue
+        missing = sorted(set(ids) - set(merge_group_questions(slots, ids, questions)))
+        if missing:
+            print(f"[WARN] global_unit={global_unit_index} 子请求（{SPLIT_KIND_LABELS[kind]}）缺少题号 {missing}")
+    if not slots:
+        return "\n\n".join(raws) or None, None, last_exc, attempts
+    questions = ordered_questions(slots, NUM_QUESTIONS_PER_UNIT)
+    return json.dumps(questions, ensure_ascii=False, indent=2), questions, last_exc, attempts
+
+def unit_sql_done(paths: dict) -> bool:
+    """SQL 已存在且不是解析失败时写下的占位文件，才算该单元已完成。"""
+    sql_path = paths["sql_path"]
+    if not sql_path.exists():
+        return False
+    with open(sql_path, "r", encoding="utf-8") as f:
+        return not f.readline().startswith("-- FAILED")
+
+def cancelled_unit_result(global_unit_index: int, paths: dict) -> dict:
+    return {
+        "status": "cancelled",
+        "global_unit": global_unit_index,
+        "stage": paths["stage"],
+        "unit_local": paths["unit_local"],
+        "unit_id": paths["unit_id"],
+    }
 
-    sql_out_path = sql_dir / f"unit{unit_id}.sql"
+def skipped_unit_result(global_unit_index: int, paths: dict) -> dict:
+    print(f"⏭️ 已存在，跳过请求 API（第 {global_unit_index} 单元） -> {paths['sql_path']}")
+    return {
+        "status": "skipped",
+        "global_unit": global_unit_index,
+        "stage": paths["stage"],
+        "unit_local": paths["unit_local"],
+        "unit_id": paths["unit_id"],
+        "sql": str(paths["sql_path"])
+    }
 
-    if parsed_questions is None:
-        with open(sql_out_path, "w", encoding="utf-8") as sf:
-            sf.write(f"-- FAILED to parse JSON for global_unit={global_unit_index} (stage={stage} unit_local={unit_local} unit_id={unit_id})\n")
-            sf.write(f"-- last exception: {repr(last_exc)}\n")
-            if raw_text:
-                sf.write("-- raw response below:\n")
-                sf.write(raw_text)
-        return {"status": "error", "global_unit": global_unit_index, "stage": stage, "unit_local": unit_local, "unit_id": unit_id, "json_raw": str(raw_record_path), "sql": str(sql_out_path), "error": repr(last_exc)}
+def parse_questions_with_fixes(raw_text: str) -> Tuple[List[dict], Dict[str, int]]:
+    """从模型返回文本中解析出题目数组；兼容 {"questions": [...]} 包装，紧凑格式的题目展开为标准结构。返回 (题目, 修复记录)。"""
+    parsed, fixes = extract_json_with_fixes(raw_text)
+    if isinstance(parsed, dict) and "questions" in parsed and isinstance(parsed["questions"], list):
+        parsed = parsed["questions"]
+    if not isinstance(parsed, list):
+        raise ValueError("解析得到的 JSON 不是题目数组 (list)。")
+    return expand_questions(parsed), fixes
 
-    parsed_path = parsed_dir / f"unit_{global_unit_index}_parsed.json"
-    with open(parsed_path, "w", encoding="utf-8") as pf:
-        json.dump(parsed_questions, pf, ensure_ascii=False, indent=2)
+def parse_questions_from_text(raw_text: str) -> List[dict]:
+    return parse_questions_with_fixes(raw_text)[0]
 
+def build_unit_sql(global_unit_index: int, unit_id: int, parsed_questions: List[dict]) -> Optional[str]:
+    """把题目数组转换为 INSERT 语句文本；没有可用行时返回 None。"""
     choice_rows = []
     fill_rows = []
 
@@ -550,21 +908,1251 @@ def process_single_unit(client: OpenAI, global_unit_index: int, theme: str, out_
         sql_blocks.append(",\n".join(vals) + ";")
 
     if not sql_blocks:
-        sql_text = f"-- No valid rows extracted for global_unit={global_unit_index} (stage={stage} unit_local={unit_local} unit_id={unit_id})\n-- parsed saved at: {parsed_path}\n"
-    else:
-        sql_text = "\n\n".join(sql_blocks)
-
-    with open(sql_out_path, "w", encoding="utf-8") as sf:
+        return None
+    return "\n\n".join(sql_blocks)
+
+def write_failed_unit_sql(global_unit_index: int, raw_text: Optional[str], last_exc: Optional[BaseException],
+                          paths: dict):
+    stage, unit_local, unit_id = paths["stage"], paths["unit_local"], paths["unit_id"]
+    with open(paths["sql_path"], "w", encoding="utf-8") as sf:
+        sf.write(f"-- FAILED to parse JSON for global_unit={global_unit_index} (stage={stage} unit_local={unit_local} unit_id={unit_id})\n")
+        sf.write(f"-- last exception: {repr(last_exc)}\n")
+        if raw_text:
+            sf.write("-- raw response below:\n")
+            sf.write(raw_text)
+
+def quarantine_unit(global_unit_index: int, parsed_questions: List[dict], issues: List[dict], paths: dict):
+    qpath = paths["quarantine_path"]
+    ensure_dir(qpath.parent)
+    with open(qpath, "w", encoding="utf-8") as qf:
+        json.dump({"global_unit_index": global_unit_index, "unit_id": paths["unit_id"], "issues": issues,
+                   "questions": parsed_questions}, qf, ensure_ascii=False, indent=2)
+    print(f"🚫第 {global_unit_index} 单元校验未通过（{len(issues)} 个问题），已隔离 -> {qpath}\n{format_issues(issues, limit=5)}")
+
+def write_unit_sql(global_unit_index: int, parsed_questions: List[dict], paths: dict) -> List[dict]:
+    """校验通过（或未开启隔离）时写出 SQL；返回校验问题列表，非空且开启隔离时不写 SQL。"""
+    stage, unit_local, unit_id = paths["stage"], paths["unit_local"], paths["unit_id"]
+    issues = UNIT_VALIDATOR(parsed_questions) if VALIDATE_BEFORE_SQL else []
+    if issues:
+        if QUARANTINE_INVALID_UNITS:
+            quarantine_unit(global_unit_index, parsed_questions, issues, paths)
+            return issues
+        print(f"[WARN] global_unit={global_unit_index} 校验发现 {len(issues)} 个问题，仍导出 SQL\n{format_issues(issues, limit=5)}")
+    sql_text = build_unit_sql(global_unit_index, unit_id, parsed_questions)
+    if sql_text is None:
+        sql_text = f"-- No valid rows extracted for global_unit={global_unit_index} (stage={stage} unit_local={unit_local} unit_id={unit_id})\n-- parsed saved at: {paths['parsed_path']}\n"
+
+    with open(paths["sql_path"], "w", encoding="utf-8") as sf:
         sf.write(f"-- Generated SQL for global_unit={global_unit_index} (stage={stage} unit_local={unit_local} unit_id={unit_id})\n")
         sf.write(sql_text)
+    return issues
+
+def write_unit_outputs(global_unit_index: int, theme: str, user_prompt: str, raw_text: Optional[str],
+                       parsed_questions: Optional[List[dict]], last_exc: Optional[BaseException],
+                       paths: dict) -> dict:
+    """写出 json_raw / json_parsed / sql 三类产物，返回单元结果（同步与异步引擎共用）。"""
+    stage = paths["stage"]
+    unit_local = paths["unit_local"]
+    unit_id = paths["unit_id"]
+    raw_record_path = paths["raw_path"]
+    sql_out_path = paths["sql_path"]
+
+    with open(raw_record_path, "w", encoding="utf-8") as rf:
+        json.dump({
+            "global_unit_index": global_unit_index,
+            "stage": stage,
+            "unit_local": unit_local,
+            "unit_id": unit_id,
+            "theme": theme,
+            "user_prompt": user_prompt,
+            "raw_text": raw_text
+        }, rf, ensure_ascii=False, indent=2)
+
+    if parsed_questions is None:
+        write_failed_unit_sql(global_unit_index, raw_text, last_exc, paths)
+        return {"status": "error", "global_unit": global_unit_index, "stage": stage, "unit_local": unit_local, "unit_id": unit_id, "json_raw": str(raw_record_path), "sql": str(sql_out_path), "error": repr(last_exc)}
+
+    parsed_path = paths["parsed_path"]
+    with open(parsed_path, "w", encoding="utf-8") as pf:
+        json.dump(parsed_questions, pf, ensure_ascii=False, indent=2)
 
-    return {"status": "ok", "global_unit": global_unit_index, "stage": stage, "unit_local": unit_local, "unit_id": unit_id, "parsed_json": str(parsed_path), "raw_json": str(raw_record_path), "sql": str(sql_out_path)}
+    issues = write_unit_sql(global_unit_index, parsed_questions, paths)
+    valid = len(parsed_questions) - len([k for k in issues_by_question(issues) if k != "$"])
+    if issues and QUARANTINE_INVALID_UNITS:
+        return {"status": "quarantined", "global_unit": global_unit_index, "stage": stage, "unit_local": unit_local, "unit_id": unit_id, "parsed_json": str(parsed_path), "raw_json": str(raw_record_path), "quarantine": str(paths["quarantine_path"]), "issues": len(issues), "valid_questions": 0}
+
+    return {"status": "ok", "global_unit": global_unit_index, "stage": stage, "unit_local": unit_local, "unit_id": unit_id, "parsed_json": str(parsed_path), "raw_json": str(raw_record_path), "sql": str(sql_out_path), "valid_questions": valid}
+
+def _stream_result(parser: IncrementalQuestionParser, finish_reason: Optional[str], usage: Any,
+                   model: str = MODEL_NAME) -> dict:
+    """把流式结果拼成与非流式响应相同结构的 dict，便于缓存 / 限流结算复用。"""
+    if usage is not None and hasattr(usage, "model_dump"):
+        usage = usage.model_dump()
+    return {
+        "model": model,
+        "choices": [{"message": {"content": parser.text}, "finish_reason": finish_reason}],
+        "usage": usage,
+    }
+
+def _stream_chunk_fields(chunk: Any) -> Tuple[Optional[str], Optional[str], Any]:
+    usage = getattr(chunk, "usage", None)
+    if not chunk.choices:
+        return None, None, usage
+    choice = chunk.choices[0]
+    return getattr(choice.delta, "content", None), choice.finish_reason, usage
+
+def _write_streamed_questions(sf, global_unit_index: int, questions: List[dict], parser: IncrementalQuestionParser):
+    for q in questions:
+        sf.write(json.dumps(q, ensure_ascii=False) + "\n")
+        sf.flush()
+        if len(parser.items) == 1:
+            print(f"📥首题已到达（第 {global_unit_index} 单元）")
+
+def stream_unit_completion(client: OpenAI, messages: List[dict], global_unit_index: int, paths: dict,
+                           tracker: Optional[CallTracker] = None, model: str = MODEL_NAME,
+                           params: Optional[dict] = None) -> dict:
+    parser = IncrementalQuestionParser(expand=expand_question if OUTPUT_FORMAT == "compact" else None)
+    finish_reason, usage = None, None
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **(SAMPLING_PARAMS if params is None else params)
+    )
+    deadline = time.monotonic() + CALL_TIMEOUT
+    try:
+        with open(paths["stream_path"], "w", encoding="utf-8") as sf:
+            for chunk in stream:
+                CANCEL.raise_if_cancelled()
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"单次调用超过 CALL_TIMEOUT={CALL_TIMEOUT}s")
+                delta, fr, u = _stream_chunk_fields(chunk)
+                finish_reason = fr or finish_reason
+                usage = u or usage
+                if delta:
+                    if tracker is not None:
+                        tracker.first_token()
+                    _write_streamed_questions(sf, global_unit_index, parser.feed(delta), parser)
+    except StreamAbort as e:
+        print(f"✂️提前中止流式输出（第 {global_unit_index} 单元）：{e}")
+        raise
+    finally:
+        stream.close()
+    return _stream_result(parser, finish_reason, usage, model)
+
+async def stream_unit_completion_async(aclient: AsyncOpenAI, messages: List[dict], global_unit_index: int,
+                                       paths: dict, tracker: Optional[CallTracker] = None,
+                                       model: str = MODEL_NAME, params: Optional[dict] = None) -> dict:
+    parser = IncrementalQuestionParser(expand=expand_question if OUTPUT_FORMAT == "compact" else None)
+    finish_reason, usage = None, None
+    stream = await aclient.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **(SAMPLING_PARAMS if params is None else params)
+    )
+    try:
+        with open(paths["stream_path"], "w", encoding="utf-8") as sf:
+            async for chunk in stream:
+                CANCEL.raise_if_cancelled()
+                delta, fr, u = _stream_chunk_fields(chunk)
+                finish_reason = fr or finish_reason
+                usage = u or usage
+                if delta:
+                    if tracker is not None:
+                        tracker.first_token()
+                    _write_streamed_questions(sf, global_unit_index, parser.feed(delta), parser)
+    except StreamAbort as e:
+        print(f"✂️提前中止流式输出（第 {global_unit_index} 单元）：{e}")
+        raise
+    finally:
+        await stream.close()
+    return _stream_result(parser, finish_reason, usage, model)
+
+def new_unit_stats() -> dict:
+    return {"calls": 0, "cached_calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+            "request_sec": 0.0}
+
+def add_record_usage(stats: Optional[dict], record: dict, request_sec: float = 0.0):
+    """把一次调用的 usage 与请求耗时（不含排队）累加到单元统计里（缓存命中不计）。"""
+    if stats is None:
+        return
+    stats["calls"] += 1
+    if record.get("cached"):
+        stats["cached_calls"] += 1
+        return
+    stats["request_sec"] = round(stats["request_sec"] + request_sec, 3)
+    usage = record.get("usage") or {}
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        stats[key] += int(usage.get(key) or 0)
+
+def finish_unit_result(result: dict, attempts: int, started: float, stats: dict, messages: List[dict],
+                       repair_info: Optional[dict]) -> dict:
+    result.update({
+        "attempts": attempts,
+        "latency_sec": round(time.time() - started, 3),
+        "usage": stats,
+        "prompt_hash": make_cache_key(MODEL_NAME, messages, request_params(MODEL_NAME)),
+    })
+    if repair_info and repair_info["repaired"]:
+        result["repair"] = repair_info
+    get_metrics().unit(result["global_unit"], result["status"], questions=result.get("valid_questions", 0),
+                       attempts=attempts, latency_sec=result["latency_sec"])
+    return result
+
+# 本次运行中拒绝过 response_format 的 (后端, 模型)
+_JSON_MODE_REJECTED = set()
+
+def request_params(model: str) -> dict:
+    """参与缓存键的请求参数：采样参数，结构化输出且模型支持 JSON mode 时加 response_format。"""
+    if STRUCTURED_OUTPUT and model in JSON_MODE_MODELS:
+        return {**SAMPLING_PARAMS, "response_format": {"type": "json_object"}}
+    return SAMPLING_PARAMS
+
+def backend_params(params: dict, backend: Backend, model: str) -> dict:
+    """实际发给该后端的参数：后端不支持 JSON mode 时去掉 response_format（包装对象的要求仍在 prompt 里）。"""
+    if "response_format" in params and (not backend.json_mode or (backend.name, model) in _JSON_MODE_REJECTED):
+        return {k: v for k, v in params.items() if k != "response_format"}
+    return params
+
+def cache_candidates(model: str, params: dict) -> List[Tuple[str, dict]]:
+    """各后端实际会发出的 (模型名, 参数)，去重后按池中顺序排列；缓存按实际发出的请求为键。"""
+    candidates = []
+    for backend in get_backend_pool().backends:
+        backend_model = backend.model_for(model)
+        sent = (backend_model, backend_params(params, backend, backend_model))
+        if sent not in candidates:
+            candidates.append(sent)
+    return candidates
+
+def note_json_mode_rejected(exc: BaseException, params: dict, backend: Backend, model: str):
+    """带 response_format 的请求被 400 拒绝：本次运行内对该后端 + 模型停用 JSON mode，下一次尝试不再带它。"""
+    if isinstance(exc, BadRequestError) and "response_format" in params and (backend.name, model) not in _JSON_MODE_REJECTED:
+        _JSON_MODE_REJECTED.add((backend.name, model))
+        print(f"[JSON] 后端 {backend.name} 的 {model} 不接受 response_format（{exc}），本次运行改为只靠 prompt 约束格式")
+
+def create_completion_with_deadline(client: OpenAI, model: str, messages: List[dict], params: dict) -> ChatCompletion:
+    """
+    非流式调用：按块读取响应体，块与块之间检查取消和 CALL_TIMEOUT。
+    服务端排队时会持续发空行保活，读取超时只管两次收到数据的间隔，管不到整次调用的总时长。
+    """
+    deadline = time.monotonic() + CALL_TIMEOUT
+    body = []
+    with client.with_streaming_response.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=False,
+        **params
+    ) as response:
+        for chunk in response.iter_bytes():
+            CANCEL.raise_if_cancelled()
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"单次调用超过 CALL_TIMEOUT={CALL_TIMEOUT}s")
+            body.append(chunk)
+    return ChatCompletion.model_validate_json(b"".join(body))
+
+def call_model(clients: Dict[str, OpenAI], messages: List[dict], global_unit_index: int, paths: Optional[dict] = None,
+               stream: bool = False, use_cached: bool = True, stats: Optional[dict] = None,
+               attempt: int = 1, phase: str = "unit", model: str = MODEL_NAME) -> dict:
+    """带缓存 + 后端池 + 共享限流 + 埋点的一次模型调用（同步），返回 llm_cache 统一格式的 record。"""
+    est_tokens = estimate_tokens_for_messages(messages, EXPECTED_COMPLETION_TOKENS)
+    tracker = get_metrics().track(unit=global_unit_index, attempt=attempt, phase=phase, model=model)
+    params = request_params(model)
+
+    def _call():
+        with get_backend_pool().lease() as backend:
+            backend.limiter.acquire(est_tokens)
+            tracker.begin()
+            backend_model = backend.model_for(model)
+            sent = backend_params(params, backend, backend_model)
+            tracker.fields.update(backend=backend.name, model=backend_model, json_mode="response_format" in sent)
+            client = clients[backend.name]
+            print(f"🚀尝试请求 API（第 {global_unit_index} 单元，{model}{backend_label(backend)}）")
+            try:
+                if stream:
+                    resp = stream_unit_completion(client, messages, global_unit_index, paths, tracker, backend_model,
+                                                  sent)
+                else:
+                    resp = create_completion_with_deadline(client, backend_model, messages, sent)
+            except BadRequestError as e:
+                note_json_mode_rejected(e, sent, backend, backend_model)
+                raise
+            backend.limiter.settle(est_tokens, usage_total_tokens(resp))
+            backend.limiter.report_success()
+            return resp, backend_model, sent
+
+    with tracker:
+        record = cached_completion(get_response_cache(), model, messages, params, _call,
+                                   use_cached=use_cached, candidates=cache_candidates(model, params))
+        tracker.finish(record)
+    add_record_usage(stats, record, time.perf_counter() - tracker.started)
+    if record["cached"]:
+        print(f"💾命中响应缓存（第 {global_unit_index} 单元）")
+    else:
+        print(f"✅️成功请求 API（第 {global_unit_index} 单元）")
+    return record
+
+class UnitParseError(ValueError):
+    """模型有返回但解析不出题目；保留原始文本，失败时照样写进 json_raw / 失败 SQL。"""
+
+    def __init__(self, raw_text: Optional[str], cause: BaseException):
+        super().__init__(f"{type(cause).__name__}: {cause}")
+        self.raw_text = raw_text
+
+def parse_outcome(fixes: Dict[str, int]) -> str:
+    """解析成功的输出：整体就是合法 JSON 为 "json"，只需从前后文字中截取为 "extracted"，做过语法修复为 "repaired"。"""
+    if not fixes:
+        return "json"
+    return "extracted" if set(fixes) <= EXTRACTION_FIXES else "repaired"
+
+def parse_unit_response(raw_text: str, global_unit_index: int, model: str = MODEL_NAME) -> Tuple[List[dict], List[str]]:
+    """
+    返回 (题目列表, 解析不了的题目片段)。整体解析失败时先本地修复：捞回能独立解析的完整题目，
+    剩下的坏片段交给 fix_broken_fragments，仍缺的题号交给逐题修复；既没有题目也没有片段才视为失败。解析结果记入 metrics。
+    """
+    try:
+        questions, fixes = parse_questions_with_fixes(raw_text)
+    except Exception:
+        salvaged, fragments = salvage_with_fragments(raw_text) if ENABLE_QUESTION_REPAIR else ([], [])
+        get_metrics().parse(global_unit_index, "salvaged" if salvaged or fragments else "failed", model=model,
+                            structured=STRUCTURED_OUTPUT)
+        if not salvaged and not fragments:
+            raise
+        RETRY_LEDGER.record("parse", "local_repair")
+        print(f"🩹第 {global_unit_index} 单元整体 JSON 解析失败，本地捞回 {len(salvaged)} 道完整题目、"
+              f"{len(fragments)} 个解析不了的片段")
+        return salvaged, fragments
+    outcome = parse_outcome(fixes)
+    get_metrics().parse(global_unit_index, outcome, model=model, structured=STRUCTURED_OUTPUT, fixes=fixes)
+    if outcome == "repaired":
+        RETRY_LEDGER.record("parse", "local_repair")
+        print(f"🩹第 {global_unit_index} 单元 JSON 已在本地修复：{format_fixes(fixes)}")
+    return questions, []
+
+# 逐题修复 / 截断续写 / JSON 片段修复的轮次逻辑写成生成器，同步与异步引擎共用：
+# 生成器 yield (messages, call_model 参数)，由 drive_calls / drive_calls_async 交给注入的调用函数发出，
+# 结果 send 回生成器、异常 throw 回生成器，生成器的返回值就是整个过程的结果。
+CallSteps = Generator[Tuple[List[dict], dict], dict, Any]
+
+def drive_calls(steps: CallSteps, call: Callable[..., dict]) -> Any:
+    """同步驱动：call(messages, **kwargs) -> record。"""
+    try:
+        messages, kwargs = next(steps)
+        while True:
+            try:
+                record = call(messages, **kwargs)
+            except Exception as e:
+                messages, kwargs = steps.throw(e)
+            else:
+                messages, kwargs = steps.send(record)
+    except StopIteration as stop:
+        return stop.value
+
+def sync_transport(clients: Dict[str, OpenAI], global_unit_index: int, stats: Optional[dict]) -> Callable[..., dict]:
+    """
+    drive_calls 用的调用函数，与整单元请求走同一套按失败类别的重试（RetryBudget + retry_delay）：
+    429 等共享限流器冷却后重发、不算这一轮失败；瞬时故障退避后重发；预算用完或不再重试的失败才抛给轮次逻辑。
+    """
+    def _call(messages: List[dict], **kwargs) -> dict:
+        budget = RetryBudget(RETRY_ATTEMPTS, RATE_LIMIT_MAX_DEFERRALS)
+        while True:
+            attempt = budget.begin()
+            try:
+                return call_model(clients, messages, global_unit_index, stats=stats, **kwargs)
+            except Cancelled:
+                raise
+            except Exception as e:
+                delay = retry_delay(global_unit_index, attempt, e, budget)
+                if not budget.can_try() or CANCEL.wait(delay):
+                    raise
+    return _call
+
+async def drive_calls_async(steps: CallSteps, call: Callable[..., Awaitable[dict]]) -> Any:
+    """异步驱动：await call(messages, **kwargs) -> record；asyncio.CancelledError 不送回生成器，直接向外传播。"""
+    try:
+        messages, kwargs = next(steps)
+        while True:
+            try:
+                record = await call(messages, **kwargs)
+            except Exception as e:
+                messages, kwargs = steps.throw(e)
+            else:
+                messages, kwargs = steps.send(record)
+    except StopIteration as stop:
+        return stop.value
+
+def json_fix_steps(raw_text: str, questions: List[dict], fragments: List[str], global_unit_index: int) -> CallSteps:
+    """
+    只把本地修复不了的片段发给 JSON_FIX_MODEL 修语法（不重新生成内容），修好的题目按题号补进本地捞回的题目；
+    仍一道题都没有时按解析失败处理（整单元立即重发）。
+    """
+    size = sum(len(f) for f in fragments)
+    fixed_text = None
+    if JSON_FIX_MODEL and size <= JSON_FIX_MAX_CHARS:
+        print(f"🩹第 {global_unit_index} 单元 {len(fragments)} 个片段（{size} 字）交给 {JSON_FIX_MODEL} 修 JSON 语法")
+        try:
+            record = yield build_json_fix_messages(fragments), {"phase": "json_fix", "model": JSON_FIX_MODEL}
+            fixed_text = record["raw_text"]
+        except Cancelled:
+            raise
+        except Exception as e:
+            print(f"❌[WARN] global_unit={global_unit_index} JSON 修复请求失败: {e}")
+    if fixed_text is not None:
+        try:
+            added = merge_fixed_questions(questions, parse_questions_from_text(fixed_text))
+            RETRY_LEDGER.record("parse", "json_fix")
+            print(f"🩹第 {global_unit_index} 单元 JSON 修复补回 {len(added)} 道题")
+        except Exception as e:
+            RETRY_LEDGER.record("parse", "json_fix_failed")
+            print(f"❌[WARN] global_unit={global_unit_index} JSON 修复结果仍无法解析: {e}")
+    if not questions:
+        raise UnitParseError(raw_text, ValueError("本地修复与 JSON 修复后仍没有可用的题目"))
+    return questions
+
+def fix_broken_fragments(clients: Dict[str, OpenAI], raw_text: str, questions: List[dict], fragments: List[str],
+                         global_unit_index: int, stats: Optional[dict] = None) -> List[dict]:
+    """返回补齐后的题目列表（见 json_fix_steps）。"""
+    return drive_calls(json_fix_steps(raw_text, questions, fragments, global_unit_index),
+                       sync_transport(clients, global_unit_index, stats))
+
+def is_truncated(record: dict) -> bool:
+    return CONTINUE_TRUNCATED and record.get("finish_reason") == "length"
+
+def start_continuation(global_unit_index: int, raw_text: Optional[str], ids: List[int],
+                       model: str) -> Tuple[dict, List[dict]]:
+    """截断的输出 -> (按题号放好的已完整题目, 续写用的对话前缀)；一道完整题目都没有时按解析失败处理（整单元重试）。"""
+    get_metrics().parse(global_unit_index, "truncated", model=model, structured=STRUCTURED_OUTPUT)
+    questions, partial = salvage_truncated(raw_text)
+    slots = {}
+    merge_group_questions(slots, ids, questions)
+    if not slots:
+        raise UnitParseError(raw_text, ValueError("输出达到长度上限被截断，且没有一道完整的题目"))
+    return slots, [{"role": "assistant", "content": partial}]
+
+def finish_continuation(global_unit_index: int, slots: dict, ids: List[int]) -> Tuple[str, List[dict]]:
+    """拼好的题目写成标准 JSON 作为 json_raw（--rebuild 可直接解析）；仍缺的题号交给逐题修复 / 校验。"""
+    missing = [qid for qid in ids if qid not in slots]
+    if missing:
+        print(f"[WARN] global_unit={global_unit_index} 续写后仍缺题号 {missing}")
+    questions = []
+    for qid in ids:
+        if qid in slots:
+            slots[qid]["id"] = qid
+            questions.append(slots[qid])
+    return json.dumps(questions, ensure_ascii=False, indent=2), questions
+
+def continuation_steps(messages: List[dict], raw_text: Optional[str], global_unit_index: int, model: str,
+                       ids: List[int]) -> CallSteps:
+    """截断续写：每轮只请求剩余题号，最多 CONTINUATION_ROUNDS 轮；有新的完整题目时把它接进对话，下一轮在此基础上继续。"""
+    slots, tail = start_continuation(global_unit_index, raw_text, ids, model)
+    conversation = list(messages) + tail
+    for rnd in range(1, CONTINUATION_ROUNDS + 1):
+        missing = [qid for qid in ids if qid not in slots]
+        if not missing or CANCEL.cancelled:
+            break
+        RETRY_LEDGER.record("truncated", "continue")
+        print(f"✂️第 {global_unit_index} 单元输出被截断（已完整 {len(slots)} 题），第 {rnd} 轮续写题号 {missing}")
+        request = build_continuation_messages(conversation, missing)
+        try:
+            record = yield request, {"use_cached": rnd == 1, "attempt": rnd, "phase": "continue", "model": model}
+            questions, partial = salvage_truncated(record["raw_text"])
+            if merge_group_questions(slots, missing, questions):
+                conversation = request + [{"role": "assistant", "content": partial}]
+        except Cancelled:
+            break
+        except Exception as e:
+            print(f"❌[WARN] global_unit={global_unit_index} 续写第 {rnd} 轮失败: {e}")
+    return finish_continuation(global_unit_index, slots, ids)
+
+def continue_truncated_unit(clients: Dict[str, OpenAI], messages: List[dict], raw_text: Optional[str],
+                            global_unit_index: int, stats: dict, model: str, ids: List[int]) -> Tuple[str, List[dict]]:
+    """返回 (json_raw 文本, 题目列表)（见 continuation_steps）。"""
+    return drive_calls(continuation_steps(messages, raw_text, global_unit_index, model, ids),
+                       sync_transport(clients, global_unit_index, stats))
+
+def repair_steps(theme: str, questions: List[dict], global_unit_index: int, model: str) -> CallSteps:
+    """只为缺失 / 不合格的题号发精简请求，按题号拼回，最多 REPAIR_ROUNDS 轮；返回 (题目列表, 修复信息)。"""
+    slots = arrange_by_id(questions, NUM_QUESTIONS_PER_UNIT)
+    repaired = []
+    for rnd in range(1, REPAIR_ROUNDS + 1):
+        broken = find_broken_questions(slots, NUM_QUESTIONS_PER_UNIT, UNIT_VALIDATOR)
+        if not broken or CANCEL.cancelled:
+            break
+        RETRY_LEDGER.record("validation", "regenerate_questions", len(broken))
+        print(f"🔧第 {global_unit_index} 单元第 {rnd} 轮逐题修复：{sorted(broken)}")
+        messages = build_repair_messages(PROMPT.system, theme, slots, broken)
+        try:
+            record = yield messages, {"use_cached": rnd == 1, "attempt": rnd, "phase": "repair", "model": model}
+            repaired += merge_repaired_questions(slots, parse_questions_from_text(record["raw_text"]), broken)
+        except Exception as e:
+            print(f"❌[WARN] global_unit={global_unit_index} 逐题修复第 {rnd} 轮失败: {e}")
+    still_broken = find_broken_questions(slots, NUM_QUESTIONS_PER_UNIT, UNIT_VALIDATOR)
+    if still_broken:
+        print(f"[WARN] global_unit={global_unit_index} 逐题修复后仍有问题：{still_broken}")
+    info = {"repaired": sorted(set(repaired)), "still_broken": sorted(still_broken)}
+    return ordered_questions(slots, NUM_QUESTIONS_PER_UNIT), info
+
+def repair_unit_questions(clients: Dict[str, OpenAI], theme: str, questions: List[dict], global_unit_index: int,
+                          stats: Optional[dict] = None, model: str = MODEL_NAME) -> Tuple[List[dict], dict]:
+    return drive_calls(repair_steps(theme, questions, global_unit_index, model),
+                       sync_transport(clients, global_unit_index, stats))
+
+def unit_model_tiers(global_unit_index: int) -> List[str]:
+    stage, _ = global_to_stage_unit(global_unit_index)
+    return cascade_tiers(MODEL_CASCADE, MODEL_NAME, stage, CASCADE_STAGES)
+
+def unit_broken_questions(questions: Optional[List[dict]]) -> dict:
+    """{题号: 问题}；整体解析失败（questions 为 None）时所有题号都算坏题。"""
+    if questions is None:
+        return {qid: "缺失" for qid in range(1, NUM_QUESTIONS_PER_UNIT + 1)}
+    return find_broken_questions(arrange_by_id(questions, NUM_QUESTIONS_PER_UNIT), NUM_QUESTIONS_PER_UNIT,
+                                 UNIT_VALIDATOR)
+
+def tier_snapshot(stats: dict) -> Tuple[float, int, int]:
+    return stats["request_sec"], stats["prompt_tokens"], stats["completion_tokens"]
+
+def tier_call(model: str, scope: str, stats: dict, before: Tuple[float, int, int], passed: bool) -> TierCall:
+    """本档的请求耗时 / token = 单元统计在本档前后的差值（排队时间不计入）。"""
+    now = tier_snapshot(stats)
+    return TierCall(model, scope, now[0] - before[0], now[1] - before[1], now[2] - before[2], passed)
+
+def plan_escalation(global_unit_index: int, tiers: List[str], level: int, broken: dict,
+                    parsed_questions: Optional[List[dict]]) -> Optional[str]:
+    """本档结果不合格时决定下一步：None = 不再升级（已是最后一档或已取消），"questions" / "unit" = 升级方式。"""
+    if level == len(tiers) - 1 or CANCEL.cancelled:
+        return None
+    scope = "unit" if parsed_questions is None else escalation_scope(len(broken), NUM_QUESTIONS_PER_UNIT,
+                                                                     CASCADE_MAX_QUESTION_FRACTION)
+    what = f"{len(broken)} 题不合格，只把坏题" if scope == "questions" else "结果不合格，整单元"
+    print(f"⬆️第 {global_unit_index} 单元 {tiers[level]} {what}交给 {tiers[level + 1]}")
+    return scope
+
+def finish_cascade(result: dict, calls: List[TierCall]) -> dict:
+    if MODEL_CASCADE:
+        result["cascade"] = [tier_call_dict(c, MODEL_PRICES) for c in calls]
+    return result
+
+def retry_delay(global_unit_index: int, attempt: int, exc: BaseException, budget: RetryBudget) -> float:
+    """按失败类别记账并返回下一次尝试前的等待秒数（不再重试时返回 0，由 budget.can_try() 结束循环）。"""
+    failure_class = classify_failure(exc)
+    retrying = budget.failed(failure_class)
+    if not retrying:
+        RETRY_LEDGER.record(failure_class, "gave_up")
+        print(f"❌[WARN] global_unit={global_unit_index} attempt={attempt} {failure_class} 失败，不再重试: {exc}")
+        return 0.0
+    if failure_class == "rate_limited":
+        # 冷却已由后端池登记到该后端的共享限流器，下一次尝试会避开它或等它冷却结束
+        RETRY_LEDGER.record(failure_class, "deferred")
+        print(f"❌[WARN] global_unit={global_unit_index} attempt={attempt} rate limited, 已登记冷却")
+        return 0.0
+    delay = jittered_backoff(attempt, 1.0, RETRY_BACKOFF_FACTOR, RETRY_BACKOFF_MAX) \
+        if failure_class in BACKOFF_CLASSES else 0.0
+    RETRY_LEDGER.record(failure_class, "retry")
+    print(f"❌[WARN] global_unit={global_unit_index} attempt={attempt} {failure_class} 失败: {exc}. retry in {delay:.1f}s")
+    return delay
+
+def request_unit_with_retries(clients: Dict[str, OpenAI], messages: List[dict], global_unit_index: int, paths: dict,
+                              stats: dict, model: str, ids: Optional[List[int]] = None
+                              ) -> Tuple[Optional[str], Optional[List[dict]], Optional[BaseException], int]:
+    """用指定模型请求整单元（含按失败类别的重试）；返回 (原始文本, 题目列表或 None, 最后一个异常, 尝试次数)。ids 为本请求负责的题号。"""
+    ids = ids or list(range(1, NUM_QUESTIONS_PER_UNIT + 1))
+    raw_text = None
+    parsed_questions = None
+    last_exc = None
+    budget = RetryBudget(RETRY_ATTEMPTS, RATE_LIMIT_MAX_DEFERRALS)
+    while budget.can_try() and not CANCEL.cancelled:
+        attempt = budget.begin()
+        try:
+            record = call_model(clients, messages, global_unit_index, paths, stream=USE_STREAMING,
+                                use_cached=(attempt == 1), stats=stats, attempt=attempt, model=model)
+            raw_text = record["raw_text"]
+            if is_truncated(record):
+                raw_text, parsed_questions = continue_truncated_unit(clients, messages, raw_text, global_unit_index,
+                                                                     stats, model, ids)
+            else:
+                parsed_questions, fragments = parse_unit_response(raw_text, global_unit_index, model)
+                if fragments:
+                    parsed_questions = fix_broken_fragments(clients, raw_text, parsed_questions, fragments,
+                                                            global_unit_index, stats)
+            break
+        except Cancelled:
+            break
+        except Exception as e:
+            last_exc = e
+            if CANCEL.wait(retry_delay(global_unit_index, attempt, e, budget)):
+                break
+    return raw_text, parsed_questions, last_exc, budget.attempts
+
+def request_unit_split(clients: Dict[str, OpenAI], theme: str, global_unit_index: int, paths: dict, stats: dict,
+                       model: str, review: str = "") -> Tuple[Optional[str], Optional[List[dict]], Optional[BaseException], int]:
+    """按 SPLIT_GROUPS 并发发出各题型的子请求（各自重试），按题号拼回；返回值同 request_unit_with_retries。"""
+    plan = split_unit_plan()
+    part_stats = [new_unit_stats() for _ in plan]
+    with ThreadPoolExecutor(max_workers=len(plan)) as ex:
+        futures = [ex.submit(request_unit_with_retries, clients, build_split_messages(theme, kind, ids, review),
+                             global_unit_index, split_part_paths(paths, k), part_stats[k], model, ids)
+                   for k, (kind, ids) in enumerate(plan)]
+        parts = [f.result() for f in futures]
+    return merge_split_parts(global_unit_index, plan, parts, stats, part_stats)
+
+def process_single_unit(clients: Dict[str, OpenAI], global_unit_index: int, theme: str, out_base: Path) -> dict:
+    paths = unit_output_paths(global_unit_index, out_base)
+    if unit_sql_done(paths):
+        return skipped_unit_result(global_unit_index, paths)
+    if CANCEL.cancelled:
+        return cancelled_unit_result(global_unit_index, paths)
+
+    review = review_context(global_unit_index, out_base)
+    user_prompt, messages = build_unit_messages(theme, review)
+
+    started = time.time()
+    stats = new_unit_stats()
+    tiers = unit_model_tiers(global_unit_index)
+    calls = []
+    attempts = 0
+    repair_model, escalate = tiers[-1], None
+
+    for level, model in enumerate(tiers):
+        before = tier_snapshot(stats)
+        if SPLIT_UNIT_REQUESTS:
+            raw_text, parsed_questions, last_exc, n = request_unit_split(clients, theme, global_unit_index, paths,
+                                                                         stats, model, review)
+        else:
+            raw_text, parsed_questions, last_exc, n = request_unit_with_retries(clients, messages, global_unit_index,
+                                                                                paths, stats, model)
+        attempts += n
+        broken = unit_broken_questions(parsed_questions)
+        calls.append(tier_call(model, "unit", stats, before, not broken))
+        escalate = plan_escalation(global_unit_index, tiers, level, broken, parsed_questions) if broken else None
+        if escalate != "unit":
+            repair_model = tiers[level + 1] if escalate else model
+            break
+
+    if parsed_questions is None and CANCEL.cancelled:
+        return finish_unit_result(cancelled_unit_result(global_unit_index, paths), attempts, started, stats,
+                                  messages, None)
+
+    repair_info = None
+    if parsed_questions is not None and (ENABLE_QUESTION_REPAIR or escalate):
+        before = tier_snapshot(stats)
+        parsed_questions, repair_info = repair_unit_questions(clients, theme, parsed_questions, global_unit_index,
+                                                              stats, repair_model)
+        if escalate:
+            calls.append(tier_call(repair_model, "questions", stats, before,
+                                   not repair_info["still_broken"]))
+
+    result = write_unit_outputs(global_unit_index, theme, user_prompt, raw_text, parsed_questions, last_exc, paths)
+    return finish_cascade(finish_unit_result(result, attempts, started, stats, messages, repair_info), calls)
+
+def report_unit_result(global_unit_index: int, res: dict):
+    status = res.get("status")
+    if status == "ok":
+        print(f"[OK] global_unit={global_unit_index} -> sql: {res.get('sql')}")
+    elif status == "quarantined":
+        print(f"[QUARANTINE] global_unit={global_unit_index} -> {res.get('quarantine')}")
+    elif status == "cancelled":
+        print(f"[CANCEL] global_unit={global_unit_index} 已取消，未写出产物")
+    elif status != "skipped":
+        print(f"[ERR] global_unit={global_unit_index} -> error saved at {res.get('sql')}")
+
+# ----------------------------
+# ========== 异步引擎（asyncio） ==========
+# ----------------------------
+class AdaptiveConcurrencyLimiter:
+    """
+    自适应并发闸门（AIMD）：
+    - 在途请求数不超过当前 limit，limit 介于 [min_limit, max_limit]
+    - 每累计 limit 次成功，limit + 1（加性增）
+    - 遇到 429 / 超时等过载信号，limit 减半（乘性减）
+    - 被取消的请求（对冲落败、Ctrl-C）只归还名额，既不算成功也不算过载
+    """
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(max(initial, self.min_limit), self.max_limit)
+        self.in_flight = 0
+        self._successes = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            while self.in_flight >= self.limit:
+                await self._cond.wait()
+            self.in_flight += 1
+
+    async def release(self, overloaded: bool = False, counted: bool = True):
+        async with self._cond:
+            self.in_flight -= 1
+            if overloaded:
+                new_limit = max(self.min_limit, self.limit // 2)
+                if new_limit != self.limit:
+                    print(f"[ASYNC] 检测到过载信号，并发上限 {self.limit} -> {new_limit}")
+                self.limit = new_limit
+                self._successes = 0
+            elif counted:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+def is_overload_error(exc: BaseException) -> bool:
+    """429 / 5xx / 超时视为过载信号，用于自适应并发下调。"""
+    status = getattr(exc, "status_code", None)
+    if status == 429 or (isinstance(status, int) and status >= 500):
+        return True
+    return isinstance(exc, (APITimeoutError, asyncio.TimeoutError))
+
+async def call_model_async(aclients: Dict[str, AsyncOpenAI], gate: AdaptiveConcurrencyLimiter, messages: List[dict],
+                           global_unit_index: int, paths: Optional[dict] = None, stream: bool = False,
+                           use_cached: bool = True, stats: Optional[dict] = None,
+                           attempt: int = 1, phase: str = "unit", model: str = MODEL_NAME) -> dict:
+    """call_model 的 asyncio 版本：额外经过自适应并发闸门，429/超时会触发闸门下调。"""
+    est_tokens = estimate_tokens_for_messages(messages, EXPECTED_COMPLETION_TOKENS)
+    tracker = get_metrics().track(unit=global_unit_index, attempt=attempt, phase=phase, model=model)
+    params = request_params(model)
+
+    async def _call():
+        async with get_backend_pool().lease() as backend:
+            rate_limiter = backend.limiter
+            await rate_limiter.acquire_async(est_tokens)
+            await gate.acquire()
+            tracker.begin()
+            backend_model = backend.model_for(model)
+            sent = backend_params(params, backend, backend_model)
+            tracker.fields.update(backend=backend.name, model=backend_model, json_mode="response_format" in sent)
+            aclient = aclients[backend.name]
+            overloaded = cancelled = False
+            print(f"🚀尝试请求 API（第 {global_unit_index} 单元，{model}{backend_label(backend)}，"
+                  f"在途 {gate.in_flight}/{gate.limit}）")
+            try:
+                if stream:
+                    resp = await asyncio.wait_for(
+                        stream_unit_completion_async(aclient, messages, global_unit_index, paths, tracker,
+                                                     backend_model, sent), CALL_TIMEOUT)
+                else:
+                    resp = await asyncio.wait_for(aclient.chat.completions.create(
+                        model=backend_model,
+                        messages=messages,
+                        stream=False,
+                        **sent
+                    ), CALL_TIMEOUT)
+            except Exception as e:
+                overloaded = is_overload_error(e)
+                note_json_mode_rejected(e, sent, backend, backend_model)
+                raise
+            except BaseException:
+                # 对冲落败 / Ctrl-C：CancelledError 不是 Exception，不能让它在 finally 里被当成一次成功
+                cancelled = True
+                raise
+            finally:
+                await gate.release(overloaded=overloaded, counted=not cancelled)
+                if cancelled:
+                    await asyncio.to_thread(rate_limiter.settle, est_tokens, 0)
+            await asyncio.to_thread(rate_limiter.settle, est_tokens, usage_total_tokens(resp))
+            await asyncio.to_thread(rate_limiter.report_success)
+            return resp, backend_model, sent
+
+    with tracker:
+        record = await cached_completion_async(get_response_cache(), model, messages, params, _call,
+                                               use_cached=use_cached, candidates=cache_candidates(model, params))
+        tracker.finish(record)
+    add_record_usage(stats, record, time.perf_counter() - tracker.started)
+    if record["cached"]:
+        print(f"💾命中响应缓存（第 {global_unit_index} 单元）")
+    else:
+        print(f"✅️成功请求 API（第 {global_unit_index} 单元）")
+    return record
+
+def async_transport(aclients: Dict[str, AsyncOpenAI], gate: AdaptiveConcurrencyLimiter, global_unit_index: int,
+                    stats: Optional[dict]) -> Callable[..., Awaitable[dict]]:
+    """sync_transport 的 asyncio 版本：修复 / 续写请求同样经过并发闸门与按失败类别的重试。"""
+    async def _call(messages: List[dict], **kwargs) -> dict:
+        budget = RetryBudget(RETRY_ATTEMPTS, RATE_LIMIT_MAX_DEFERRALS)
+        while True:
+            attempt = budget.begin()
+            try:
+                return await call_model_async(aclients, gate, messages, global_unit_index, stats=stats, **kwargs)
+            except Cancelled:
+                raise
+            except Exception as e:
+                delay = retry_delay(global_unit_index, attempt, e, budget)
+                if not budget.can_try():
+                    raise
+                if delay:
+                    await asyncio.sleep(delay)
+    return _call
+
+async def repair_unit_questions_async(aclients: Dict[str, AsyncOpenAI], gate: AdaptiveConcurrencyLimiter, theme: str,
+                                      questions: List[dict], global_unit_index: int,
+                                      stats: Optional[dict] = None, model: str = MODEL_NAME) -> Tuple[List[dict], dict]:
+    return await drive_calls_async(repair_steps(theme, questions, global_unit_index, model),
+                                   async_transport(aclients, gate, global_unit_index, stats))
+
+async def continue_truncated_unit_async(aclients: Dict[str, AsyncOpenAI], gate: AdaptiveConcurrencyLimiter,
+                                        messages: List[dict], raw_text: Optional[str], global_unit_index: int,
+                                        stats: dict, model: str, ids: List[int]) -> Tuple[str, List[dict]]:
+    return await drive_calls_async(continuation_steps(messages, raw_text, global_unit_index, model, ids),
+                                   async_transport(aclients, gate, global_unit_index, stats))
+
+async def fix_broken_fragments_async(aclients: Dict[str, AsyncOpenAI], gate: AdaptiveConcurrencyLimiter, raw_text: str,
+                                     questions: List[dict], fragments: List[str], global_unit_index: int,
+                                     stats: Optional[dict] = None) -> List[dict]:
+    return await drive_calls_async(json_fix_steps(raw_text, questions, fragments, global_unit_index),
+                                   async_transport(aclients, gate, global_unit_index, stats))
+
+async def request_unit_async(aclients: Dict[str, AsyncOpenAI], gate: AdaptiveConcurrencyLimiter, messages: List[dict],
+                             global_unit_index: int, paths: dict, use_cached: bool, stats: dict, attempt: int,
+                             copy: int = 0, model: str = MODEL_NAME) -> Tuple[dict, Optional[List[dict]]]:
+    """一次单元请求 + 解析；copy=1 为对冲副本（不读缓存，流式落盘到单独的 .hedge.jsonl）。"""
+    if copy:
+        paths = {**paths, "stream_path": paths["stream_path"].with_suffix(".hedge.jsonl")}
+    record = await call_model_async(aclients, gate, messages, global_unit_index, paths, stream=USE_STREAMING,
+                                    use_cached=use_cached and not copy, stats=stats, attempt=attempt,
+                                    phase="hedge" if copy else "unit", model=model)
+    if is_truncated(record):
+        return record, None   # 截断的输出由调用方续写，不在对冲竞速里做
+    try:
+        questions, fragments = parse_unit_response(record["raw_text"], global_unit_index, model)
+    except Exception as e:
+        raise UnitParseError(record["raw_text"], e) from e
+    if fragments:
+        questions = await fix_broken_fragments_async(aclients, gate, record["raw_text"], questions, fragments,
+                                                     global_unit_index, stats)
+    return record, questions
+
+async def request_unit_hedged_async(aclients: Dict[str, AsyncOpenAI], gate: AdaptiveConcurrencyLimiter, messages: List[dict],
+                                    global_unit_index: int, paths: dict, use_cached: bool, stats: dict,
+                                    attempt: int, hedge: Optional[HedgePolicy],
+                                    model: str = MODEL_NAME) -> Tuple[dict, Optional[List[dict]]]:
+    (record, questions), info = await run_hedged(
+        lambda copy: request_unit_async(aclients, gate, messages, global_unit_index, paths, use_cached, stats,
+                                        attempt, copy, model),
+        hedge)
+    if hedge is not None:
+        if info["winner"]:
+            hedge_path = paths["stream_path"].with_suffix(".hedge.jsonl")
+            if hedge_path.exists():
+                os.replace(hedge_path, paths["stream_path"])
+            print(f"⚡对冲副本先返回（第 {global_unit_index} 单元，{info['elapsed']:.1f}s），主请求已取消")
+        elif not record["cached"]:
+            hedge.observe(info["elapsed"])
+    return record, questions
+
+async def request_unit_with_retries_async(aclients: Dict[str, AsyncOpenAI], gate: AdaptiveConcurrencyLimiter,
+                                          messages: List[dict], global_unit_index: int, paths: dict, stats: dict,
+                                          model: str, hedge: Optional[HedgePolicy], ids: Optional[List[int]] = None
+                                          ) -> Tuple[Optional[str], Optional[List[dict]], Optional[BaseException], int]:
+    ids = ids or list(range(1, NUM_QUESTIONS_PER_UNIT + 1))
+    raw_text = None
+    parsed_questions = None
+    last_exc = None
+    budget = RetryBudget(RETRY_ATTEMPTS, RATE_LIMIT_MAX_DEFERRALS)
+    # 对冲阈值按主模型的耗时分布统计，低档模型的请求不参与对冲
+    hedge = hedge if model == MODEL_NAME else None
+    while budget.can_try() and not CANCEL.cancelled:
+        attempt = budget.begin()
+        try:
+            record, parsed_questions = await request_unit_hedged_async(
+                aclients, gate, messages, global_unit_index, paths, (attempt == 1), stats, attempt, hedge, model)
+            raw_text = record["raw_text"]
+            if is_truncated(record):
+                raw_text, parsed_questions = await continue_truncated_unit_async(
+                    aclients, gate, messages, raw_text, global_unit_index, stats, model, ids)
+            break
+        except Cancelled:
+            break
+        except Exception as e:
+            last_exc = e
+            if isinstance(e, UnitParseError):
+                raw_text = e.raw_text
+            delay = retry_delay(global_unit_index, attempt, e, budget)
+            if delay:
+                await asyncio.sleep(delay)
+    return raw_text, parsed_questions, last_exc, budget.attempts
+
+async def request_unit_split_async(aclients: Dict[str, AsyncOpenAI], gate: AdaptiveConcurrencyLimiter, theme: str,
+                                   global_unit_index: int, paths: dict, stats: dict, model: str, review: str = ""
+                                   ) -> Tuple[Optional[str], Optional[List[dict]], Optional[BaseException], int]:
+    """异步版的按题型拆分；子请求各自占用并发门的名额，不做对冲。"""
+    plan = split_unit_plan()
+    part_stats = [new_unit_stats() for _ in plan]
+    parts = await asyncio.gather(*(
+        request_unit_with_retries_async(aclients, gate, build_split_messages(theme, kind, ids, review), global_unit_index,
+                                        split_part_paths(paths, k), part_stats[k], model, None, ids)
+        for k, (kind, ids) in enumerate(plan)))
+    return merge_split_parts(global_unit_index, plan, parts, stats, part_stats)
+
+async def process_single_unit_async(aclients: Dict[str, AsyncOpenAI], limiter: AdaptiveConcurrencyLimiter,
+                                    global_unit_index: int, theme: str, out_base: Path,
+                                    hedge: Optional[HedgePolicy] = None) -> dict:
+    paths = await asyncio.to_thread(unit_output_paths, global_unit_index, out_base)
+    if await asyncio.to_thread(unit_sql_done, paths):
+        return skipped_unit_result(global_unit_index, paths)
+    if CANCEL.cancelled:
+        return cancelled_unit_result(global_unit_index, paths)
+
+    review = await asyncio.to_thread(review_context, global_unit_index, out_base)
+    user_prompt, messages = build_unit_messages(theme, review)
+
+    started = time.time()
+    stats = new_unit_stats()
+    tiers = unit_model_tiers(global_unit_index)
+    calls = []
+    attempts = 0
+    repair_model, escalate = tiers[-1], None
+
+    for level, model in enumerate(tiers):
+        before = tier_snapshot(stats)
+        if SPLIT_UNIT_REQUESTS:
+            raw_text, parsed_questions, last_exc, n = await request_unit_split_async(
+                aclients, limiter, theme, global_unit_index, paths, stats, model, review)
+        else:
+            raw_text, parsed_questions, last_exc, n = await request_unit_with_retries_async(
+                aclients, limiter, messages, global_unit_index, paths, stats, model, hedge)
+        attempts += n
+        broken = unit_broken_questions(parsed_questions)
+        calls.append(tier_call(model, "unit", stats, before, not broken))
+        escalate = plan_escalation(global_unit_index, tiers, level, broken, parsed_questions) if broken else None
+        if escalate != "unit":
+            repair_model = tiers[level + 1] if escalate else model
+            break
+
+    if parsed_questions is None and CANCEL.cancelled:
+        return finish_unit_result(cancelled_unit_result(global_unit_index, paths), attempts, started, stats,
+                                  messages, None)
+
+    repair_info = None
+    if parsed_questions is not None and (ENABLE_QUESTION_REPAIR or escalate):
+        before = tier_snapshot(stats)
+        parsed_questions, repair_info = await repair_unit_questions_async(aclients, limiter, theme, parsed_questions,
+                                                                          global_unit_index, stats, repair_model)
+        if escalate:
+            calls.append(tier_call(repair_model, "questions", stats, before,
+                                   not repair_info["still_broken"]))
+
+    result = await asyncio.to_thread(write_unit_outputs, global_unit_index, theme, user_prompt,
+                                     raw_text, parsed_questions, last_exc, paths)
+    return finish_cascade(finish_unit_result(result, attempts, started, stats, messages, repair_info), calls)
+
+async def run_units_async(tasks: List[Tuple[int, str]], out_base: Path,
+                          on_result: Optional[Callable[[dict], None]] = None,
+                          deps: Optional[Dict[int, List[int]]] = None) -> List[dict]:
+    """deps：{单元号: [须先完成的单元号]}（复习单元等被复习单元写出 json_parsed），等待期间不占并发门名额。"""
+    pool = get_backend_pool()
+    aclients = init_async_clients(pool)
+    n = len(pool)
+    limiter = AdaptiveConcurrencyLimiter(ASYNC_INITIAL_CONCURRENCY * n, ASYNC_MIN_CONCURRENCY * n, ASYNC_MAX_CONCURRENCY * n)
+    hedge = HedgePolicy(HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, HEDGE_MAX_EXTRA_FRACTION) if ENABLE_HEDGING else None
+    print(f"[ASYNC] 单元数 {len(tasks)}，初始并发 {limiter.limit}（范围 {limiter.min_limit}–{limiter.max_limit}）")
+
+    finished = {gidx: asyncio.Event() for gidx, _ in tasks}
+
+    async def _run(gidx: int, th: str) -> Tuple[int, Any]:
+        try:
+            for dep in (deps or {}).get(gidx, ()):
+                await finished[dep].wait()
+            return gidx, await process_single_unit_async(aclients, limiter, gidx, th, out_base, hedge)
+        except asyncio.CancelledError:
+            return gidx, {"status": "cancelled", "global_unit": gidx}
+        except Exception as e:
+            return gidx, e
+        finally:
+            finished[gidx].set()
+
+    async def _watch_cancel(running: List[asyncio.Task]):
+        while not CANCEL.cancelled:
+            await asyncio.sleep(0.2)
+        for t in running:
+            t.cancel()
+
+    results = []
+    watcher = None
+    try:
+        pending = [asyncio.create_task(_run(gidx, th)) for (gidx, th) in tasks]
+        watcher = asyncio.create_task(_watch_cancel(pending))
+        for fut in asyncio.as_completed(pending):
+            gidx, res = await fut
+            if isinstance(res, Exception):
+                print(f"[EXC] global_unit={gidx} exception: {res}")
+                res = {"status": "error", "global_unit": gidx, "error": repr(res)}
+            else:
+                report_unit_result(gidx, res)
+            results.append(res)
+            if on_result is not None:
+                await asyncio.to_thread(on_result, res)
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        for aclient in aclients.values():
+            await aclient.close()
+    if hedge is not None:
+        print(f"[HEDGE] {hedge.summary()}")
+    return results
+
+# ----------------------------
+# ========== 线程池引擎 ==========
+# ----------------------------
+def run_units_threaded(tasks: List[Tuple[int, str]], out_base: Path,
+                       on_result: Optional[Callable[[dict], None]] = None,
+                       deps: Optional[Dict[int, List[int]]] = None) -> List[dict]:
+    """deps 同 run_units_async：依赖未完成的单元先不提交，依赖都完成后按 tasks 中的顺序提交。"""
+    deps = deps or {}
+    pool = get_backend_pool()
+    clients = init_clients(pool)
+    results = []
+    unfinished = {gidx for gidx, _ in tasks}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS * len(pool)) as ex:
+        future_map = {}
+        pending = set()
+        blocked = list(tasks)
+
+        def _submit_ready():
+            nonlocal blocked
+            still = []
+            for (gidx, th) in blocked:
+                if any(dep in unfinished for dep in deps.get(gidx, ())):
+                    still.append((gidx, th))
+                    continue
+                fut = ex.submit(process_single_unit, clients, gidx, th, out_base)
+                future_map[fut] = (gidx, th)
+                pending.add(fut)
+            blocked = still
+
+        _submit_ready()
+        while pending:
+            # 带超时地等待，Ctrl-C 后能及时取消尚未开始的单元
+            done, not_done = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            pending.clear()
+            pending.update(not_done)
+            if CANCEL.cancelled:
+                for fut in pending:
+                    fut.cancel()
+            for fut in done:
+                gidx, th = future_map[fut]
+                if fut.cancelled():
+                    res = {"status": "cancelled", "global_unit": gidx}
+                else:
+                    try:
+                        res = fut.result()
+                        report_unit_result(gidx, res)
+                    except Exception as e:
+                        print(f"[EXC] global_unit={gidx} exception: {e}")
+                        res = {"status": "error", "global_unit": gidx, "error": repr(e)}
+                results.append(res)
+                if on_result is not None:
+                    on_result(res)
+                unfinished.discard(gidx)
+            if CANCEL.cancelled:
+                for (gidx, _th) in blocked:
+                    res = {"status": "cancelled", "global_unit": gidx}
+                    results.append(res)
+                    if on_result is not None:
+                        on_result(res)
+                blocked = []
+            elif done and blocked:
+                _submit_ready()
+    return results
+
+def order_tasks(tasks: List[Tuple[int, str]]) -> List[Tuple[int, str]]:
+    """按 JOB_ORDER 重排待调度单元，并打印按当前并发模拟的预计完工时间；模拟结果没有变短时保持原顺序。"""
+    if JOB_ORDER != "lpt" or len(tasks) < 2:
+        return tasks
+    metrics = get_metrics()
+    history = load_unit_history(metrics.path, metrics.script)
+    costs = estimate_unit_costs(tasks, lambda theme: build_unit_messages(theme)[1], history)
+    ordered = lpt_order(costs)
+    n = len(get_backend_pool())
+    workers = ASYNC_INITIAL_CONCURRENCY * n if USE_ASYNC_ENGINE else MAX_WORKERS * n
+    before = simulate_makespan([c.cost for c in costs], workers)
+    after = simulate_makespan([c.cost for c in ordered], workers)
+    known = sum(1 for c in costs if c.source == "history")
+    unit = "s" if known else "（相对值）"
+    if after >= before:
+        print(f"[ORDER] LPT 调度：{known}/{len(costs)} 个单元有历史耗时；按并发 {workers} 模拟，"
+              f"预计完工 {before:.1f} -> {after:.1f}{unit}，没有缩短，保持原顺序")
+        return tasks
+    print(f"[ORDER] LPT 调度：{known}/{len(costs)} 个单元有历史耗时；按并发 {workers} 模拟，"
+          f"预计完工 {before:.1f} -> {after:.1f}{unit}；前 5 个：{[c.global_unit for c in ordered[:5]]}")
+    return [(c.global_unit, c.theme) for c in ordered]
+
+# ----------------------------
+# ========== 批量推理（Batch API） ==========
+# ----------------------------
+def batch_custom_id(global_unit_index: int) -> str:
+    return f"unit-{global_unit_index:03d}"
+
+def submit_batch(tasks: List[Tuple[int, str]], requests_path: Path) -> Path:
+    """把所有单元的首轮请求写成一份 Batch JSONL（messages 与在线模式逐字节一致，结果可直接进响应缓存）。"""
+    entries = []
+    for gidx, theme in tasks:
+        _, messages = build_unit_messages(theme)
+        entries.append(BatchEntry(batch_custom_id(gidx), MODEL_NAME, messages, request_params(MODEL_NAME),
+                                  {"global_unit": gidx, "theme": theme}))
+    return write_batch_requests(requests_path, entries)
+
+def collect_batch_unit(item: BatchResult, out_base: Path) -> dict:
+    """一行批量结果 -> 解析 / 校验 / 写 SQL（与在线模式相同的产物与结果结构）。"""
+    global_unit_index, theme = item.meta["global_unit"], item.meta["theme"]
+    paths = unit_output_paths(global_unit_index, out_base)
+    user_prompt, messages = build_unit_messages(theme)
+    started = time.time()
+    stats = new_unit_stats()
+    tracker = get_metrics().track(unit=global_unit_index, attempt=1, phase="batch", model=MODEL_NAME)
+    raw_text, parsed_questions, last_exc = None, None, None
+    if item.error is not None:
+        tracker.finish(outcome="error", error=item.error)
+        last_exc = RuntimeError(f"批量请求 {item.custom_id} 失败：{item.error}")
+    else:
+        tracker.finish(item.record, outcome="batch")
+        add_record_usage(stats, item.record)
+        raw_text = item.record["raw_text"]
+        try:
+            parsed_questions, _ = parse_unit_response(raw_text, global_unit_index)
+            if not parsed_questions:
+                raise ValueError("整体 JSON 解析失败，本地修复没有捞回完整的题目")
+        except Exception as e:
+            last_exc = e
+    result = write_unit_outputs(global_unit_index, theme, user_prompt, raw_text, parsed_questions, last_exc, paths)
+    return finish_unit_result(result, 1, started, stats, messages, None)
+
+def collect_batch(requests_path: Path, results_path: Path, out_base: Path,
+                  on_result: Optional[Callable[[dict], None]] = None) -> List[dict]:
+    results = []
+    for item in collect_batch_results(requests_path, results_path, get_response_cache()):
+        try:
+            res = collect_batch_unit(item, out_base)
+            report_unit_result(res["global_unit"], res)
+        except Exception as e:
+            print(f"[EXC] {item.custom_id} exception: {e}")
+            res = {"status": "error", "global_unit": item.meta.get("global_unit"), "error": repr(e)}
+        results.append(res)
+        if on_result is not None:
+            on_result(res)
+    return results
+
+# ----------------------------
+# ========== 离线重建（不调用 API） ==========
+# ----------------------------
+_UNIT_FILE_RE = re.compile(r"unit_(\d+)_(raw|parsed)\.json$")
+
+def rebuild_single_unit(source_path: str, source: str, out_base: str) -> dict:
+    """
+    子进程中执行：读取一个 json_raw / json_parsed 文件，重新走
+    解析 → normalize_fill_code_field → 转义 → SQL，写出到 out_base 下。
+    """
+    path = Path(source_path)
+    m = _UNIT_FILE_RE.search(path.name)
+    if not m:
+        return {"status": "error", "source": source_path, "error": "无法从文件名识别 global unit"}
+    global_unit_index = int(m.group(1))
+    paths = unit_output_paths(global_unit_index, Path(out_base))
+    stage, unit_local, unit_id = paths["stage"], paths["unit_local"], paths["unit_id"]
+    base = {"global_unit": global_unit_index, "stage": stage, "unit_local": unit_local, "unit_id": unit_id,
+            "source": source_path, "sql": str(paths["sql_path"])}
+
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    if source == "json_raw":
+        raw_text = data.get("raw_text")
+        try:
+            parsed_questions = parse_questions_from_text(raw_text)
+        except Exception as e:
+            write_failed_unit_sql(global_unit_index, raw_text, e, paths)
+            return {**base, "status": "error", "error": repr(e)}
+        with open(paths["parsed_path"], "w", encoding="utf-8") as pf:
+            json.dump(parsed_questions, pf, ensure_ascii=False, indent=2)
+    else:
+        parsed_questions = data.get("questions") if isinstance(data, dict) else data
+        if not isinstance(parsed_questions, list):
+            e = ValueError("json_parsed 文件内容不是题目数组 (list)。")
+            write_failed_unit_sql(global_unit_index, None, e, paths)
+            return {**base, "status": "error", "error": repr(e)}
+
+    issues = write_unit_sql(global_unit_index, parsed_questions, paths)
+    if issues and QUARANTINE_INVALID_UNITS:
+        return {**base, "status": "quarantined", "questions": len(parsed_questions),
+                "quarantine": str(paths["quarantine_path"]), "issues": len(issues)}
+    return {**base, "status": "ok", "questions": len(parsed_questions)}
+
+def rebuild_all_units(src_base: Path, out_base: Path, source: str = "json_raw", workers: Optional[int] = None) -> dict:
+    """遍历 src_base/<source>/stageN/ 下所有单元文件，在进程池中并行重建 SQL，并写出 summary_rebuild.json。"""
+    if source not in ("json_raw", "json_parsed"):
+        raise ValueError("source 只能是 json_raw 或 json_parsed")
+    files = sorted((src_base / source).glob("stage*/unit_*_*.json"),
+                   key=lambda p: int(_UNIT_FILE_RE.search(p.name).group(1)) if _UNIT_FILE_RE.search(p.name) else 0)
+    print(f"[REBUILD] 从 {src_base / source} 读取 {len(files)} 个单元，输出到 {out_base}，进程数 {workers or os.cpu_count()}")
+    ensure_dir(out_base)
+
+    t0 = time.time()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        future_map = {ex.submit(rebuild_single_unit, str(fp), source, str(out_base)): fp for fp in files}
+        for fut in as_completed(future_map):
+            fp = future_map[fut]
+            try:
+                res = fut.result()
+            except Exception as e:
+                res = {"status": "error", "source": str(fp), "error": repr(e)}
+            results.append(res)
+            if res.get("status") == "error":
+                print(f"[ERR] {fp.name}: {res.get('error')}")
+    elapsed = time.time() - t0
+    results.sort(key=lambda r: r.get("global_unit", 0))
+
+    summary = {
+        "mode": "rebuild",
+        "source": source,
+        "total": len(results),
+        "ok": sum(1 for r in results if r.get("status") == "ok"),
+        "quarantined": sum(1 for r in results if r.get("status") == "quarantined"),
+        "error": sum(1 for r in results if r.get("status") not in ("ok", "quarantined")),
+        "elapsed_sec": round(elapsed, 3),
+        "details": results
+    }
+    summary_path = out_base / "summary_rebuild.json"
+    with open(summary_path, "w", encoding="utf-8") as sf:
+        json.dump(summary, sf, ensure_ascii=False, indent=2)
+    print(f"[REBUILD] ok={summary['ok']} quarantined={summary['quarantined']} error={summary['error']} 耗时 {elapsed:.2f}s，summary -> {summary_path}")
+    return summary
 
 # ----------------------------
 # ========== 主流程 ==========
 # ----------------------------
-def main():
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="生成题目并导出 SQL（不带参数时按脚本顶部配置调用 API 生成）")
+    ap.add_argument("--rebuild", action="store_true", help="离线重建：不调用 API，从已保存的 JSON 重新生成 SQL")
+    ap.add_argument("--rebuild-from", choices=["json_raw", "json_parsed"], default=REBUILD_SOURCE, help="重建的数据来源")
+    ap.add_argument("--src-dir", default=None, help="包含 json_raw/json_parsed 的目录（默认 BASE_OUT_DIR）")
+    ap.add_argument("--out-dir", default=None, help="重建输出目录（默认 REBUILD_OUT_DIR 或 BASE_OUT_DIR）")
+    ap.add_argument("--workers", type=int, default=REBUILD_WORKERS, help="重建进程数")
+    ap.add_argument("--resume", action="store_true", help="按运行清单只调度上次未完成 / 失败 / 被隔离的单元")
+    batch = ap.add_mutually_exclusive_group()
+    batch.add_argument("--batch-submit", action="store_true", help="只写出 Batch API 请求 JSONL，不调用 API")
+    batch.add_argument("--batch-collect", metavar="RESULTS", default=None, help="读取 Batch API 结果 JSONL 并导出 SQL（离线）")
+    ap.add_argument("--batch-requests", default=None,
+                    help="批量请求文件路径（默认 BATCH_REQUESTS_PATH 或 BASE_OUT_DIR/batch/requests.jsonl）")
+    return ap.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.rebuild:
+        src_base = Path(args.src_dir) if args.src_dir else BASE_OUT_DIR
+        out_base = Path(args.out_dir) if args.out_dir else (Path(REBUILD_OUT_DIR) if REBUILD_OUT_DIR else src_base)
+        rebuild_all_units(src_base, out_base, source=args.rebuild_from, workers=args.workers)
+        return
+
     print("=== generate_and_export_sql_final_v7 START ===")
+    install_sigint_handler(CANCEL)
+    PROMPT.check_drift()
+    if SPLIT_UNIT_REQUESTS:
+        split_unit_plan()
+        for prompt in SPLIT_PROMPTS[OUTPUT_FORMAT].values():
+            prompt.check_drift()
     total_units = STAGES * UNITS_PER_STAGE
     start = max(1, GLOBAL_UNIT_START)
     end = GLOBAL_UNIT_END if GLOBAL_UNIT_END is not None else total_units
@@ -576,7 +2164,6 @@ def main():
     if len(themes) < total_units:
         print(f"[INFO] themes count ({len(themes)}) < total units ({total_units}). Will use last theme as fallback for missing items.")
 
-    client = init_client(DEEPSEEK_API_KEY)
     ensure_dir(BASE_OUT_DIR)
 
     tasks = []
@@ -584,33 +2171,80 @@ def main():
         theme = themes[global_idx - 1] if (global_idx - 1) < len(themes) else (themes[-1] if themes else "")
         tasks.append((global_idx, theme))
 
-    results = []
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
-        future_map = {}
-        for (gidx, th) in tasks:
-            fut = ex.submit(process_single_unit, client, gidx, th, BASE_OUT_DIR)
-            future_map[fut] = (gidx, th)
-        for fut in as_completed(future_map):
-            gidx, th = future_map[fut]
-            try:
-                res = fut.result()
-                results.append(res)
-                if res.get("status") == "ok":
-                    print(f"[OK] global_unit={gidx} -> sql: {res.get('sql')}")
-                else:
-                    print(f"[ERR] global_unit={gidx} -> error saved at {res.get('sql')}")
-            except Exception as e:
-                print(f"[EXC] global_unit={gidx} exception: {e}")
-                results.append({"status": "error", "global_unit": gidx, "error": repr(e)})
+    requests_path = Path(args.batch_requests or BATCH_REQUESTS_PATH or BASE_OUT_DIR / "batch" / "requests.jsonl")
+    if args.batch_collect:
+        # 收集的单元以提交时的请求文件为准，与当前 GLOBAL_UNIT 范围无关
+        try:
+            meta = read_batch_meta(requests_path)
+        except (OSError, ValueError) as e:
+            raise SystemExit(f"[BATCH] 无法读取提交时的元数据 {meta_path_for(requests_path)}：{e}")
+        tasks = [(m["global_unit"], m["theme"]) for m in meta.values() if isinstance(m, dict) and "global_unit" in m]
+        if not tasks:
+            raise SystemExit(f"[BATCH] {meta_path_for(requests_path)} 中没有本脚本提交的单元："
+                             f"请用 --batch-requests 指定 --batch-submit 写出的请求文件")
+        start, end = min(g for g, _ in tasks), max(g for g, _ in tasks)
+
+    store = RunStore(RUN_STORE_PATH) if USE_RUN_STORE else None
+    if args.resume:
+        if store is None:
+            raise RuntimeError("--resume 需要开启 USE_RUN_STORE")
+        todo = set(store.units_to_resume(BASE_OUT_DIR, [g for g, _ in tasks]))
+        print(f"[RESUME] 范围内 {len(tasks)} 个单元，待续跑 {len(todo)} 个：{sorted(todo)}")
+        tasks = [(g, th) for (g, th) in tasks if g in todo]
+
+    if args.batch_submit:
+        submit_batch(tasks, requests_path)
+        print(f"[BATCH] 提交该文件到 Batch API，完成后运行：--batch-collect <results.jsonl> --batch-requests \"{requests_path}\"")
+        return
+
+    deps = {}
+    if not args.batch_collect:
+        deps = plan_review_units(themes, tasks)
+        tasks = order_tasks(tasks)
+
+    mode = "batch" if args.batch_collect else ("resume" if args.resume else "generate")
+    on_result = None
+    run_id = None
+    if store is not None:
+        run_id = store.start_run(mode, BASE_OUT_DIR, MODEL_NAME, [g for g, _ in tasks])
+        on_result = lambda res: store.record_unit(run_id, res)
+        print(f"[RUN] run_id={run_id} 运行清单 -> {store.path}")
+
+    t0 = time.time()
+    if args.batch_collect:
+        results = collect_batch(requests_path, Path(args.batch_collect), BASE_OUT_DIR, on_result)
+    elif USE_ASYNC_ENGINE:
+        results = asyncio.run(run_units_async(tasks, BASE_OUT_DIR, on_result, deps))
+    else:
+        results = run_units_threaded(tasks, BASE_OUT_DIR, on_result, deps)
+    print(f"[INFO] 生成阶段耗时 {time.time() - t0:.1f}s")
+    if store is not None:
+        store.finish_run(run_id)
+    metrics_report = get_metrics().print_report()
+    cascade_report = summarize_cascade(results, MODEL_PRICES, MODEL_NAME)
+    if cascade_report is not None:
+        print(format_cascade(cascade_report))
+    if not args.batch_collect and len(get_backend_pool()) > 1:
+        print(f"[POOL] {json.dumps(get_backend_pool().summary(), ensure_ascii=False)}")
+    print(RETRY_LEDGER.format())
 
     summary = {
+        "mode": mode,
+        "run_id": run_id,
         "requested_range": [start, end],
         "total": len(results),
         "ok": sum(1 for r in results if r.get("status") == "ok"),
-        "error": sum(1 for r in results if r.get("status") != "ok"),
+        "quarantined": sum(1 for r in results if r.get("status") == "quarantined"),
+        "cancelled": sum(1 for r in results if r.get("status") == "cancelled"),
+        "error": sum(1 for r in results if r.get("status") not in ("ok", "quarantined", "cancelled")),
+        "interrupted": CANCEL.cancelled,
+        "metrics": metrics_report,
+        "backends": get_backend_pool().summary() if not args.batch_collect else None,
+        "cascade": cascade_report,
+        "retry_policy": RETRY_LEDGER.summary(),
         "details": results
     }
-    summary_path = BASE_OUT_DIR / "summary_generate.json"
+    summary_path = BASE_OUT_DIR / ("summary_batch.json" if args.batch_collect else "summary_generate.json")
     with open(summary_path, "w", encoding="utf-8") as sf:
         json.dump(summary, sf, ensure_ascii=False, indent=2)
     print(f"[DONE] summary saved to {summary_path}")
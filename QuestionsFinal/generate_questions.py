@@ -11,35 +11,39 @@ generate_deepseek_questions_no_cli.py
 - 并发使用 ThreadPoolExecutor，最大并发数为 MAX_WORKERS（默认 5）
 - 指定的 prompt 模板会被格式化注入 {stage},{unit},{theme},{input_address},{output_address},{num_questions}
 - 每个单元的输出保存在 OUT_DIR/stage_{s:02d}/unit_{u:02d}.json
-- 简单重试（RETRY_ATTEMPTS 与指数退避）
+- 所有线程共用 Common/http_client.py 的 requests.Session（keep-alive 连接池大小 = MAX_WORKERS）
+- 请求经 Common/rate_limiter.py 的 SharedRateLimiter.call 发出：先从共享令牌桶取额度，429 时按 Retry-After
+  写入共享冷却后重排队，5xx / 超时等瞬时故障退避重试（最多 RETRY_ATTEMPTS 次），与其他同时运行的生成脚本共用配额
 - 将原始 API 返回和 AI 文本一并保存，便于后续解析
 """
 
 import os
-import time
+import sys
 import json
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Optional
-import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Common"))
+from rate_limiter import SharedRateLimiter, estimate_tokens_for_messages
+from http_client import requests_session
 
 # ---------------------------
 # ========== 配置区 ==========
 # ---------------------------
 # API key：你可以把 key 填在这里（不推荐长期明文保存），或在运行前用环境变量 DEEPSEEK_API_KEY 设置。
-DEEPSEEK_API_KEY = ""
+DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
 
-# DeepSeek API endpoint（如需替换为实际 endpoint，请改这里）
-DEEPSEEK_BASE_URL = "https://api.deepseek.com"
-API_ENDPOINT = DEEPSEEK_BASE_URL
+# DeepSeek API base URL（环境变量 DEEPSEEK_BASE_URL 优先，例如指向 Common/mock_llm_server.py）
+DEEPSEEK_BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+API_ENDPOINT = DEEPSEEK_BASE_URL.rstrip("/") + "/chat/completions"
 
 # 脚本控制参数（已写死，不使用 CLI）
 STAGES = 5                # 共有几个 stage
 UNITS_PER_STAGE = 30      # 每个 stage 包含多少 unit
 NUM_QUESTIONS_PER_UNIT = 15
 MAX_WORKERS = 5           # 同时并发的最大请求数量（你要求的 5）
-RETRY_ATTEMPTS = 4
-RETRY_BACKOFF_FACTOR = 2  # 指数退避基底
+RETRY_ATTEMPTS = 4        # 瞬时故障最多尝试几次（429 另计，由共享限流器登记冷却后重排队）
 
 # 文件 / 路径配置（写死）
 THEMES_TXT_PATH = "unit_themes.txt"   # 每行一个单元主题（按 stage-major 顺序）
@@ -48,21 +52,20 @@ OUT_DIR = "./deepseek_outputs"        # 输出目录（会自动创建）
 # DeepSeek 模型名称（按 provider 要求设置）
 MODEL_NAME = "deepseek-chat"
 
+# 共享限流（与其他生成脚本共用同一 scope 的 RPM/TPM 额度）
+RATE_LIMIT_SCOPE = "deepseek"
+RATE_LIMIT_RPM = 120
+RATE_LIMIT_TPM = 400000
+EXPECTED_COMPLETION_TOKENS = 4000
+
 # System prompt 可选（如果你想使用 system role）
 USE_SYSTEM_PROMPT = False
 SYSTEM_PROMPT = "You are an assistant that generates exam questions in structured JSON format."
 
 # 你已经准备好的固定 prompt（把你固定的 prompt 全部放到下面的字符串中，保留占位符）
 # 占位符：{stage}, {unit}, {theme}, {input_address}, {output_address}, {num_questions}
+# 固定的格式要求放在最前面、逐单元变化的信息放在最后，让各单元请求共享尽可能长的相同前缀（命中服务端前缀缓存）
 PROMPT_TEMPLATE = """
-请为单元生成 {num_questions} 道编程题（题型、题目、选项/答案/解析等），
-本单元信息如下:
-stage: {stage}
-unit: {unit}
-unit_theme: {theme}
-input_address: {input_address}
-output_address: {output_address}
-
 题目输出请以 **严格的 JSON 数组** 形式返回（主键为数组），
 每道题包含至少字段：q_id, type, title, text, choices(如有), answer, explanation。
 注意：
@@ -71,6 +74,14 @@ output_address: {output_address}
 - 若生成选择题，请提供 choices 字段（数组），并在 answer 中给出正确项。
 - 保持题目风格一致，难度为中等偏下到中等。
 - 请不要附带多余的markdown或额外解释，输出只保留 JSON 数组或在最前/最后补充少量机器可剥离说明。
+
+请为单元生成 {num_questions} 道编程题（题型、题目、选项/答案/解析等），
+本单元信息如下:
+stage: {stage}
+unit: {unit}
+unit_theme: {theme}
+input_address: {input_address}
+output_address: {output_address}
 """
 
 # ---------------------------
@@ -103,7 +114,7 @@ def call_deepseek_api(api_key: str, model: str, messages: List[dict], timeout: i
         "messages": messages,
         "stream": False
     }
-    resp = requests.post(API_ENDPOINT, headers=headers, json=payload, timeout=timeout)
+    resp = requests_session(MAX_WORKERS).post(API_ENDPOINT, headers=headers, json=payload, timeout=timeout)
     resp.raise_for_status()
     return resp.json()
 
@@ -138,62 +149,60 @@ def process_unit(api_key: str,
         messages.append({"role": "system", "content": system_prompt})
     messages.append({"role": "user", "content": prompt_text})
 
-    last_exc = None
-    for attempt in range(1, RETRY_ATTEMPTS + 1):
-        try:
-            raw = call_deepseek_api(api_key, model, messages)
-            # 提取文本（兼容常见的 choices/ message 结构）
-            ai_text = None
-            choices = raw.get("choices")
-            if choices and isinstance(choices, list) and len(choices) > 0:
-                first = choices[0]
-                # 常见形态 first.message.content or first.text
-                ai_text = None
-                if isinstance(first, dict):
-                    msg = first.get("message")
-                    if isinstance(msg, dict):
-                        ai_text = msg.get("content")
-                    if not ai_text:
-                        # fallback
-                        ai_text = first.get("text") or first.get("content")
-            # 如果仍然没有抓到，直接把 raw 转为字符串
-            if ai_text is None:
-                try:
-                    ai_text = json.dumps(raw, ensure_ascii=False)
-                except Exception:
-                    ai_text = str(raw)
+    limiter = SharedRateLimiter(scope=RATE_LIMIT_SCOPE, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM)
+    est_tokens = estimate_tokens_for_messages(messages, EXPECTED_COMPLETION_TOKENS)
+    try:
+        raw = limiter.call(lambda: call_deepseek_api(api_key, model, messages), est_tokens,
+                           transient_retries=RETRY_ATTEMPTS - 1)
+    except Exception as e:
+        print(f"[WARN] stage={stage} unit={unit} failed: {e}")
+        # 重试用尽 -> 写入错误文件
+        err_dir = Path(out_dir) / "errors"
+        ensure_dir(err_dir)
+        err_path = err_dir / f"stage{stage:02d}_unit{unit:02d}_error.txt"
+        with open(err_path, "w", encoding="utf-8") as fe:
+            fe.write(f"Last exception:\n{repr(e)}\n")
+        return {"status": "error", "stage": stage, "unit": unit, "error": repr(e), "err_path": str(err_path)}
 
-            # 保存完整输出（包括原始 raw 以便后续解析）
-            out_stage_dir = Path(out_dir) / f"stage_{stage:02d}"
-            ensure_dir(out_stage_dir)
-            out_path = out_stage_dir / f"unit_{unit:02d}.json"
-            out_payload = {
-                "stage": stage,
-                "unit": unit,
-                "theme": theme,
-                "input_address": input_addr,
-                "output_address": output_addr,
-                "prompt_sent": prompt_text,
-                "raw_response": raw,
-                "ai_text": ai_text
-            }
-            with open(out_path, "w", encoding="utf-8") as fw:
-                json.dump(out_payload, fw, ensure_ascii=False, indent=2)
+    # 提取文本（兼容常见的 choices/ message 结构）
+    ai_text = None
+    choices = raw.get("choices")
+    if choices and isinstance(choices, list) and len(choices) > 0:
+        first = choices[0]
+        # 常见形态 first.message.content or first.text
+        ai_text = None
+        if isinstance(first, dict):
+            msg = first.get("message")
+            if isinstance(msg, dict):
+                ai_text = msg.get("content")
+            if not ai_text:
+                # fallback
+                ai_text = first.get("text") or first.get("content")
+    # 如果仍然没有抓到，直接把 raw 转为字符串
+    if ai_text is None:
+        try:
+            ai_text = json.dumps(raw, ensure_ascii=False)
+        except Exception:
+            ai_text = str(raw)
 
-            return {"status": "ok", "stage": stage, "unit": unit, "path": str(out_path)}
-        except Exception as e:
-            last_exc = e
-            wait = RETRY_BACKOFF_FACTOR ** (attempt - 1)
-            print(f"[WARN] stage={stage} unit={unit} attempt={attempt} failed: {e}. retry in {wait}s")
-            time.sleep(wait)
+    # 保存完整输出（包括原始 raw 以便后续解析）
+    out_stage_dir = Path(out_dir) / f"stage_{stage:02d}"
+    ensure_dir(out_stage_dir)
+    out_path = out_stage_dir / f"unit_{unit:02d}.json"
+    out_payload = {
+        "stage": stage,
+        "unit": unit,
+        "theme": theme,
+        "input_address": input_addr,
+        "output_address": output_addr,
+        "prompt_sent": prompt_text,
+        "raw_response": raw,
+        "ai_text": ai_text
+    }
+    with open(out_path, "w", encoding="utf-8") as fw:
+        json.dump(out_payload, fw, ensure_ascii=False, indent=2)
 
-    # 全部重试失败 -> 写入错误文件
-    err_dir = Path(out_dir) / "errors"
-    ensure_dir(err_dir)
-    err_path = err_dir / f"stage{stage:02d}_unit{unit:02d}_error.txt"
-    with open(err_path, "w", encoding="utf-8") as fe:
-        fe.write(f"Last exception:\n{repr(last_exc)}\n")
-    return {"status": "error", "stage": stage, "unit": unit, "error": repr(last_exc), "err_path": str(err_path)}
+    return {"status": "ok", "stage": stage, "unit": unit, "path": str(out_path)}
 
 # ---------------------------
 # ========== 主流程 ==========
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+incremental_json.py
+
+流式输出的增量题目解析器（供 FinalScript 的 streaming 模式使用）：
+- 逐块 feed() 模型输出，内部维护字符串 / 转义 / 括号深度状态，线性扫描、不回头重扫
+- 支持裸数组 [...]、{"questions": [...]} 包装，以及 ```json 围栏前缀
+- 每当数组中的一个题目对象的右花括号到达，就立即解析并做结构检查，返回给调用方落盘；
+  单题不是合法 JSON 时先用 Common/json_repair.py 在本地修复，修复类别累计在 fixes 中
+- 传入 expand（如 compact_questions.expand_question）时，数组元素也可以是紧凑格式的题目数组，
+  先展开成标准 dict 再检查
+- 明显异常时抛出 StreamAbort，调用方据此立刻关闭流、停止为无用 token 付费：
+  - 前言超过 MAX_PRELUDE_CHARS 仍未出现 [ 或 {（模型在输出散文）
+  - 数组元素不是对象
+  - 第一道题就解析失败或结构不符（之后的单题错误只记录，不中断；strict_first=False 时第一道题也只记录）
+- 解析失败 / 结构不符的题目片段原文保存在 rejected 中（供本地修复之后的“修复 JSON”请求使用）
+"""
+from typing import Any, Callable, Dict, List, Optional
+
+from json_repair import parse_json_tolerant
+
+# 前言（``` 围栏、说明文字）最多允许多少字符
+MAX_PRELUDE_CHARS = 400
+
+QUESTION_TYPES = ("choice", "fill")
+
+
+class StreamAbort(Exception):
+    """流式输出被判定为明显不可用，应立即终止请求。"""
+
+
+def default_question_check(q) -> Optional[str]:
+    """最小结构检查：是对象、有 id、type 为 choice / fill。返回错误描述或 None。"""
+    if not isinstance(q, dict):
+        return "题目不是 JSON 对象"
+    if "id" not in q:
+        return "题目缺少 id"
+    q_type = str(q.get("type") or "").strip().lower()
+    if q_type not in QUESTION_TYPES:
+        return f"未知题型 type={q.get('type')!r}"
+    return None
+
+
+class IncrementalQuestionParser:
+    def __init__(self, check: Callable[[dict], Optional[str]] = default_question_check,
+                 max_prelude_chars: int = MAX_PRELUDE_CHARS, expand: Optional[Callable[[Any], Any]] = None,
+                 strict_first: bool = True):
+        self.check = check
+        self.strict_first = strict_first
+        self.expand = expand
+        self.max_prelude_chars = max_prelude_chars
+        self.text = ""
+        self.items: List[dict] = []
+        self.errors: List[str] = []
+        self.rejected: List[str] = []
+        self.fixes: Dict[str, int] = {}
+        self.complete_end = 0     # 最后一道通过检查的题目在 text 中的结束位置（截断续写时保留到这里）
+        self._pos = 0
+        self._state = "prelude"   # prelude -> (wrapper ->) array -> done
+        self._depth = 0           # 数组内部的嵌套深度，0 表示位于数组元素之间
+        self._in_string = False
+        self._escape = False
+        self._obj_start = None
+
+    @property
+    def complete(self) -> bool:
+        """题目数组是否已经完整闭合（没有被截断）。"""
+        return self._state == "done"
+
+    def feed(self, chunk: str) -> List[dict]:
+        """喂入一段新文本，返回本次新完成并通过检查的题目对象。"""
+        if not chunk:
+            return []
+        self.text += chunk
+        new_items = []
+        text = self.text
+        i = self._pos
+        n = len(text)
+        while i < n and self._state != "done":
+            ch = text[i]
+            if self._state == "prelude":
+                if ch == "[":
+                    self._state = "array"
+                elif ch == "{":
+                    self._state = "wrapper"
+                elif i >= self.max_prelude_chars:
+                    raise StreamAbort(f"前 {self.max_prelude_chars} 个字符内没有出现 JSON（疑似散文输出）")
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif self._state == "wrapper":
+                # {"questions": [ ... ]}：跳过键名字符串，找到第一个数组
+                if ch == '"':
+                    self._in_string = True
+                elif ch == "[":
+                    self._state = "array"
+            else:
+                if ch == '"':
+                    if self._depth == 0:
+                        raise StreamAbort("题目数组中出现了非对象元素（字符串）")
+                    self._in_string = True
+                elif ch == "{" or ch == "[":
+                    if self._depth == 0:
+                        if ch == "[" and self.expand is None:
+                            raise StreamAbort("题目数组中出现了非对象元素（数组）")
+                        self._obj_start = i
+                    self._depth += 1
+                elif ch == "}" or ch == "]":
+                    if self._depth == 0:
+                        if ch == "]":
+                            self._state = "done"
+                        else:
+                            raise StreamAbort("括号不匹配")
+                    else:
+                        self._depth -= 1
+                        if self._depth == 0:
+                            item = self._finish_object(text[self._obj_start:i + 1])
+                            if item is not None:
+                                new_items.append(item)
+                                self.complete_end = i + 1
+                            self._obj_start = None
+                elif self._depth == 0 and not (ch.isspace() or ch == ","):
+                    raise StreamAbort(f"题目数组中出现了非法字符 {ch!r}")
+            i += 1
+        self._pos = i
+        return new_items
+
+    def _finish_object(self, fragment: str) -> Optional[dict]:
+        try:
+            obj, fixes = parse_json_tolerant(fragment)
+            for kind, n in fixes.items():
+                self.fixes[kind] = self.fixes.get(kind, 0) + n
+            if self.expand is not None:
+                obj = self.expand(obj)
+            err = self.check(obj) if self.check else None
+        except Exception as e:
+            obj, err = None, f"题目 JSON 解析失败: {e}"
+        if err is None:
+            self.items.append(obj)
+            return obj
+        if not self.items and self.strict_first:
+            raise StreamAbort(f"第一道题即不合规：{err}")
+        self.errors.append(err)
+        self.rejected.append(fragment)
+        return None
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+job_ordering.py
+
+FinalScript 的单元调度顺序（makespan 优化）：
+- 按单元号顺序提交时，“复习上一单元”、小复习 / 阶段总复习这类耗时最长的单元常常排在最后，整次运行被尾巴拖长
+- 每个单元先估一个耗时：
+  - 有历史的单元：取 metrics JSONL 中历次运行该单元真正请求 API（非缓存）的调用耗时之和的中位数
+  - 没有历史的单元：按 prompt 大小与主题特征（复习 / 多单元总复习）给出相对耗时，
+    再用有历史的单元把相对值整体校准到秒（所有单元都没有历史时保持相对值，只用于排序）
+- lpt_order：最长处理时间优先（LPT），耗时相同的按单元号；不改变请求内容，不增加任何 API 花费
+- simulate_makespan：按给定并发数做贪心列表调度的模拟，打印顺序调度与 LPT 的预计完工时间对比
+
+用法：
+    history = load_unit_history(metrics.path, "finalscript_v7")
+    costs = estimate_unit_costs(tasks, lambda theme: build_unit_messages(theme)[1], history)
+    tasks = [(c.global_unit, c.theme) for c in lpt_order(costs)]
+"""
+import re
+import sys
+import heapq
+import statistics
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Common"))
+from llm_metrics import load_events
+from rate_limiter import estimate_tokens_for_messages
+
+# 没有历史时的相对耗时：1 + prompt token / PROMPT_TOKENS_PER_COST，再乘主题特征系数
+PROMPT_TOKENS_PER_COST = 20000
+REVIEW_FACTOR = 1.3           # 主题里带“复习××”（复习上一单元的内容）
+SUMMARY_REVIEW_FACTOR = 1.6   # 小复习 / 阶段总复习（覆盖多个单元）
+SUMMARY_REVIEW_RE = re.compile(r"(小|总)复习")
+HISTORY_RUNS = 5              # 每个单元只看最近几次运行
+
+
+class UnitCost(NamedTuple):
+    global_unit: int
+    theme: str
+    cost: float
+    source: str   # "history" / "estimate"
+
+
+def load_unit_history(metrics_path: Path, script: Optional[str] = None) -> Dict[int, float]:
+    """{单元号: 历史耗时中位数（秒）}；只统计带非缓存单元请求的 (运行, 单元)，把同一运行里的修复调用也算进去。"""
+    metrics_path = Path(metrics_path)
+    if not metrics_path.exists():
+        return {}
+    per_run = defaultdict(float)
+    fresh = set()
+    for e in load_events(metrics_path):
+        if e.get("kind") != "call" or e.get("outcome") != "ok" or (script and e.get("script") != script):
+            continue
+        try:
+            key = (int(e["unit"]), e.get("run"))
+        except (KeyError, TypeError, ValueError):
+            continue
+        per_run[key] += float(e.get("latency_sec") or 0.0)
+        if e.get("phase") in ("unit", "hedge"):
+            fresh.add(key)
+    samples = defaultdict(list)
+    for (unit, _run), total in per_run.items():
+        if (unit, _run) in fresh:
+            samples[unit].append(total)   # 按文件顺序追加，越靠后越新
+    return {unit: statistics.median(v[-HISTORY_RUNS:]) for unit, v in samples.items()}
+
+def heuristic_cost(theme: str, prompt_tokens: int) -> float:
+    cost = 1.0 + prompt_tokens / PROMPT_TOKENS_PER_COST
+    if SUMMARY_REVIEW_RE.search(theme):
+        cost *= SUMMARY_REVIEW_FACTOR
+    elif "复习" in theme:
+        cost *= REVIEW_FACTOR
+    return cost
+
+def estimate_unit_costs(tasks: List[Tuple[int, str]], build_messages: Callable[[str], List[dict]],
+                        history: Dict[int, float]) -> List[UnitCost]:
+    """tasks 为 [(单元号, 主题)]；build_messages(theme) 返回该单元实际发送的 messages（用于估 prompt 大小）。"""
+    heuristics = {gidx: heuristic_cost(theme, estimate_tokens_for_messages(build_messages(theme)))
+                  for gidx, theme in tasks}
+    ratios = [history[g] / heuristics[g] for g in heuristics if g in history and history[g] > 0]
+    scale = statistics.median(ratios) if ratios else 1.0
+    costs = []
+    for gidx, theme in tasks:
+        if gidx in history:
+            costs.append(UnitCost(gidx, theme, history[gidx], "history"))
+        else:
+            costs.append(UnitCost(gidx, theme, heuristics[gidx] * scale, "estimate"))
+    return costs
+
+def lpt_order(costs: List[UnitCost]) -> List[UnitCost]:
+    return sorted(costs, key=lambda c: (-c.cost, c.global_unit))
+
+def simulate_makespan(costs: List[float], workers: int) -> float:
+    """按顺序把任务交给最早空闲的 worker，返回全部完成的时刻。"""
+    if not costs:
+        return 0.0
+    free_at = [0.0] * max(1, min(int(workers), len(costs)))
+    for c in costs:
+        heapq.heappush(free_at, heapq.heappop(free_at) + c)
+    return max(free_at)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+model_cascade.py
+
+FinalScript 的模型级联（便宜模型先试，结构校验不过再升级）的计划与统计：
+- cascade_tiers：按单元所在阶段决定本单元要走的模型序列（不在级联阶段内的单元只用主模型）
+- escalation_scope：低档模型产出的单元有多少题不合格，决定升级方式——
+  少量坏题只把这些题号交给下一档模型逐题修复（"questions"），坏题过多或整体解析失败则整单元交给下一档重做（"unit"）
+- TierCall：单元在某一档的一次尝试（模型、耗时、token、是否通过校验）
+- summarize_cascade：各档通过率，以及在低档就通过的单元相对“直接用最高档”省下的耗时与费用估计
+  （最高档的单元平均耗时 / 费用取本次运行中最高档整单元请求的均值；本次没有最高档样本时不给出节省估计）
+
+费用按 MODEL_PRICES 中每百万 token 的单价（输入, 输出）计算，只用于对比，不代表账单。
+"""
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+
+class TierCall(NamedTuple):
+    model: str
+    scope: str           # "unit" = 整单元请求；"questions" = 只修复低档留下的坏题
+    latency_sec: float
+    prompt_tokens: int
+    completion_tokens: int
+    passed: bool         # 这一档结束后整单元是否通过结构校验
+
+
+def cascade_tiers(cascade: Sequence[str], primary_model: str, stage: int,
+                  stages: Optional[Sequence[int]] = None) -> List[str]:
+    """级联的最后一档总是主模型；stages 为 None 时所有阶段都走级联。"""
+    if not cascade or (stages is not None and stage not in stages):
+        return [primary_model]
+    tiers = [m for m in cascade if m != primary_model]
+    return tiers + [primary_model]
+
+def escalation_scope(broken_count: int, num_questions: int, max_question_fraction: float) -> str:
+    if 0 < broken_count <= num_questions * max_question_fraction:
+        return "questions"
+    return "unit"
+
+def call_cost(prices: Dict[str, Tuple[float, float]], model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    price_in, price_out = prices.get(model, (0.0, 0.0))
+    return (prompt_tokens * price_in + completion_tokens * price_out) / 1_000_000
+
+def tier_call_dict(call: TierCall, prices: Dict[str, Tuple[float, float]]) -> dict:
+    d = call._asdict()
+    d["latency_sec"] = round(call.latency_sec, 3)
+    d["cost"] = round(call_cost(prices, call.model, call.prompt_tokens, call.completion_tokens), 6)
+    return d
+
+
+def summarize_cascade(results: List[dict], prices: Dict[str, Tuple[float, float]], top_model: str) -> Optional[dict]:
+    """
+    results 中带 "cascade" 字段（[tier_call_dict, ...]）的单元参与统计；top_model 为最高档（主模型）。
+    第一档就是 top_model 的单元（不在级联阶段内）只用来提供“直接用最高档”的耗时 / 费用基线。
+    """
+    units = [r["cascade"] for r in results if r.get("cascade")]
+    cascaded = [calls for calls in units if calls[0]["model"] != top_model]
+    if not cascaded:
+        return None
+    tiers: Dict[str, dict] = {}
+    for calls in cascaded:
+        for call in calls:
+            t = tiers.setdefault(call["model"], {"attempted": 0, "passed": 0, "latency_sec": 0.0, "cost": 0.0})
+            t["attempted"] += 1
+            t["passed"] += int(call["passed"])
+            t["latency_sec"] += call["latency_sec"]
+            t["cost"] += call["cost"]
+
+    top_unit_calls = [c for calls in units for c in calls if c["model"] == top_model and c["scope"] == "unit"]
+    baseline = None
+    if top_unit_calls:
+        baseline = {"latency_sec": sum(c["latency_sec"] for c in top_unit_calls) / len(top_unit_calls),
+                    "cost": sum(c["cost"] for c in top_unit_calls) / len(top_unit_calls)}
+    # 净节省：低档通过的单元省下整单元最高档请求，升级的单元多花了低档那一次，两者相抵
+    saved_latency = saved_cost = None
+    if baseline is not None:
+        saved_latency = sum(baseline["latency_sec"] - sum(c["latency_sec"] for c in calls) for calls in cascaded)
+        saved_cost = sum(baseline["cost"] - sum(c["cost"] for c in calls) for calls in cascaded)
+
+    return {
+        "units": len(cascaded),
+        "top_model": top_model,
+        "passed_below_top": sum(1 for calls in cascaded if any(c["passed"] and c["model"] != top_model for c in calls)),
+        "escalated_questions": sum(1 for calls in cascaded if calls[-1]["scope"] == "questions"),
+        "escalated_units": sum(1 for calls in cascaded if calls[-1]["model"] == top_model and calls[-1]["scope"] == "unit"),
+        "tiers": {m: {"attempted": t["attempted"], "passed": t["passed"],
+                      "pass_rate": round(t["passed"] / t["attempted"], 3) if t["attempted"] else None,
+                      "latency_sec": round(t["latency_sec"], 1), "cost": round(t["cost"], 4)}
+                  for m, t in tiers.items()},
+        "baseline_per_unit": {k: round(v, 4) for k, v in baseline.items()} if baseline else None,
+        "saved_latency_sec": round(saved_latency, 1) if baseline else None,
+        "saved_cost": round(saved_cost, 4) if baseline else None,
+    }
+
+def format_cascade(summary: dict) -> str:
+    lines = [f"[CASCADE] {summary['units']} 个单元走级联：{summary['passed_below_top']} 个在低档模型就通过校验，"
+             f"{summary['escalated_questions']} 个只升级坏题，{summary['escalated_units']} 个整单元升级"]
+    for model, t in summary["tiers"].items():
+        lines.append(f"  {model:<20} 尝试 {t['attempted']:>4}  通过 {t['passed']:>4}  通过率 {t['pass_rate']}  "
+                     f"耗时 {t['latency_sec']}s  费用 {t['cost']}")
+    if summary["saved_latency_sec"] is None:
+        lines.append(f"  本次没有 {summary['top_model']} 的整单元请求样本，无法估计节省")
+    else:
+        lines.append(f"  相对全部直接用 {summary['top_model']}：约省请求耗时 {summary['saved_latency_sec']}s、"
+                     f"费用 {summary['saved_cost']}")
+    return "\n".join(lines)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+question_repair.py
+
+单元内逐题修复（供 FinalScript 使用），避免一道题坏掉就整单元 15 题重新生成：
+- arrange_by_id：按题号把题目放进 1..N 的槽位（题号缺失/重复时按位置兜底）
+- find_broken_questions：找出缺失或结构不合格（按 question_validator 的规则）的题号及原因
+- salvage_questions：整体 JSON 解析失败时，从原始文本中捞出已经完整的题目对象（含紧凑格式的题目数组）
+- salvage_with_fragments / build_json_fix_messages：本地修复之后仍解析不了的题目片段，只把这些片段交给便宜模型修 JSON 语法
+- salvage_truncated / build_continuation_messages：输出达到长度上限被截断时，保留已完整的题目与对应原文，
+  在同一对话里只要求续写剩余题号（system / 原 user 消息不变）
+- build_repair_messages：只针对坏题号构造精简请求（单元主题 + 合格兄弟题摘要作为上下文）
+- merge_repaired_questions / ordered_questions：把替换题按题号拼回，保证最终顺序与 calc_q_id 编号一致
+- merge_group_questions：按题型拆分的子请求（一组题号）结果写回槽位
+"""
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Common"))
+from incremental_json import IncrementalQuestionParser, StreamAbort
+from question_validator import expected_type
+from compact_questions import expand_question
+from json_repair import parse_json_tolerant
+
+REPAIR_USER_TEMPLATE = """我现在要生成的单元主题是：{theme}
+本单元已有以下合格题目（仅供参考、避免重复，不要重新输出它们）：
+{siblings}
+请只重新生成下列题号的题目，题型与全部规则同上，输出严格的 JSON 数组，每个对象的 id 必须等于对应题号：
+{targets}"""
+
+CONTINUATION_USER_TEMPLATE = """上面的输出达到长度上限被截断了，已完整的题目保留，不要重新输出它们。
+请继续生成下列题号的题目，题型与全部规则同上，输出一个新的 JSON 数组，每道题的 id 必须等于对应题号：
+{targets}"""
+
+JSON_FIX_SYSTEM_PROMPT = """你是 JSON 语法修复工具。用户给出的是从题目 JSON 中截出的、无法解析的片段，每个片段是一道或几道题目。
+只修复 JSON 语法问题（字符串内未转义的引号 / 反斜杠 / 换行、多余或缺少的逗号、括号不配对、中文引号等），
+不要改动、增删任何字段的内容，不要补写题目。
+把修复后的题目按原顺序放进一个 JSON 对象 {"questions": [...]} 输出，对象以外不要输出任何文字。"""
+
+
+def _as_int(v) -> Optional[int]:
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+def arrange_by_id(questions: List[dict], num_questions: int) -> Dict[int, dict]:
+    slots: Dict[int, dict] = {}
+    leftovers = []
+    for pos, q in enumerate(questions, 1):
+        if not isinstance(q, dict):
+            continue
+        qid = _as_int(q.get("id"))
+        if qid is None or not (1 <= qid <= num_questions) or qid in slots:
+            leftovers.append((pos, q))
+            continue
+        slots[qid] = q
+    for pos, q in leftovers:
+        if 1 <= pos <= num_questions and pos not in slots:
+            slots[pos] = q
+    return slots
+
+def find_broken_questions(slots: Dict[int, dict], num_questions: int, validator) -> Dict[int, str]:
+    """用 question_validator 编译好的单元校验器逐题检查，返回 {题号: 第一个问题描述}。"""
+    broken = {}
+    for qid in range(1, num_questions + 1):
+        q = slots.get(qid)
+        if q is None:
+            broken[qid] = "缺失"
+            continue
+        issues = validator.question(q, qid)
+        if issues:
+            broken[qid] = issues[0]["message"]
+    return broken
+
+def _salvage_parser(raw_text: str) -> Tuple[IncrementalQuestionParser, bool]:
+    """返回 (解析器, 是否中途放弃扫描)。"""
+    parser = IncrementalQuestionParser(check=lambda q: None if isinstance(q, dict) else "不是对象",
+                                       max_prelude_chars=len(raw_text), expand=expand_question, strict_first=False)
+    try:
+        parser.feed(raw_text)
+    except StreamAbort:
+        return parser, True
+    return parser, False
+
+def salvage_questions(raw_text: Optional[str]) -> List[dict]:
+    """逐字符扫描原始文本，返回所有能独立解析的完整题目对象（忽略后续截断/损坏部分）。"""
+    if not raw_text:
+        return []
+    return _salvage_parser(raw_text)[0].items
+
+def salvage_with_fragments(raw_text: Optional[str]) -> Tuple[List[dict], List[str]]:
+    """
+    本地修复：(能独立解析的完整题目, 解析不了的片段原文)。单题先经 json_repair 修复，片段包括修复后仍不合法的题目，
+    以及扫描中途放弃（如字符串里未转义的引号打乱了括号计数）时剩余文本中从第一个 { 到最后一个 } 的部分
+    （这部分先整体按题目数组修复一次，能解析出题目就不再作为片段）。
+    """
+    if not raw_text:
+        return [], []
+    parser, aborted = _salvage_parser(raw_text)
+    items, fragments = parser.items, list(parser.rejected)
+    if aborted:
+        tail = raw_text[parser.complete_end:]
+        start, end = tail.find("{"), tail.rfind("}")
+        if start != -1 and end > start:
+            try:
+                recovered = [expand_question(q) for q in parse_json_tolerant("[" + tail[start:end + 1] + "]")[0]]
+            except ValueError:
+                recovered = []
+            if recovered and all(isinstance(q, dict) for q in recovered):
+                items = items + recovered
+            else:
+                fragments.append(tail[start:end + 1])
+    return items, fragments
+
+def salvage_truncated(raw_text: Optional[str]) -> Tuple[List[dict], str]:
+    """被截断的输出 -> (已完整的题目, 截到最后一道完整题目为止的原文)。"""
+    if not raw_text:
+        return [], ""
+    parser, _ = _salvage_parser(raw_text)
+    return parser.items, raw_text[:parser.complete_end]
+
+def _sibling_line(qid: int, q: dict) -> str:
+    title = q.get("title") or ""
+    content = (q.get("content") or q.get("text") or "")[:40]
+    return f"- 第{qid}题 [{q.get('type')}] {title}：{content}"
+
+def build_repair_messages(system_prompt: str, theme: str, slots: Dict[int, dict],
+                          broken: Dict[int, str]) -> List[dict]:
+    siblings = "\n".join(_sibling_line(qid, q) for qid, q in sorted(slots.items()) if qid not in broken) or "（无）"
+    targets = "\n".join(f"- 第{qid}题（{expected_type(qid)}）：{reason}" for qid, reason in sorted(broken.items()))
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": REPAIR_USER_TEMPLATE.format(theme=theme, siblings=siblings, targets=targets)},
+    ]
+
+def build_continuation_messages(conversation: List[dict], missing_ids: List[int]) -> List[dict]:
+    """conversation 为原请求消息 + 截断输出中已完整部分（assistant）；追加只要剩余题号的 user 消息。"""
+    targets = "\n".join(f"- 第{qid}题（{expected_type(qid)}）" for qid in sorted(missing_ids))
+    return list(conversation) + [{"role": "user", "content": CONTINUATION_USER_TEMPLATE.format(targets=targets)}]
+
+def build_json_fix_messages(fragments: List[str]) -> List[dict]:
+    body = "\n\n".join(f"片段 {i}：\n{frag}" for i, frag in enumerate(fragments, 1))
+    return [
+        {"role": "system", "content": JSON_FIX_SYSTEM_PROMPT},
+        {"role": "user", "content": body},
+    ]
+
+def merge_fixed_questions(questions: List[dict], fixed: List[dict]) -> List[dict]:
+    """修好的题目追加到已捞回的题目后面；题号已存在的以先捞回的为准。返回实际追加的题目。"""
+    have = {_as_int(q.get("id")) for q in questions if isinstance(q, dict)}
+    added = []
+    for q in fixed:
+        if isinstance(q, dict) and _as_int(q.get("id")) not in have:
+            have.add(_as_int(q.get("id")))
+            questions.append(q)
+            added.append(q)
+    return added
+
+def merge_repaired_questions(slots: Dict[int, dict], replacements: List[dict], broken_ids) -> List[int]:
+    """按题号把替换题写回槽位；替换题缺 id 时按坏题号顺序依次对应。返回实际替换的题号。"""
+    pending = sorted(broken_ids)
+    replaced = []
+    unnumbered = []
+    for q in replacements:
+        if not isinstance(q, dict):
+            continue
+        qid = _as_int(q.get("id"))
+        if qid in pending and qid not in replaced:
+            slots[qid] = q
+            replaced.append(qid)
+        elif qid is None:
+            unnumbered.append(q)
+    for q in unnumbered:
+        remaining = [i for i in pending if i not in replaced]
+        if not remaining:
+            break
+        slots[remaining[0]] = q
+        replaced.append(remaining[0])
+    return sorted(replaced)
+
+def merge_group_questions(slots: Dict[int, dict], ids: List[int], questions: Optional[List[dict]]) -> List[int]:
+    """
+    子请求只负责 ids 这几个题号：id 在组内的按 id 放，其余（模型自行从 1 编号等）按组内剩余题号的顺序依次放。
+    返回放入的题号。
+    """
+    remaining = list(ids)
+    spill = []
+    for q in questions or []:
+        if not isinstance(q, dict):
+            continue
+        qid = _as_int(q.get("id"))
+        if qid in remaining:
+            slots[qid] = q
+            remaining.remove(qid)
+        else:
+            spill.append(q)
+    for qid, q in zip(list(remaining), spill):
+        slots[qid] = q
+        remaining.remove(qid)
+    return sorted(set(ids) - set(remaining))
+
+def ordered_questions(slots: Dict[int, dict], num_questions: int) -> List[dict]:
+    """按题号输出题目列表，并把 id 统一改写为题号（缺失的题号直接跳过）。"""
+    out = []
+    for qid in range(1, num_questions + 1):
+        q = slots.get(qid)
+        if q is not None:
+            q["id"] = qid
+            out.append(q)
+    return out
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+review_digest.py
+
+“复习”单元的复习素材摘要（FinalScript v7 的 USE_REVIEW_DIGESTS 使用），全部本地生成、不调用模型：
+- review_sources：从主题文字判断复习单元要复习之前哪些单元
+  - “小复习（1–9 单元）”“阶段总复习（1–29 单元）”：按括号里的单元范围
+  - “**复习××**”：与之前单元的主题名比较——完全相同 > 前缀相同（如“字符串方法”对应 16–18 单元）>
+    开头关键词相同（如“input 类型转换”对应 input 开头的单元），最多取最近的 MAX_MATCHED_UNITS 个；都对不上时取上一单元
+- load_unit_digest：从 json_parsed/stageN/unit_N_parsed.json 提取单元主题与每道题的标题 + 解析首句，
+  缓存为同目录的 unit_N_digest.json（记录来源文件哈希，来源改变后自动重建）
+- format_review_context：把若干单元的摘要按字数预算拼成一段文字，放进复习单元的 user 消息（system 前缀不变）
+
+复习单元只依赖 review_sources 给出的单元：这些单元一写出 json_parsed 就能生成摘要、复习单元即可开始，
+不用等整个阶段；被复习单元不在本次运行中且没有 json_parsed 时，该单元不带复习素材照常生成。
+
+命令行：python review_digest.py <themes.txt> <BASE_OUT_DIR> [--build]，打印每个复习单元的依赖，--build 预先生成全部摘要。
+"""
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional
+
+THEME_NUMBER_RE = re.compile(r"^\s*\d+\s*[.、．]\s*")
+REVIEW_MARK_RE = re.compile(r"[，,]?\s*\*\*.*?\*\*")
+RANGE_RE = re.compile(r"[（(]\s*(\d+)\s*[–\-~～—]\s*(\d+)\s*单元\s*[）)]")
+REVIEW_TARGET_RE = re.compile(r"\*\*\s*复习(.+?)\s*\*\*")
+HEAD_SPLIT_RE = re.compile(r"[\s（(：:，,/]")
+SENTENCE_END_RE = re.compile(r"[。；;！!？?]")
+
+MAX_MATCHED_UNITS = 3
+DIGEST_ITEM_CHARS = 40
+
+
+def base_title(theme: str) -> str:
+    """“4. 数字类型：整数，**复习变量与命名规则**” -> “数字类型：整数”；整行加粗的（小复习等）只去掉 ** 与序号。"""
+    title = THEME_NUMBER_RE.sub("", REVIEW_MARK_RE.sub("", theme or "")).strip()
+    return title or THEME_NUMBER_RE.sub("", (theme or "").replace("**", "")).strip()
+
+def _head(title: str) -> str:
+    return HEAD_SPLIT_RE.split(title.strip(), 1)[0]
+
+def is_review_theme(theme: str) -> bool:
+    return bool(RANGE_RE.search(theme or "") or REVIEW_TARGET_RE.search(theme or ""))
+
+def review_sources(global_unit_index: int, themes: List[str]) -> List[int]:
+    """复习单元要复习的之前单元（升序）；不是复习单元时返回 []。themes[i] 为第 i+1 单元的主题。"""
+    theme = themes[global_unit_index - 1] if 0 < global_unit_index <= len(themes) else ""
+    m = RANGE_RE.search(theme)
+    if m:
+        lo, hi = sorted(map(int, m.groups()))
+        return [u for u in range(lo, hi + 1) if u < global_unit_index]
+    m = REVIEW_TARGET_RE.search(theme)
+    if not m:
+        return []
+    target = m.group(1).strip()
+    earlier = [(u, base_title(themes[u - 1])) for u in range(1, min(global_unit_index, len(themes) + 1))]
+    rules = (
+        lambda b: b == target,
+        lambda b: b.startswith(target) or target.startswith(b),
+        lambda b: _head(b) == _head(target) or (len(_head(b)) >= 2 and target.startswith(_head(b))),
+    )
+    for rule in rules:
+        found = [u for u, b in earlier if b and rule(b)]
+        if found:
+            return found[-MAX_MATCHED_UNITS:]
+    return [global_unit_index - 1] if global_unit_index > 1 else []
+
+
+# ----------------------------
+# ========== 摘要 ==========
+# ----------------------------
+def _concept(explanation: str) -> str:
+    text = " ".join(str(explanation or "").split())
+    m = SENTENCE_END_RE.search(text)
+    if m:
+        text = text[:m.start()]
+    return text[:DIGEST_ITEM_CHARS]
+
+def build_unit_digest(global_unit_index: int, theme: str, questions: list, source_sha: str) -> dict:
+    items = []
+    for q in questions:
+        if not isinstance(q, dict):
+            continue
+        items.append({"id": q.get("id"), "type": q.get("type"), "title": str(q.get("title") or "").strip(),
+                      "concept": _concept(q.get("explanation"))})
+    return {"global_unit": global_unit_index, "theme": base_title(theme), "source_sha": source_sha, "items": items}
+
+def load_unit_digest(global_unit_index: int, theme: str, parsed_path: Path, digest_path: Path) -> Optional[dict]:
+    """读缓存的摘要；缓存不存在或来源已改变时从 json_parsed 重建。单元还没有 json_parsed 时返回 None。"""
+    parsed_path, digest_path = Path(parsed_path), Path(digest_path)
+    if not parsed_path.exists():
+        return None
+    data = parsed_path.read_bytes()
+    sha = hashlib.sha256(data).hexdigest()[:16]
+    if digest_path.exists():
+        try:
+            cached = json.loads(digest_path.read_text(encoding="utf-8"))
+            if cached.get("source_sha") == sha:
+                return cached
+        except (OSError, ValueError):
+            pass
+    try:
+        questions = json.loads(data.decode("utf-8"))
+    except ValueError:
+        return None
+    if isinstance(questions, dict):
+        questions = questions.get("questions") or []
+    digest = build_unit_digest(global_unit_index, theme, questions if isinstance(questions, list) else [], sha)
+    tmp = digest_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(digest, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, digest_path)
+    return digest
+
+def format_review_context(digests: List[dict], max_chars: int) -> str:
+    """每个被复习单元平分字数预算：单元主题一行，之后按题号列“标题：解析首句”，超出预算的题目省略。"""
+    budget = max(80, max_chars // max(1, len(digests)))
+    blocks = []
+    for d in digests:
+        header = f"第{d['global_unit']}单元「{d['theme']}」："
+        lines, used = [header], len(header)
+        for it in d.get("items") or []:
+            line = f"- {it['title']}：{it['concept']}" if it.get("concept") else f"- {it['title']}"
+            if used + len(line) > budget:
+                break
+            lines.append(line)
+            used += len(line)
+        blocks.append("\n".join(lines))
+    return "\n".join(blocks)
+
+
+# ----------------------------
+# ========== 命令行 ==========
+# ----------------------------
+def _stage_of(global_unit_index: int, units_per_stage: int) -> int:
+    return (global_unit_index - 1) // units_per_stage + 1
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="查看复习单元的依赖，或预先生成所有单元的复习摘要")
+    ap.add_argument("themes", help="单元主题文件（一行一个单元）")
+    ap.add_argument("out_base", help="FinalScript 的 BASE_OUT_DIR（包含 json_parsed/）")
+    ap.add_argument("--units-per-stage", type=int, default=30)
+    ap.add_argument("--build", action="store_true", help="为所有已有 json_parsed 的单元生成 / 更新摘要")
+    args = ap.parse_args(argv)
+
+    with open(args.themes, "r", encoding="utf-8") as f:
+        themes = [ln.strip() for ln in f if ln.strip()]
+    deps: Dict[int, List[int]] = {g: review_sources(g, themes) for g in range(1, len(themes) + 1)}
+    for g, sources in deps.items():
+        if sources:
+            print(f"第{g}单元 {base_title(themes[g - 1])} <- {sources}")
+    print(f"{sum(1 for s in deps.values() if s)} 个复习单元")
+    if args.build:
+        built = 0
+        for g in range(1, len(themes) + 1):
+            parsed_dir = Path(args.out_base) / "json_parsed" / f"stage{_stage_of(g, args.units_per_stage)}"
+            if load_unit_digest(g, themes[g - 1], parsed_dir / f"unit_{g}_parsed.json",
+                                parsed_dir / f"unit_{g}_digest.json") is not None:
+                built += 1
+        print(f"生成 / 校验了 {built} 个单元的摘要")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
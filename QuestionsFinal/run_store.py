@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+run_store.py
+
+FinalScript 的运行清单 / 断点存储（SQLite）：
+- runs 表：每次运行一行（模式、输出目录、模型、单元范围、开始/结束时间、汇总计数、总 token）
+- unit_runs 表：每次运行中每个单元一行（状态、尝试次数、最后错误、耗时、token 用量、prompt 哈希、产物路径）
+- 运行开始时先把要处理的单元全部登记为 pending，每个 future 完成后立即在事务里更新该单元，
+  进程中途崩溃也只会丢失正在进行中的单元
+- --resume：按同一输出目录下每个单元“最近一次”的状态，只调度 pending / error / quarantined / cancelled 的单元
+- history()：跨运行查询吞吐（单元/分钟、token/分钟），命令行 python run_store.py 可直接打印
+
+默认数据库位于 Common/.runtime/run_store.sqlite3（与限流器、响应缓存放在一起），可用 YPROGRAM_RUN_STORE 改到别处。
+"""
+import os
+import sys
+import time
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+DEFAULT_DB_PATH = Path(os.environ.get("YPROGRAM_RUN_STORE", "")
+                       or Path(__file__).resolve().parents[1] / "Common" / ".runtime" / "run_store.sqlite3")
+
+# 这些状态视为已完成，--resume 时不再调度
+DONE_STATUSES = ("ok", "skipped")
+
+
+class RunStore:
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path or DEFAULT_DB_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " run_id INTEGER PRIMARY KEY AUTOINCREMENT, mode TEXT NOT NULL, out_dir TEXT NOT NULL, model TEXT,"
+            " unit_start INTEGER, unit_end INTEGER, units_total INTEGER NOT NULL DEFAULT 0,"
+            " started REAL NOT NULL, finished REAL, ok INTEGER, quarantined INTEGER, error INTEGER, total_tokens INTEGER)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS unit_runs ("
+            " run_id INTEGER NOT NULL, global_unit INTEGER NOT NULL, status TEXT NOT NULL, attempts INTEGER,"
+            " last_error TEXT, latency_sec REAL, prompt_tokens INTEGER, completion_tokens INTEGER, total_tokens INTEGER,"
+            " cached_calls INTEGER, prompt_hash TEXT, artifacts TEXT, updated REAL NOT NULL,"
+            " PRIMARY KEY (run_id, global_unit))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_unit_runs_unit ON unit_runs(global_unit, run_id)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, sql_list: List[tuple]):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in sql_list:
+                conn.execute(sql, params)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---------- 写入 ----------
+    def start_run(self, mode: str, out_dir: Path, model: str, units: List[int]) -> int:
+        """登记一次运行，并把所有待处理单元写成 pending；返回 run_id。"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute(
+                "INSERT INTO runs (mode, out_dir, model, unit_start, unit_end, units_total, started) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (mode, str(out_dir), model, min(units) if units else None, max(units) if units else None, len(units), now),
+            )
+            run_id = cur.lastrowid
+            conn.executemany(
+                "INSERT INTO unit_runs (run_id, global_unit, status, updated) VALUES (?, ?, 'pending', ?)",
+                [(run_id, g, now) for g in units],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return run_id
+
+    def record_unit(self, run_id: int, result: dict):
+        """单元完成（成功 / 失败 / 隔离 / 跳过）后立即落库。"""
+        usage = result.get("usage") or {}
+        artifacts = {k: result[k] for k in ("sql", "parsed_json", "raw_json", "json_raw", "quarantine") if result.get(k)}
+        self._write([(
+            "INSERT OR REPLACE INTO unit_runs (run_id, global_unit, status, attempts, last_error, latency_sec,"
+            " prompt_tokens, completion_tokens, total_tokens, cached_calls, prompt_hash, artifacts, updated)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_id, result.get("global_unit"), result.get("status", "error"), result.get("attempts"),
+             result.get("error"), result.get("latency_sec"), usage.get("prompt_tokens"), usage.get("completion_tokens"),
+             usage.get("total_tokens"), usage.get("cached_calls"), result.get("prompt_hash"),
+             json.dumps(artifacts, ensure_ascii=False), time.time()),
+        )])
+
+    def finish_run(self, run_id: int):
+        conn = self._conn()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM unit_runs WHERE run_id = ? GROUP BY status",
+                                   (run_id,)).fetchall())
+        tokens = conn.execute("SELECT COALESCE(SUM(total_tokens), 0) FROM unit_runs WHERE run_id = ?",
+                              (run_id,)).fetchone()[0]
+        # 被取消 / 从未开始（pending）的单元不算失败，--resume 时照样会被重新调度
+        error = sum(v for k, v in counts.items() if k not in ("ok", "skipped", "quarantined", "cancelled", "pending"))
+        self._write([(
+            "UPDATE runs SET finished = ?, ok = ?, quarantined = ?, error = ?, total_tokens = ? WHERE run_id = ?",
+            (time.time(), counts.get("ok", 0), counts.get("quarantined", 0), error, tokens, run_id),
+        )])
+
+    # ---------- 查询 ----------
+    def latest_statuses(self, out_dir: Path) -> dict:
+        """同一输出目录下每个单元最近一次运行的状态 {global_unit: status}。"""
+        rows = self._conn().execute(
+            "SELECT u.global_unit, u.status FROM unit_runs u JOIN runs r ON r.run_id = u.run_id"
+            " WHERE r.out_dir = ? AND u.run_id = (SELECT MAX(u2.run_id) FROM unit_runs u2 JOIN runs r2 ON r2.run_id = u2.run_id"
+            "  WHERE u2.global_unit = u.global_unit AND r2.out_dir = r.out_dir)",
+            (str(out_dir),),
+        ).fetchall()
+        return dict(rows)
+
+    def units_to_resume(self, out_dir: Path, candidates: Iterable[int]) -> List[int]:
+        """在候选单元中挑出尚未完成的（从未登记、pending、error、quarantined）。"""
+        latest = self.latest_statuses(out_dir)
+        return [g for g in candidates if latest.get(g) not in DONE_STATUSES]
+
+    def history(self, limit: int = 20) -> List[dict]:
+        rows = self._conn().execute(
+            "SELECT run_id, mode, out_dir, model, units_total, started, finished, ok, quarantined, error, total_tokens"
+            " FROM runs ORDER BY run_id DESC LIMIT ?", (limit,)).fetchall()
+        out = []
+        for run_id, mode, out_dir, model, total, started, finished, ok, quarantined, error, tokens in rows:
+            minutes = ((finished or time.time()) - started) / 60.0
+            out.append({
+                "run_id": run_id, "mode": mode, "out_dir": out_dir, "model": model, "units": total,
+                "ok": ok, "quarantined": quarantined, "error": error, "finished": finished is not None,
+                "elapsed_min": round(minutes, 2),
+                "units_per_min": round((ok or 0) / minutes, 2) if minutes > 0 else None,
+                "tokens_per_min": round((tokens or 0) / minutes) if minutes > 0 else None,
+            })
+        return out
+
+
+if __name__ == "__main__":
+    store = RunStore(sys.argv[1] if len(sys.argv) > 1 else None)
+    for h in store.history():
+        state = "" if h["finished"] else "（未结束/已中断）"
+        print(f"#{h['run_id']} {h['mode']} {h['out_dir']} units={h['units']} ok={h['ok']} quarantined={h['quarantined']} "
+              f"error={h['error']} {h['elapsed_min']}min {h['units_per_min']} 单元/min {h['tokens_per_min']} token/min{state}")
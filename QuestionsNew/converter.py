@@ -1,19 +1,50 @@
 import json
 import time
 import os
-import re
-from openai import OpenAI
-from concurrent.futures import ThreadPoolExecutor  # 引入线程池
+import sys
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED  # 引入线程池
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Common"))
+from rate_limiter import SharedRateLimiter, estimate_tokens_for_messages
+from llm_cache import ResponseCache, cached_completion
+from llm_metrics import MetricsRecorder
+from prompt_prefix import PromptPrefix
+from cancellation import CancelToken, install_sigint_handler, http_timeout
+from http_client import openai_client
+from json_repair import parse_json_tolerant, format_fixes
 
 # ================= 配置区域 =================
 # 替换为你的 DeepSeek API Key
-API_KEY = ""
+API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
+# 环境变量 DEEPSEEK_BASE_URL 可改到其他兼容服务（例如 Common/mock_llm_server.py）
+BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
 
-# 初始化 DeepSeek 客户端
-client = OpenAI(
-    api_key=API_KEY,
-    base_url="https://api.deepseek.com"
-)
+# 超时（秒）：建立连接 / 两次收到数据之间的最长间隔（非流式请求即整次响应的等待上限）
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 300
+
+# 并发线程数（连接池大小与之相同）
+MAX_WORKERS = 5  # 建议 3-5，防止 API 速率限制
+
+# 初始化 DeepSeek 客户端：所有线程共用一个 keep-alive 连接池（max_retries=0：429 与 5xx / 连接中断都由 RATE_LIMITER.call 重试）
+client = openai_client(API_KEY, BASE_URL, max_connections=MAX_WORKERS,
+                       timeout=http_timeout(CONNECT_TIMEOUT, READ_TIMEOUT))
+
+# Ctrl-C 后不再开始新单元；已提交但未开始的任务直接取消，在途请求最多再等 READ_TIMEOUT
+CANCEL = CancelToken()
+
+# 共享限流器：与其他生成脚本（FinalScript / library_generate 等）共用同一份 RPM/TPM 额度
+RATE_LIMITER = SharedRateLimiter(scope="deepseek", rpm=120, tpm=400000)
+EXPECTED_COMPLETION_TOKENS = 6000
+
+# 响应缓存：同一份原始文本 + prompt 再次转换时直接复用上次的返回
+RESPONSE_CACHE = ResponseCache()
+MODEL_NAME = "deepseek-chat"
+SAMPLING_PARAMS = {"response_format": {'type': 'json_object'}, "temperature": 0.1}
+
+# 调用埋点：token / 耗时 / 尝试次数写入 Common/.runtime/metrics/converter.jsonl，结束时打印汇总
+METRICS = MetricsRecorder("converter")
 
 # ================= 核心系统指令 (Prompt) =================
 SYSTEM_INSTRUCTION = """
@@ -77,6 +108,8 @@ SYSTEM_INSTRUCTION = """
 1. **只输出 JSON**，不要包含 markdown 标记（如 ```json）。
 2. **转义修正**：确保所有 JSON 字符串内的引号都已正确转义。
 """
+# 规范化后的固定前缀：所有单元的 system 逐字节一致，原始题目文本只出现在最后的 user 消息里
+PROMPT = PromptPrefix("converter", SYSTEM_INSTRUCTION, "请处理以下数据：\n\n{raw_content}")
 
 # ================= SQL 生成器 =================
 class SQLGenerator:
@@ -166,13 +199,10 @@ VALUES (
     {self.escape_sql_single_quote(q.get('example'))}
 );""".strip()
 
-def clean_json_text(text):
-    text = re.sub(r'^```json\s*', '', text, flags=re.MULTILINE)
-    text = re.sub(r'^```\s*', '', text, flags=re.MULTILINE)
-    return text.strip()
-
 # ================= 单文件处理函数 =================
 def generate_sql_from_file(input_path, output_path, current_unit_id, start_qid):
+    if CANCEL.cancelled:
+        return
     if os.path.exists(output_path):
         print(f"⏭️ Unit {current_unit_id} 已存在，跳过。")
         return
@@ -185,20 +215,30 @@ def generate_sql_from_file(input_path, output_path, current_unit_id, start_qid):
         raw_content = f.read()
 
     print(f"🚀 [Unit {current_unit_id}] 正在请求 API...")
+    messages = PROMPT.messages(raw_content=raw_content)
     try:
-        response = client.chat.completions.create(
-            model="deepseek-chat", 
-            messages=[
-                {"role": "system", "content": SYSTEM_INSTRUCTION},
-                {"role": "user", "content": f"请处理以下数据：\n\n{raw_content}"}
-            ],
-            response_format={'type': 'json_object'},
-            temperature=0.1
-        )
-        data_structure = json.loads(clean_json_text(response.choices[0].message.content))
+        with METRICS.track(unit=current_unit_id, model=MODEL_NAME) as call:
+            record = cached_completion(
+                RESPONSE_CACHE, MODEL_NAME, messages, SAMPLING_PARAMS,
+                lambda: RATE_LIMITER.call(
+                    call.attempt(lambda: client.chat.completions.create(
+                        model=MODEL_NAME,
+                        messages=messages,
+                        **SAMPLING_PARAMS
+                    )),
+                    estimate_tokens_for_messages(messages, EXPECTED_COMPLETION_TOKENS)
+                )
+            )
+            call.finish(record)
+        if record["cached"]:
+            print(f"💾 [Unit {current_unit_id}] 命中响应缓存")
+        data_structure, fixes = parse_json_tolerant(record["raw_text"])
+        if fixes:
+            print(f"🩹 [Unit {current_unit_id}] JSON 已在本地修复：{format_fixes(fixes)}")
         
     except Exception as e:
         print(f"❌ Unit {current_unit_id} 失败: {e}")
+        METRICS.unit(current_unit_id, "error", error=repr(e))
         with open(f"F:\\project\\YProgram\\QuestionsNew\\python1_insertJSON\\unit{current_unit_id}.json", "w", encoding="utf-8") as f:
             json.dump(data_structure, f, ensure_ascii=False, indent=4)
         return
@@ -267,6 +307,7 @@ def generate_sql_from_file(input_path, output_path, current_unit_id, start_qid):
     with open(output_path, "w", encoding="utf-8") as f:
         f.write("\n".join(sql_lines))
     
+    METRICS.unit(current_unit_id, "ok", questions=len(choice_qs) + len(fill_qs))
     print(f"🎉 Unit {current_unit_id} 完成！文件保存至: {output_path}")
 
 # ================= 主流程 =================
@@ -275,13 +316,15 @@ def main():
     QUESTIONS_PER_UNIT = 15  # 每个单元固定的题目数量
     START_OFFSET = 1         # 第一个单元从 ID 几开始？
     
-    # [修改功能 2]：配置并发线程数
-    MAX_WORKERS = 5 # 建议 3-5，防止 API 速率限制
+    # [修改功能 2]：并发线程数见配置区 MAX_WORKERS
     
+    install_sigint_handler(CANCEL)
+    PROMPT.check_drift()
     print(f"🚀 开始并行处理任务，并发数: {MAX_WORKERS}...")
     start_time = time.time()
 
     # 使用线程池进行并发处理
+    futures = set()
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
         for i in range(1, 151):
             j = (i - 1) // 30 + 1
@@ -293,10 +336,21 @@ def main():
             current_start_qid = (i - 1) * QUESTIONS_PER_UNIT + START_OFFSET
 
             # 3. 提交任务给线程池 (不再需要手动 sleep，也不需要等待上一个结束)
-            executor.submit(generate_sql_from_file, input_path, output_path, i, current_start_qid)
+            futures.add(executor.submit(generate_sql_from_file, input_path, output_path, i, current_start_qid))
+
+        # 带超时地等待，Ctrl-C 后及时取消尚未开始的单元
+        cancelled = 0
+        while futures:
+            _, futures = wait(futures, timeout=0.5, return_when=FIRST_COMPLETED)
+            if CANCEL.cancelled:
+                cancelled += sum(1 for fut in futures if fut.cancel())
 
     end_time = time.time()
-    print(f"\n✅ 所有任务处理完成！总耗时: {end_time - start_time:.2f} 秒")
+    if CANCEL.cancelled:
+        print(f"\n⛔ 已中断：{cancelled} 个单元未开始，已完成的单元均已写出。耗时: {end_time - start_time:.2f} 秒")
+    else:
+        print(f"\n✅ 所有任务处理完成！总耗时: {end_time - start_time:.2f} 秒")
+    METRICS.print_report()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -6,12 +6,13 @@ from openai import OpenAI
 
 # ================= 配置区域 =================
 # 替换为你的 DeepSeek API Key
-API_KEY = ""
+API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
+BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
 
 # 初始化 DeepSeek 客户端
 client = OpenAI(
     api_key=API_KEY,
-    base_url="https://api.deepseek.com"
+    base_url=BASE_URL
 )
 
 # ================= 核心系统指令 (Prompt) =================
@@ -10,14 +10,21 @@
 - 把 fill 题的 `input` / `output` 字段写为 JSON_ARRAY（如果原为字符串则包装为单元素数组）
 - code_segments 使用 json.dumps 序列化并正确转义，避免被错误清洗
 - 支持按 unit id 范围过滤（只处理需要的 unit）
+- 生成前用 Common/question_validator.py 校验（分组格式：9 选择 + 6 填空、options A–D、填空答案必须在 options 中、
+  slot 编号、code_block 中不能出现 slot/code），不合格的单元写入 QUARANTINE_ROOT 而不生成 SQL
 """
 
 import json
 import os
 import re
+import sys
 import time
+from pathlib import Path
 from typing import Any, Dict, List, Optional
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Common"))
+from question_validator import compile_unit_validator, format_issues
+
 # ================= 配置区（请在这里修改） =================
 # JSON 根目录（包含 stage 子目录）
 JSON_ROOT = r"F:\project\YProgram\QuestionsNew\python1_insertJSON"
@@ -31,6 +38,10 @@ STAGES_TO_PROCESS = ["stage1", "stage2", "stage3", "stage4", "stage5"]
 # 是否覆盖已存在的 SQL 文件（False 会跳过已存在文件）
 OVERWRITE_EXISTING_SQL = False
 
+# 生成前做结构校验；不合格的单元把问题清单写到这里（保持 stage 子目录），不生成 SQL
+VALIDATE_BEFORE_SQL = True
+QUARANTINE_ROOT = r"F:\project\YProgram\QuestionsNew\python1_insert_quarantine"
+
 # 题目数量/单元计算（用于计算 start_qid）
 QUESTIONS_PER_UNIT = 15
 START_OFFSET = 1  # q_id 起始偏移
@@ -45,6 +56,16 @@ DEFAULT_ORDER = 'interleave_3_2'  # 使用你之前指定的排列方式（可
 
 # ================= 内部实现（下面一般不需要改） =================
 
+UNIT_VALIDATOR = compile_unit_validator("grouped", num_questions=QUESTIONS_PER_UNIT)
+
+
+class UnitValidationError(Exception):
+    def __init__(self, issues: List[Dict[str, str]], quarantine_path: str):
+        super().__init__(f"校验未通过（{len(issues)} 个问题），已隔离 -> {quarantine_path}\n{format_issues(issues, limit=5)}")
+        self.issues = issues
+        self.quarantine_path = quarantine_path
+
+
 def extract_unit_id_from_filename(fname: str) -> Optional[int]:
     """
     从文件名提取 unit id（找到连续的数字序列并返回最大的那个）
@@ -247,6 +268,16 @@ def process_one_json_file(json_path: str, out_sql_path: str, order: str = DEFAUL
         # 若无法识别，抛错误并停止处理该文件（可以改为默认值）
         raise RuntimeError(f"无法从文件名或 JSON 内容识别 unit id：{json_path}")
 
+    if VALIDATE_BEFORE_SQL:
+        issues = UNIT_VALIDATOR(data)
+        if issues:
+            stage = os.path.basename(os.path.dirname(json_path))
+            quarantine_path = os.path.join(QUARANTINE_ROOT, stage, os.path.splitext(os.path.basename(json_path))[0] + ".issues.json")
+            os.makedirs(os.path.dirname(quarantine_path), exist_ok=True)
+            with open(quarantine_path, 'w', encoding='utf-8') as fq:
+                json.dump({"source": json_path, "unit_id": unit_id, "issues": issues}, fq, ensure_ascii=False, indent=2)
+            raise UnitValidationError(issues, quarantine_path)
+
     start_qid = (unit_id - 1) * QUESTIONS_PER_UNIT + START_OFFSET
 
     sql_text = json_to_sql(data, unit_id=unit_id, start_qid=start_qid, order=order)
@@ -261,6 +292,7 @@ def batch_process():
     total = 0
     skipped = 0
     processed = 0
+    quarantined = 0
     for stage in STAGES_TO_PROCESS:
         stage_json_dir = os.path.join(JSON_ROOT, stage)
         if not os.path.isdir(stage_json_dir):
@@ -304,6 +336,9 @@ def batch_process():
                 process_one_json_file(in_path, out_path, order=DEFAULT_ORDER)
                 print(f"✅ 生成: {out_path}")
                 processed += 1
+            except UnitValidationError as e:
+                print(f"🚫 {in_path} {e}")
+                quarantined += 1
             except Exception as e:
                 print(f"❌ 处理失败: {in_path} -> {e}")
 
@@ -311,6 +346,7 @@ def batch_process():
     print(f"总扫描文件数: {total}")
     print(f"已成功生成: {processed}")
     print(f"跳过/未处理: {skipped}")
+    print(f"校验未通过（已隔离）: {quarantined}")
 
 
 if __name__ == "__main__":
@@ -1,17 +1,36 @@
 import time
 import os
 import re
-from openai import OpenAI
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Common"))
+from rate_limiter import SharedRateLimiter, estimate_tokens_for_messages
+from llm_cache import ResponseCache, cached_completion
+from llm_metrics import MetricsRecorder
+from prompt_prefix import PromptPrefix
+from http_client import openai_client
 
 # ================= 配置区域 =================
 # 替换为你的 DeepSeek API Key
-API_KEY = ""
+API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
+# 环境变量 DEEPSEEK_BASE_URL 可改到其他兼容服务（例如 Common/mock_llm_server.py）
+BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+
+# 初始化 DeepSeek 客户端（逐个文件串行请求，一条 keep-alive 连接即可）
+client = openai_client(API_KEY, BASE_URL, max_connections=1)
+
+# 共享限流器：与其他生成脚本共用同一份 RPM/TPM 额度，429 时统一冷却
+RATE_LIMITER = SharedRateLimiter(scope="deepseek", rpm=120, tpm=400000)
+EXPECTED_COMPLETION_TOKENS = 8000
 
-# 初始化 DeepSeek 客户端
-client = OpenAI(
-    api_key=API_KEY,
-    base_url="https://api.deepseek.com"
-)
+# 响应缓存：同一份原始文本 + prompt 再次转换时直接复用上次的返回
+RESPONSE_CACHE = ResponseCache()
+MODEL_NAME = "deepseek-chat"
+SAMPLING_PARAMS = {"stream": False, "temperature": 0.1}
+
+# 调用埋点：写入 Common/.runtime/metrics/transformer.jsonl，结束时打印汇总
+METRICS = MetricsRecorder("transformer")
 
 # ================= 核心系统指令 (直接生成 SQL) =================
 SYSTEM_INSTRUCTION = """
@@ -129,6 +148,8 @@ VALUES
 - 开头包含 `USE questions;`。
 - 不要包含 markdown 代码块标记 (如 ```sql)。
 """
+# 规范化后的固定前缀（system 逐字节一致，题目文本放在最后的 user 消息里）
+PROMPT = PromptPrefix("transformer", SYSTEM_INSTRUCTION, "请将以下题目转换为 SQL 插入语句，unit_id 统一设为 1：\n\n{raw_content}")
 
 def clean_sql_text(text):
     """清理 AI 可能返回的 Markdown 标记"""
@@ -136,6 +157,11 @@ def clean_sql_text(text):
     text = re.sub(r'^```\s*', '', text, flags=re.MULTILINE)
     return text.strip()
 
+def count_insert_rows(sql_text):
+    """粗略统计 INSERT 语句里的行数（每条 INSERT 记 1 行，多行 VALUES 按 "),(" 分隔累加）。"""
+    statements = re.findall(r'INSERT\s+INTO.*?;', sql_text, flags=re.IGNORECASE | re.DOTALL)
+    return sum(len(re.findall(r'\)\s*,\s*\(', s)) + 1 for s in statements)
+
 # ================= 主流程 =================
 def main():
     # ⚠️ 修改为你的实际文件路径
@@ -151,20 +177,26 @@ def main():
         raw_content = f.read()
 
     print("🚀 正在调用 DeepSeek API 直接生成 SQL 脚本...")
+    PROMPT.check_drift()
+    messages = PROMPT.messages(raw_content=raw_content)
     try:
         # 注意：这里不再使用 response_format={'type': 'json_object'}，因为我们直接要 SQL 文本
-        response = client.chat.completions.create(
-            model="deepseek-chat", 
-            messages=[
-                {"role": "system", "content": SYSTEM_INSTRUCTION},
-                {"role": "user", "content": f"请将以下题目转换为 SQL 插入语句，unit_id 统一设为 1：\n\n{raw_content}"}
-            ],
-            stream=False,
-            temperature=0.1 
-        )
+        with METRICS.track(unit=os.path.basename(input_file), model=MODEL_NAME) as call:
+            record = cached_completion(
+                RESPONSE_CACHE, MODEL_NAME, messages, SAMPLING_PARAMS,
+                lambda: RATE_LIMITER.call(
+                    call.attempt(lambda: client.chat.completions.create(
+                        model=MODEL_NAME,
+                        messages=messages,
+                        **SAMPLING_PARAMS
+                    )),
+                    estimate_tokens_for_messages(messages, EXPECTED_COMPLETION_TOKENS)
+                )
+            )
+            call.finish(record)
         
-        sql_content = response.choices[0].message.content
-        print("✅ API 响应成功。")
+        sql_content = record["raw_text"]
+        print("💾 命中响应缓存。" if record["cached"] else "✅ API 响应成功。")
         
         # 清理文本
         final_sql = clean_sql_text(sql_content)
@@ -178,9 +210,12 @@ def main():
             f.write(header + final_sql)
         
         print(f"🎉 成功！SQL 文件已保存至: {output_file}")
+        METRICS.unit(os.path.basename(input_file), "ok", questions=count_insert_rows(final_sql))
         
     except Exception as e:
         print(f"❌ 运行失败: {e}")
+        METRICS.unit(os.path.basename(input_file), "error", error=repr(e))
+    METRICS.print_report()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,83 @@
+import os
+import sys
+import json
+import signal
+import tempfile
+import importlib.util
+from itertools import count
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+for sub in ("Common", "QuestionsFinal"):
+    path = str(ROOT / sub)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Common/ 下的模块在导入时读取这些路径：测试期间的限流器、缓存、metrics、运行清单都放进临时目录，不碰 Common/.runtime
+_RUNTIME = Path(tempfile.mkdtemp(prefix="yprogram-tests-"))
+for name, value in {"YPROGRAM_RATELIMIT_DB": "rate_limiter.sqlite3", "YPROGRAM_LLM_CACHE": "llm_cache.sqlite3",
+                    "YPROGRAM_METRICS_DIR": "metrics", "YPROGRAM_PROMPT_REGISTRY": "prompt_registry.json",
+                    "YPROGRAM_RUN_STORE": "run_store.sqlite3"}.items():
+    os.environ[name] = str(_RUNTIME / value)
+os.environ.pop("YPROGRAM_BACKENDS", None)
+
+from llm_cache import ResponseCache
+from mock_llm_server import start_mock_server
+
+SCRIPT = ROOT / "QuestionsFinal" / "FinalScript v7.py"
+THEMES = ROOT / "QuestionsFinal" / "Python questions outline.txt"
+UNITS = 6
+_loaded = count()
+
+
+@pytest.fixture
+def mock_server():
+    servers = []
+
+    def _start(latency: str = "uniform:0.01,0.05", **faults):
+        server = start_mock_server(latency=latency, seed=7, retry_after=0.1, **faults)
+        servers.append(server)
+        return server
+
+    yield _start
+    for server in servers:
+        server.shutdown()
+
+
+@pytest.fixture
+def load_finalscript(tmp_path, monkeypatch):
+    """每个测试导入一份全新的脚本模块（模块级的后端池、缓存、取消标志互不影响），产物写到 tmp_path。"""
+    previous_sigint = signal.getsignal(signal.SIGINT)
+
+    def _load(base_url: str = "http://127.0.0.1:9/v1", backends: list = None):
+        monkeypatch.setenv("DEEPSEEK_BASE_URL", base_url)
+        monkeypatch.setenv("DEEPSEEK_API_KEY", "mock")
+        if backends is not None:
+            monkeypatch.setenv("YPROGRAM_BACKENDS", json.dumps(backends))
+        spec = importlib.util.spec_from_file_location(f"finalscript_v7_{next(_loaded)}", SCRIPT)
+        fs = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(fs)
+        fs.BASE_OUT_DIR = tmp_path / "out"
+        fs.THEMES_TXT_PATH = THEMES
+        fs.GLOBAL_UNIT_START, fs.GLOBAL_UNIT_END = 1, UNITS
+        fs.RUN_STORE_PATH = tmp_path / "run_store.sqlite3"
+        fs.METRICS_PATH = tmp_path / "metrics.jsonl"
+        fs._response_cache = ResponseCache(tmp_path / "llm_cache.sqlite3")
+        fs.RETRY_BACKOFF_MAX = 0.2
+        return fs
+
+    yield _load
+    signal.signal(signal.SIGINT, previous_sigint)
+
+
+def read_summary(fs, name: str = "summary_generate.json") -> dict:
+    return json.loads((fs.BASE_OUT_DIR / name).read_text(encoding="utf-8"))
+
+
+def assert_all_units_finished(summary: dict, total: int = UNITS):
+    assert summary["total"] == total
+    assert summary["error"] == 0 and summary["cancelled"] == 0
+    assert summary["ok"] + summary["quarantined"] == total
+    assert summary["ok"] >= 1
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from collections import Counter
+
+import pytest
+
+import backend_pool
+from backend_pool import Backend, BackendPool, load_backends
+from conftest import UNITS, assert_all_units_finished, read_summary
+
+
+class HTTPFailure(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def make_pool(*weights, strategy="least_outstanding"):
+    return BackendPool([Backend(f"b{i}", "http://x", "k", weight=w) for i, w in enumerate(weights)], strategy)
+
+
+def fail(pool, exc, times=1):
+    for _ in range(times):
+        with pytest.raises(type(exc)):
+            with pool.lease():
+                raise exc
+
+
+def test_breaker_trips_after_consecutive_failures():
+    pool = make_pool(1)
+    backend = pool.backends[0]
+    fail(pool, HTTPFailure(503), backend_pool.FAIL_THRESHOLD - 1)
+    assert backend.unavailable_until == 0
+    fail(pool, HTTPFailure(503))
+    assert backend.trips == 1 and backend.unavailable_until > 0
+    assert pool.summary()["backends"]["b0"]["available"] is False
+
+
+def test_auth_failure_trips_at_once_and_output_errors_do_not_count():
+    pool = make_pool(1)
+    fail(pool, ValueError("bad json"), backend_pool.FAIL_THRESHOLD + 1)
+    assert pool.backends[0].stats["failures"] == 0 and pool.backends[0].trips == 0
+    fail(pool, HTTPFailure(401))
+    assert pool.backends[0].trips == 1
+
+
+def test_tripped_backend_is_skipped_and_success_resets():
+    pool = make_pool(1, 1)
+    first = pool.backends[0]
+    first.unavailable_until = float("inf")
+    for _ in range(4):
+        with pool.lease() as backend:
+            assert backend is pool.backends[1]
+    first.unavailable_until = 0
+    first.consecutive_failures, first.trips = 2, 1
+    while True:
+        with pool.lease() as backend:
+            if backend is first:
+                break
+    assert first.consecutive_failures == 0 and first.trips == 0
+
+
+def test_all_unavailable_picks_earliest_recovery():
+    pool = make_pool(1, 1)
+    pool.backends[0].unavailable_until = float("inf")
+    pool.backends[1].unavailable_until = 1e12
+    with pool.lease() as backend:
+        assert backend is pool.backends[1]
+
+
+def test_weighted_round_robin_follows_weights():
+    pool = make_pool(3, 1, strategy="weighted_rr")
+    picks = Counter()
+    for _ in range(40):
+        with pool.lease() as backend:
+            picks[backend.name] += 1
+    assert picks == {"b0": 30, "b1": 10}
+
+
+def test_load_backends_defaults_and_model_mapping(monkeypatch):
+    monkeypatch.setenv("KEY_B", "sk-b")
+    default = Backend("default", "https://api", "sk-default", rpm=60, tpm=1000)
+    backends = load_backends('[{"name": "a", "api_key": "sk-a", "model": "r1"}, {"name": "b", "api_key_env": "KEY_B", '
+                             '"json_mode": false}]', default, scope_prefix="deepseek", primary_model="deepseek-reasoner")
+    a, b = backends
+    assert (a.base_url, a.rpm, a.scope, a.model_for("deepseek-reasoner"), a.model_for("deepseek-chat")) == \
+        ("https://api", 60, "deepseek:a", "r1", "deepseek-chat")
+    assert b.api_key == "sk-b" and b.json_mode is False
+    assert load_backends("", default) == [default]
+
+
+def test_backend_pool_fails_over_to_healthy_backend(mock_server, load_finalscript):
+    healthy = mock_server(rate_malformed=0.2)
+    broken = mock_server(rate_5xx=1.0)
+    fs = load_finalscript(healthy.base_url, backends=[
+        {"name": "healthy", "base_url": healthy.base_url, "api_key": "mock"},
+        {"name": "broken", "base_url": broken.base_url, "api_key": "mock"},
+    ])
+
+    fs.main([])
+
+    summary = read_summary(fs)
+    assert_all_units_finished(summary)
+    backends = summary["backends"]["backends"]
+    assert backends["broken"]["ok"] == 0
+    assert backends["broken"]["failures"] == broken.model.stats["5xx"] >= 1
+    assert backends["healthy"]["ok"] >= UNITS
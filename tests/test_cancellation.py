@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+
+import pytest
+
+from cancellation import CancelToken, Cancelled
+
+
+def test_wait_returns_early_when_cancelled():
+    token = CancelToken()
+    threading.Timer(0.05, token.cancel, args=("SIGINT",)).start()
+    started = time.monotonic()
+    assert token.wait(5) is True
+    assert time.monotonic() - started < 1
+    assert token.reason == "SIGINT"
+    with pytest.raises(Cancelled):
+        token.raise_if_cancelled()
+
+
+def test_first_reason_wins():
+    token = CancelToken()
+    assert token.wait(0) is False
+    token.cancel("first")
+    token.cancel("second")
+    assert token.cancelled and token.reason == "first"
+
+
+@pytest.mark.parametrize("async_engine", [True, False], ids=["async", "threaded"])
+def test_unit_cancelled_mid_retry_is_reported_as_cancelled(load_finalscript, tmp_path, async_engine):
+    fs = load_finalscript("http://127.0.0.1:9/v1")
+
+    def _cancel_during_call(*args, **kwargs):
+        fs.CANCEL.cancel("test")
+        raise fs.Cancelled("test")
+
+    async def _cancel_during_call_async(*args, **kwargs):
+        _cancel_during_call()
+
+    fs.call_model = _cancel_during_call
+    fs.request_unit_hedged_async = _cancel_during_call_async
+    if async_engine:
+        gate = fs.AdaptiveConcurrencyLimiter(1, 1, 1)
+        result = fs.asyncio.run(fs.process_single_unit_async({}, gate, 1, "主题", fs.BASE_OUT_DIR))
+    else:
+        result = fs.process_single_unit({}, 1, "主题", fs.BASE_OUT_DIR)
+
+    assert result["status"] == "cancelled" and result["attempts"] == 1
+    assert not fs.unit_output_paths(1, fs.BASE_OUT_DIR)["sql_path"].exists()
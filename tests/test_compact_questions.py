@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""紧凑格式来回检查：标准题目 -> compact_question -> JSON -> expand_question 必须与原题完全相同。"""
+import json
+from pathlib import Path
+
+import pytest
+
+from compact_questions import (CompactFormatError, FIELDS, _segments, compact_code, compact_question,
+                               dumps_compact, expand_code, expand_question, expand_questions)
+from question_validator import CODE_KEYS, compile_unit_validator
+
+CORPUS_DIR = Path(__file__).resolve().parents[1] / "QuestionsFinal" / "Questions_v7" / "json_parsed"
+VALIDATOR = compile_unit_validator()
+
+
+def load_corpus():
+    cases = []
+    for f in sorted(CORPUS_DIR.rglob("*.json")):
+        data = json.loads(f.read_text(encoding="utf-8"))
+        questions = data.get("questions", data) if isinstance(data, dict) else data
+        for pos, q in enumerate(questions, 1):
+            cases.append(pytest.param(q, pos, id=f"{f.stem}-q{q.get('id', pos)}"))
+    return cases
+
+
+CORPUS = load_corpus()
+
+
+def code_of(q: dict):
+    return next((q[k] for k in CODE_KEYS if k in q), None)
+
+
+def test_corpus_present():
+    assert len(CORPUS) == 455
+
+
+@pytest.mark.parametrize("q, pos", CORPUS)
+def test_corpus_round_trip(q, pos):
+    try:
+        compact = compact_question(q)
+    except CompactFormatError:
+        # 只有结构校验本来就不接受的题目才允许无法写成紧凑格式
+        assert VALIDATOR.question(q, pos), "题目合格却无法写成紧凑格式"
+        return
+    back = expand_question(json.loads(json.dumps(compact, ensure_ascii=False)))
+    assert set(q) - set(CODE_KEYS) <= set(back)
+    assert back["type"] == q["type"]
+    for name in FIELDS[q["type"]]:
+        if name == "code":
+            # 原题的 code 可能是字符串 / 裸数组 / 缺 segments 包装，展开结果总是 {segments: [...]}
+            assert back["code_segments"] == {"segments": _segments(code_of(q))}
+        else:
+            assert back[name] == q.get(name)
+
+
+def test_adjacent_code_blocks_keep_boundaries():
+    segments = [
+        {"type": "code_block", "lines": [{"type": "code_line", "value": "a = 1"}]},
+        {"type": "code_block", "lines": [{"type": "code_line", "value": "b = 2"}]},
+        {"type": "code_inline", "parts": [{"type": "code", "value": "print("}, {"type": "slot", "index": 0},
+                                          {"type": "code", "value": ")"}]},
+    ]
+    lines = compact_code({"segments": segments})
+    assert lines == ["a = 1", None, "b = 2", "print(__0__)"]
+    assert expand_code(lines) == {"segments": segments}
+
+
+def test_inline_without_plain_string_form_is_written_as_parts():
+    segments = [
+        {"type": "code_inline", "parts": [{"type": "code", "value": "x = 1"}]},
+        {"type": "code_inline", "parts": [{"type": "code", "value": "y = "}, {"type": "slot", "index": 0},
+                                          {"type": "code", "value": ""}]},
+    ]
+    lines = compact_code({"segments": segments})
+    assert lines == [["x = 1"], ["y = ", 0, ""]]
+    assert expand_code(lines) == {"segments": segments}
+
+
+def test_slot_inside_code_block_is_rejected():
+    q = {"type": "fill", "code_segments": {"segments": [
+        {"type": "code_block", "lines": [{"type": "slot", "index": 0}]}]}}
+    with pytest.raises(CompactFormatError):
+        compact_question(q)
+
+
+def test_dumps_compact_expands_back():
+    questions = [p.values[0] for p in CORPUS[:15]]
+    questions = [q for pos, q in enumerate(questions, 1) if not VALIDATOR.question(q, pos)]
+    parsed = expand_questions(json.loads(dumps_compact(questions)))
+    assert [q["id"] for q in parsed] == [q["id"] for q in questions]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""FinalScript v7 批量推理：--batch-submit 写出请求，假服务代替供应商生成结果文件，再 --batch-collect 离线导出。"""
+import json
+from pathlib import Path
+
+import pytest
+from openai import OpenAI
+
+from conftest import UNITS, read_summary
+
+
+def run_batch_provider(requests_path: Path, results_path: Path, base_url: str, fail: set):
+    """代替供应商执行批量请求：逐条发给假服务，按 Batch API 结果格式写出；fail 中的 custom_id 写成失败行。"""
+    client = OpenAI(api_key="mock", base_url=base_url, max_retries=0)
+    with open(requests_path, encoding="utf-8") as src, open(results_path, "w", encoding="utf-8") as out:
+        for line in src:
+            req = json.loads(line)
+            if req["custom_id"] in fail:
+                result = {"custom_id": req["custom_id"], "response": None, "error": {"message": "expired"}}
+            else:
+                body = client.chat.completions.create(**req["body"]).model_dump()
+                result = {"custom_id": req["custom_id"], "response": {"status_code": 200, "body": body}, "error": None}
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+def test_batch_submit_and_collect(mock_server, load_finalscript, tmp_path):
+    server = mock_server()
+    fs = load_finalscript(server.base_url)
+    requests_path = tmp_path / "batch" / "requests.jsonl"
+    results_path = tmp_path / "batch" / "results.jsonl"
+
+    fs.main(["--batch-submit", "--batch-requests", str(requests_path)])
+    assert server.model.stats["requests"] == 0   # 提交阶段不访问 API
+    ids = [json.loads(line)["custom_id"] for line in requests_path.read_text(encoding="utf-8").splitlines()]
+    assert ids == [fs.batch_custom_id(g) for g in range(1, UNITS + 1)]
+
+    run_batch_provider(requests_path, results_path, server.base_url, fail={ids[-1]})
+    served = server.model.stats["requests"]
+    fs.main(["--batch-collect", str(results_path), "--batch-requests", str(requests_path)])
+    assert server.model.stats["requests"] == served   # 收集阶段同样离线
+
+    summary = read_summary(fs, "summary_batch.json")
+    assert summary["mode"] == "batch" and summary["total"] == UNITS
+    assert summary["error"] == 1
+    assert summary["ok"] + summary["quarantined"] == UNITS - 1
+
+
+def test_batch_collect_without_submitted_units_exits(load_finalscript, tmp_path):
+    fs = load_finalscript()
+    requests_path = tmp_path / "batch" / "requests.jsonl"
+    requests_path.parent.mkdir()
+    requests_path.write_text("", encoding="utf-8")
+    results_path = tmp_path / "batch" / "results.jsonl"
+    results_path.write_text("", encoding="utf-8")
+
+    with pytest.raises(SystemExit, match="无法读取提交时的元数据"):
+        fs.main(["--batch-collect", str(results_path), "--batch-requests", str(requests_path)])
+    (tmp_path / "batch" / "requests.meta.json").write_text(json.dumps({"lb-1-15": {"theme": "变量"}}), encoding="utf-8")
+    with pytest.raises(SystemExit, match="没有本脚本提交的单元"):
+        fs.main(["--batch-collect", str(results_path), "--batch-requests", str(requests_path)])
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from hedging import HedgePolicy, run_hedged
+
+
+def warmed_policy(**kwargs) -> HedgePolicy:
+    policy = HedgePolicy(percentile=90, min_samples=2, min_delay=0.01, **kwargs)
+    policy.observe(0.05)
+    policy.observe(0.05)
+    return policy
+
+
+def test_no_hedge_until_enough_samples():
+    policy = HedgePolicy(min_samples=3)
+    policy.observe(1.0)
+    assert policy.delay() is None
+    policy.observe(1.0)
+    policy.observe(3.0)
+    assert policy.delay() == pytest.approx(3.0, rel=0.5)
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    policy = warmed_policy(max_extra_fraction=1.0)
+    cancelled = []
+
+    async def call(copy):
+        try:
+            await asyncio.sleep(5 if copy == 0 else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(copy)
+            raise
+        return copy
+
+    result, info = asyncio.run(run_hedged(call, policy))
+    assert result == 1 and info["hedged"] and info["winner"] == 1
+    assert cancelled == [0]
+    assert policy.summary()["hedge_wins"] == 1
+
+
+def test_failed_copy_waits_for_the_other():
+    policy = warmed_policy(max_extra_fraction=1.0)
+
+    async def call(copy):
+        if copy == 1:
+            raise RuntimeError("hedge failed")
+        await asyncio.sleep(0.2)
+        return "primary"
+
+    result, info = asyncio.run(run_hedged(call, policy))
+    assert result == "primary" and info["hedged"] and info["winner"] == 0
+
+
+def test_extra_request_budget_limits_hedges():
+    policy = warmed_policy(max_extra_fraction=0.1)
+
+    async def call(copy):
+        await asyncio.sleep(0.05)
+        return copy
+
+    result, info = asyncio.run(run_hedged(call, policy))
+    assert result == 0 and not info["hedged"]
+    assert policy.hedges == 0
+
+
+def test_cancelled_hedge_loser_releases_gate_and_tokens(mock_server, load_finalscript):
+    server = mock_server(latency="fixed:5")
+    fs = load_finalscript(server.base_url)
+    limiter = fs.get_backend_pool().backends[0].limiter
+    settled = []
+    limiter.settle = lambda estimated, actual: settled.append((estimated, actual))
+
+    async def _run():
+        gate = fs.AdaptiveConcurrencyLimiter(2, 1, 4)
+        aclients = fs.init_async_clients(fs.get_backend_pool())
+        call = asyncio.create_task(fs.call_model_async(aclients, gate, [{"role": "user", "content": "hi"}], 1,
+                                                       use_cached=False))
+        await asyncio.sleep(0.3)
+        call.cancel()   # 与 run_hedged 取消落败的一份相同
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        return gate
+
+    gate = asyncio.run(_run())
+    assert gate.in_flight == 0 and gate._successes == 0 and gate.limit == 2
+    assert len(settled) == 1 and settled[0][1] == 0 and settled[0][0] > 0
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""增量解析器：无论模型输出在哪里被切块（字符串中间、转义符之后、围栏里），结果都要与整段解析相同。"""
+import json
+import random
+
+import pytest
+
+from compact_questions import compact_question, dumps_compact, expand_question
+from incremental_json import IncrementalQuestionParser, StreamAbort
+
+QUESTIONS = [
+    {"id": 1, "type": "choice", "title": "含 \"引号\" 与 {花括号} 的题干", "options": ["[a]", "b}", "c\\", "d"],
+     "answer": "A"},
+    {"id": 2, "type": "fill", "title": "补全", "code_segments": {"segments": [
+        {"type": "code_inline", "parts": [{"type": "code", "value": "print(\"]\\n\")"},
+                                          {"type": "slot", "index": 0}]}]},
+     "options": ["x", "y"], "answer": [0]},
+    {"id": 3, "type": "choice", "title": "最后一题", "options": ["a", "b", "c", "d"], "answer": "D"},
+]
+BARE = json.dumps(QUESTIONS, ensure_ascii=False, indent=2)
+WRAPPED = "```json\n" + json.dumps({"questions": QUESTIONS}, ensure_ascii=False) + "\n```"
+
+
+def feed_in_chunks(text, sizes, **kwargs):
+    parser = IncrementalQuestionParser(**kwargs)
+    got, pos = [], 0
+    for size in sizes:
+        got += parser.feed(text[pos:pos + size])
+        pos += size
+    got += parser.feed(text[pos:])
+    return parser, got
+
+
+@pytest.mark.parametrize("text", [BARE, WRAPPED], ids=["bare", "wrapped"])
+def test_one_char_at_a_time(text):
+    parser, got = feed_in_chunks(text, [1] * len(text))
+    assert got == QUESTIONS == parser.items
+    assert parser.complete and not parser.errors and not parser.fixes
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_split_points(seed):
+    rng = random.Random(seed)
+    parser, got = feed_in_chunks(BARE, [rng.randint(1, 40) for _ in range(len(BARE) // 10)])
+    assert got == QUESTIONS and parser.complete
+
+
+def test_items_are_returned_as_soon_as_they_close():
+    parser = IncrementalQuestionParser()
+    cut = BARE.index('"id": 2')
+    assert parser.feed(BARE[:cut]) == QUESTIONS[:1]
+    assert not parser.complete
+    assert parser.feed(BARE[cut:]) == QUESTIONS[1:]
+
+
+def test_truncated_stream_keeps_complete_prefix():
+    cut = BARE.index('"最后一题"')
+    parser, got = feed_in_chunks(BARE[:cut], [7] * (cut // 7))
+    assert got == QUESTIONS[:2] and not parser.complete
+    assert BARE[:parser.complete_end].rstrip().endswith("}")
+    assert json.loads(BARE[:parser.complete_end] + "]") == QUESTIONS[:2]
+
+
+def test_local_repair_is_counted():
+    text = '[{"id": 1, "type": "choice", "answer": "A",}, {"id": 2, "type": "fill",}]'
+    parser, got = feed_in_chunks(text, [5] * 20)
+    assert [q["id"] for q in got] == [1, 2]
+    assert parser.fixes == {"trailing_comma": 2}
+
+
+def test_later_bad_items_are_recorded_not_raised():
+    text = '[{"id": 1, "type": "choice"}, {"id": 2, "type": "essay"}, {"type": "fill"}, {"id": 4, "type": "fill"}]'
+    parser = IncrementalQuestionParser()
+    assert [q["id"] for q in parser.feed(text)] == [1, 4]
+    assert len(parser.errors) == 2 and parser.rejected == ['{"id": 2, "type": "essay"}', '{"type": "fill"}']
+
+
+@pytest.mark.parametrize("text", [
+    "好的，下面是为你生成的题目，共十五道，" * 30,
+    '["第一题"]',
+    '[{"id": 1, "type": "essay"}]',
+    '[{"id": 1, "type": "choice"} oops',
+    '[[1, 2]]',
+])
+def test_stream_abort(text):
+    with pytest.raises(StreamAbort):
+        IncrementalQuestionParser(max_prelude_chars=100).feed(text)
+
+
+def test_lenient_first_item():
+    parser = IncrementalQuestionParser(strict_first=False)
+    assert parser.feed('[{"id": 1, "type": "essay"}, {"id": 2, "type": "choice"}]') == [{"id": 2, "type": "choice"}]
+    assert len(parser.errors) == 1
+
+
+def test_compact_items_are_expanded():
+    text = dumps_compact(QUESTIONS)
+    parser, got = feed_in_chunks(text, [3] * len(text), expand=expand_question)
+    assert got == [expand_question(compact_question(q)) for q in QUESTIONS]
+    assert parser.complete
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""单元调度：LPT 排序、列表调度的完工时间模拟、历史耗时与启发式估计。"""
+import json
+
+import pytest
+
+from job_ordering import (REVIEW_FACTOR, SUMMARY_REVIEW_FACTOR, UnitCost, estimate_unit_costs, heuristic_cost,
+                          load_unit_history, lpt_order, simulate_makespan)
+
+
+def costs_of(*values):
+    return [UnitCost(i, f"主题{i}", v, "estimate") for i, v in enumerate(values, 1)]
+
+
+def test_lpt_orders_longest_first_ties_by_unit():
+    order = lpt_order(costs_of(2.0, 5.0, 2.0, 9.0, 5.0))
+    assert [c.global_unit for c in order] == [4, 2, 5, 1, 3]
+
+
+@pytest.mark.parametrize("costs, workers, expected", [
+    ([], 4, 0.0),
+    ([3.0, 1.0, 2.0], 1, 6.0),
+    ([3.0, 1.0, 2.0], 10, 3.0),
+    ([1.0, 1.0, 1.0, 1.0], 2, 2.0),
+    ([1.0, 1.0, 4.0], 2, 5.0),
+    ([2.0, 2.0], 0, 4.0),
+])
+def test_simulate_makespan(costs, workers, expected):
+    assert simulate_makespan(costs, workers) == expected
+
+
+def test_lpt_shortens_a_long_tail():
+    costs = costs_of(1, 1, 1, 1, 1, 1, 6)
+    in_order = simulate_makespan([c.cost for c in costs], 3)
+    lpt = simulate_makespan([c.cost for c in lpt_order(costs)], 3)
+    assert (in_order, lpt) == (8.0, 6.0)
+
+
+def test_heuristic_cost_factors():
+    assert heuristic_cost("函数", 0) == 1.0
+    assert heuristic_cost("循环；复习函数", 0) == pytest.approx(REVIEW_FACTOR)
+    assert heuristic_cost("第一阶段总复习", 0) == pytest.approx(SUMMARY_REVIEW_FACTOR)
+    assert heuristic_cost("小复习", 20000) == pytest.approx(2 * SUMMARY_REVIEW_FACTOR)
+
+
+def test_history_takes_median_of_fresh_runs(tmp_path):
+    events = [
+        {"kind": "call", "outcome": "ok", "script": "fs", "run": "r1", "unit": 1, "phase": "unit", "latency_sec": 10},
+        {"kind": "call", "outcome": "ok", "script": "fs", "run": "r1", "unit": 1, "phase": "repair", "latency_sec": 2},
+        {"kind": "call", "outcome": "ok", "script": "fs", "run": "r2", "unit": 1, "phase": "hedge", "latency_sec": 20},
+        {"kind": "call", "outcome": "ok", "script": "fs", "run": "r3", "unit": 1, "phase": "unit", "latency_sec": 30},
+        {"kind": "call", "outcome": "ok", "script": "fs", "run": "r1", "unit": 2, "phase": "repair", "latency_sec": 5},
+        {"kind": "call", "outcome": "error", "script": "fs", "run": "r1", "unit": 3, "phase": "unit", "latency_sec": 5},
+        {"kind": "call", "outcome": "ok", "script": "other", "run": "r1", "unit": 4, "phase": "unit", "latency_sec": 5},
+        {"kind": "call", "outcome": "ok", "script": "fs", "run": "r1", "phase": "unit", "latency_sec": 5},
+    ]
+    path = tmp_path / "metrics.jsonl"
+    path.write_text("\n".join(json.dumps(e) for e in events) + "\n", encoding="utf-8")
+    assert load_unit_history(path, "fs") == {1: 20.0}   # r1 = 10 + 2；只有修复调用的单元 2 不算
+    assert load_unit_history(tmp_path / "missing.jsonl") == {}
+
+
+def test_estimates_are_calibrated_by_history():
+    tasks = [(1, "函数"), (2, "复习函数"), (3, "小复习")]
+    costs = estimate_unit_costs(tasks, lambda theme: [], {1: 10.0})
+    scale = 10.0 / heuristic_cost("函数", 0)
+    assert costs[0] == UnitCost(1, "函数", 10.0, "history")
+    assert costs[1].source == "estimate"
+    assert costs[1].cost == pytest.approx(heuristic_cost("复习函数", 0) * scale)
+    assert [c.global_unit for c in lpt_order(costs)] == [3, 2, 1]
+    uncalibrated = estimate_unit_costs(tasks, lambda theme: [], {})
+    assert [c.cost for c in uncalibrated] == [heuristic_cost(t, 0) for _, t in tasks]
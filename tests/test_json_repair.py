@@ -0,0 +1,90 @@
+import json
+from importlib.util import module_from_spec, spec_from_file_location
+from pathlib import Path
+
+import pytest
+
+from json_repair import EXTRACTION_FIXES, JSONRepairError, parse_json_tolerant, repair_json
+
+
+@pytest.mark.parametrize("text, expected, fixes", [
+    ('[{"id": 1}]', [{"id": 1}], {}),
+    ('```json\n[{"id": 1}]\n```', [{"id": 1}], {"fence": 2}),
+    ('好的，题目如下：\n[{"id": 1, "title": "求和"}]\n以上。', [{"id": 1, "title": "求和"}], {"leading_text", "trailing_text"}),
+    ('[{"id": 1,}, {"id": 2},]', [{"id": 1}, {"id": 2}], {"trailing_comma": 2}),
+    ('{"a": 1\n "b": 2}', {"a": 1, "b": 2}, {"missing_comma": 1}),
+    ("{'a': True, 'b': None}", {"a": True, "b": None}, {"single_quote", "python_literal"}),
+    ('{id: 1, "kind": choice}', {"id": 1, "kind": "choice"}, {"unquoted_key", "bare_word"}),
+    ('{“a”：1，"b": 2}', {"a": 1, "b": 2}, {"fullwidth_quote", "fullwidth_punct"}),
+    ('{"a": 1, // 注释\n "b": 2 /* 块 */}', {"a": 1, "b": 2}, {"comment": 2}),
+    ('{"title": "输出 "hello" 的结果"}', {"title": '输出 "hello" 的结果'}, {"inner_quote": 1}),
+    ('{"code": "a\nb", "re": "\\d+"}', {"code": "a\nb", "re": "\\d+"}, {"control_char", "bad_escape"}),
+    ('[{"id": 1}, {"id": 2', [{"id": 1}, {"id": 2}], {"unclosed_bracket": 2}),
+])
+def test_repairs(text, expected, fixes):
+    obj, got = parse_json_tolerant(text)
+    assert obj == expected
+    if isinstance(fixes, dict):
+        assert got == fixes
+    else:
+        assert fixes <= set(got)
+
+
+def test_embedded_json_string_keeps_inner_quotes():
+    text = '{"code_segment": "{"segments": [{"type": "code_block"}]}"}'
+    obj, fixes = parse_json_tolerant(text)
+    assert json.loads(obj["code_segment"]) == {"segments": [{"type": "code_block"}]}
+    assert fixes == {"inner_quote": 1}
+
+
+def test_valid_json_is_not_rewritten():
+    text = '{"a": [1, 2.5, "x\\n"], "b": null}'
+    assert parse_json_tolerant(text) == (json.loads(text), {})
+
+
+def test_extraction_only_fixes():
+    _, fixes = parse_json_tolerant('```json\n{"a": 1}\n```')
+    assert set(fixes) <= EXTRACTION_FIXES
+
+
+def test_bracketed_note_in_prose_is_not_json():
+    # 说明文字里的 [注意] 只有无引号的词，不能被当成题目数组
+    with pytest.raises(JSONRepairError):
+        parse_json_tolerant('好的，下面是题目 [注意] 内容：[{"id": 1}]')
+    text = '好的，下面是题目 [注意]：\n```json\n[{"id": 1, "type": "choice"}, {"id": 2, "type": "fill"}]\n```'
+    obj, fixes = parse_json_tolerant(text)
+    assert obj == [{"id": 1, "type": "choice"}, {"id": 2, "type": "fill"}]
+    assert "bare_word" not in fixes
+
+
+def test_only_bare_words_is_not_json():
+    with pytest.raises(JSONRepairError):
+        parse_json_tolerant("[hello, world]")
+    assert repair_json("见 [附录] 与 {说明}") == ("见 [附录] 与 {说明}", {})
+
+
+def test_code_with_a_dict_literal_is_not_json():
+    with pytest.raises(JSONRepairError):
+        parse_json_tolerant("d = {'a': 1}\nprint(d)")
+
+
+def test_plain_text_raises():
+    with pytest.raises(JSONRepairError):
+        parse_json_tolerant("抱歉，我无法完成这个请求。")
+    with pytest.raises(JSONRepairError):
+        parse_json_tolerant(None)
+
+
+@pytest.fixture(scope="module")
+def finalscript():
+    spec = spec_from_file_location("finalscript_v7_json_repair",
+                                   Path(__file__).resolve().parents[1] / "QuestionsFinal" / "FinalScript v7.py")
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_fill_code_string_is_kept_as_code(finalscript):
+    assert finalscript.normalize_fill_code_field("d = {'a': 1}\nprint(d)") == "d = {'a': 1}\nprint(d)"
+    assert finalscript.normalize_fill_code_field('[{"type": "code_block", "lines": []}]') == \
+        {"segments": [{"type": "code_block", "lines": []}]}
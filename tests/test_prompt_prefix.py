@@ -0,0 +1,19 @@
+from prompt_prefix import PromptPrefix
+
+
+def test_whitespace_edit_is_reported_as_drift(tmp_path):
+    registry = tmp_path / "prompt_prefixes.json"
+    assert PromptPrefix("demo", "规则一\n规则二\n", registry_path=registry).check_drift() == []
+
+    edited = PromptPrefix("demo", "规则一\r\n规则二\n", registry_path=registry)
+    warnings = edited.check_drift()
+    assert len(warnings) == 1 and "只改了空白" in warnings[0] and "第 3 个字符" in warnings[0]
+    assert edited.messages("u")[0]["content"] == "规则一\r\n规则二\n"
+    assert edited.check_drift() == []
+
+
+def test_content_edit_is_reported_as_modified(tmp_path):
+    registry = tmp_path / "prompt_prefixes.json"
+    PromptPrefix("demo", "规则一\n规则二", registry_path=registry).check_drift()
+    warnings = PromptPrefix("demo", "规则一\n规则三", registry_path=registry).check_drift()
+    assert len(warnings) == 1 and "已修改" in warnings[0]
@@ -0,0 +1,113 @@
+import copy
+import json
+
+import pytest
+
+from question_validator import FILL_IDS, compile_unit_validator, expected_type, issues_by_question
+
+
+def choice(qid: int) -> dict:
+    return {"id": qid, "type": "choice", "title": f"题目 {qid}", "content": "下面哪项正确？",
+            "options": ["a", "b", "c", "d"], "answer": "B"}
+
+
+def fill(qid: int, slots=(0, 1)) -> dict:
+    parts = [{"type": "code", "value": "x = "}]
+    for i in slots:
+        parts += [{"type": "slot", "index": i}, {"type": "code", "value": " + "}]
+    return {"id": qid, "type": "fill", "title": f"题目 {qid}", "content": "补全代码",
+            "code_segments": {"segments": [{"type": "code_block", "lines": [{"type": "code_line", "value": "# demo"}]},
+                                           {"type": "code_inline", "parts": parts}]},
+            "options": ["1", "2", "3"], "answer": [0, 2][:len(slots)]}
+
+
+def unit() -> list:
+    return [fill(q) if q in FILL_IDS else choice(q) for q in range(1, 16)]
+
+
+def codes(issues) -> set:
+    return {it["code"] for it in issues}
+
+
+validate = compile_unit_validator()
+
+
+def test_layout_is_nine_choice_and_six_fill():
+    types = [expected_type(q) for q in range(1, 16)]
+    assert types.count("choice") == 9 and types.count("fill") == 6
+    assert [q for q in range(1, 16) if types[q - 1] == "fill"] == [4, 5, 9, 10, 14, 15]
+
+
+def test_valid_unit_has_no_issues():
+    assert validate(unit()) == []
+
+
+def test_question_count_and_type_order():
+    questions = unit()
+    assert codes(validate(questions[:14])) == {"unit.count"}
+    questions[0], questions[3] = questions[3], questions[0]
+    issues = validate(questions)
+    assert {it["path"] for it in issues} == {"$[0].type", "$[3].type"}
+
+
+@pytest.mark.parametrize("field, value, code", [
+    ("options", ["a", "b", "c"], "choice.options"),
+    ("answer", "E", "choice.answer"),
+    ("answer", "b", "choice.answer"),
+    ("title", "  ", "question.text"),
+])
+def test_choice_rules(field, value, code):
+    q = choice(1)
+    q[field] = value
+    assert codes(validate.question(q, 1)) == {code}
+
+
+def test_slot_numbering_must_start_at_zero_and_be_contiguous():
+    assert codes(validate.question(fill(4, slots=(0, 2)), 4)) == {"fill.slot_index"}
+    assert codes(validate.question(fill(4, slots=(1,)), 4)) == {"fill.slot_index"}
+    assert codes(validate.question(fill(4, slots=()), 4)) == {"fill.no_slot", "fill.answer"}
+    assert validate.question(fill(4, slots=(1, 0)), 4) == []
+
+
+def test_slot_inside_code_block_is_rejected():
+    q = fill(4)
+    q["code_segments"]["segments"][0]["lines"].append({"type": "slot", "index": 0})
+    issues = validate.question(q, 4)
+    assert codes(issues) == {"fill.code_block_line_type"}
+    assert issues[0]["path"] == "$.code_segments.segments[0].lines[1].type"
+
+
+def test_fill_answer_must_index_options():
+    q = fill(4)
+    q["answer"] = [0, 3]
+    assert codes(validate.question(q, 4)) == {"fill.answer_range"}
+    q["answer"] = [True]
+    assert codes(validate.question(q, 4)) == {"fill.answer_range"}
+
+
+def test_code_segments_string_is_parsed():
+    q = fill(4)
+    q["code_segments"] = json.dumps(q["code_segments"])
+    assert validate.question(q, 4) == []
+
+
+def test_grouped_layout():
+    grouped = compile_unit_validator("grouped")
+    fills = []
+    for q in unit():
+        if q["type"] == "fill":
+            q = copy.deepcopy(q)
+            q["answer"] = [q["options"][i] for i in q["answer"]]
+            fills.append(q)
+    chosen = [dict(choice(1), options={"A": "a", "B": "b", "C": "c", "D": "d"}) for _ in range(9)]
+    assert grouped({"choice_questions": chosen, "fill_questions": fills}) == []
+    assert codes(grouped({"choice_questions": chosen[:8], "fill_questions": fills})) == {"unit.count"}
+    chosen[0] = dict(chosen[0], options={"A": "a", "B": "b", "C": "c"})
+    assert codes(grouped({"choice_questions": chosen, "fill_questions": fills})) == {"choice.options"}
+
+
+def test_issues_grouped_by_question():
+    questions = unit()
+    questions[2]["answer"] = "Z"
+    questions[3]["answer"] = []
+    assert set(issues_by_question(validate(questions))) == {"$[2]", "$[3]"}
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""共享令牌桶：预扣、按实际用量多退少补、失败退回、429 冷却。时间用固定的 now 驱动，结果与机器快慢无关。"""
+import pytest
+
+import rate_limiter
+from rate_limiter import SharedRateLimiter, is_rate_limited, retry_after_seconds, usage_total_tokens
+
+
+class HTTPFailure(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("Resp", (), {"status_code": status_code, "headers": headers or {}})()
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "time", clock.time)
+    monkeypatch.setattr(rate_limiter.time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def limiter(tmp_path, clock):
+    return SharedRateLimiter("test", rpm=60, tpm=1000, db_path=tmp_path / "limits.sqlite3")
+
+
+def tokens(limiter, kind="tpm"):
+    with limiter._transaction() as conn:
+        capacity = limiter.tpm if kind == "tpm" else limiter.rpm
+        return limiter._refill(conn, f"{limiter.scope}:{kind}", capacity, rate_limiter.time.time())
+
+
+def test_acquire_deducts_and_refills_per_second(limiter, clock):
+    assert limiter.try_acquire(400) == 0
+    assert tokens(limiter) == 600 and tokens(limiter, "rpm") == 59
+    assert limiter.try_acquire(700) == pytest.approx(100 * 60 / 1000)   # 缺 100 token，按 tpm/60 每秒回填
+    assert tokens(limiter) == 600                                       # 拿不到时不扣
+    clock.now += 6
+    assert limiter.try_acquire(700) == 0
+
+
+def test_request_larger_than_bucket_is_capped(limiter):
+    assert limiter.try_acquire(5000) == 0
+    assert tokens(limiter) == 0
+
+
+def test_settle_refunds_and_charges(limiter):
+    limiter.try_acquire(500)
+    limiter.settle(500, 200)
+    assert tokens(limiter) == 800
+    limiter.settle(200, 900)
+    assert tokens(limiter) == 100
+    limiter.settle(0, 600)
+    assert tokens(limiter) == -500     # 估少了可以欠账，后续请求自然等待
+    limiter.settle(100, None)
+    assert tokens(limiter) == -500
+
+
+def test_settle_refund_is_capped_at_tpm(limiter):
+    limiter.try_acquire(100)
+    limiter.settle(100, 0)
+    limiter.settle(900, 0)
+    assert tokens(limiter) == 1000
+
+
+def test_call_refunds_failed_attempts(limiter, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "jittered_backoff", lambda *args: 0.0)
+    outcomes = [HTTPFailure(503), HTTPFailure(502), {"usage": {"total_tokens": 150}}]
+
+    def fn():
+        out = outcomes.pop(0)
+        if isinstance(out, Exception):
+            raise out
+        return out
+
+    assert limiter.call(fn, est_tokens=400) == {"usage": {"total_tokens": 150}}
+    assert not outcomes
+    # 两次失败的预扣全部退回，成功那次按实际 150 结算；请求额度不退
+    assert tokens(limiter) == 850
+    assert tokens(limiter, "rpm") == 57
+
+
+def test_call_reraises_non_transient_after_refund(limiter):
+    def fn():
+        raise HTTPFailure(400)
+
+    with pytest.raises(HTTPFailure):
+        limiter.call(fn, est_tokens=300)
+    assert tokens(limiter) == 1000
+
+
+def test_call_gives_up_after_rate_limit_retries(limiter):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise HTTPFailure(429, {"retry-after": "1"})
+
+    with pytest.raises(HTTPFailure):
+        limiter.call(fn, est_tokens=100, rate_limit_retries=2)
+    assert len(calls) == 3
+
+
+def test_429_cooldown_is_shared_and_backs_off(limiter, tmp_path, clock):
+    other = SharedRateLimiter("test", rpm=60, tpm=1000, db_path=tmp_path / "limits.sqlite3")
+    assert limiter.report_rate_limited() == pytest.approx(rate_limiter.DEFAULT_429_BACKOFF)
+    assert other.try_acquire(10) == pytest.approx(rate_limiter.DEFAULT_429_BACKOFF)
+    assert limiter.report_rate_limited() == pytest.approx(rate_limiter.DEFAULT_429_BACKOFF * 2)
+    limiter.report_success()
+    clock.now += 10
+    assert other.try_acquire(10) == 0
+    assert limiter.report_rate_limited(0.5) == pytest.approx(0.5)
+
+
+def test_helpers():
+    assert is_rate_limited(HTTPFailure(429)) and not is_rate_limited(HTTPFailure(500))
+    assert retry_after_seconds(HTTPFailure(429, {"retry-after-ms": "1500"})) == 1.5
+    assert retry_after_seconds(HTTPFailure(429, {"retry-after": "3"})) == 3.0
+    assert retry_after_seconds(HTTPFailure(429)) is None
+    assert usage_total_tokens({"usage": {"total_tokens": 42}}) == 42
+    assert usage_total_tokens(type("R", (), {"usage": None})()) is None
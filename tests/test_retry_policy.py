@@ -0,0 +1,93 @@
+import asyncio
+import random
+
+import httpx
+import pytest
+from openai import APIConnectionError
+
+from cancellation import Cancelled
+from incremental_json import StreamAbort
+from retry_policy import RetryBudget, RetryLedger, classify_failure, jittered_backoff
+
+
+class HTTPFailure(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class ResponseFailure(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.response = type("Resp", (), {"status_code": status_code})()
+
+
+@pytest.mark.parametrize("exc, expected", [
+    (Cancelled(), "cancelled"),
+    (asyncio.CancelledError(), "cancelled"),
+    (HTTPFailure(429), "rate_limited"),
+    (ResponseFailure(429), "rate_limited"),
+    (HTTPFailure(500), "transport"),
+    (HTTPFailure(503), "transport"),
+    (HTTPFailure(408), "transport"),
+    (HTTPFailure(400), "other"),
+    (HTTPFailure(401), "other"),
+    (APIConnectionError(request=httpx.Request("POST", "http://x")), "transport"),
+    (TimeoutError(), "transport"),
+    (ConnectionResetError(), "transport"),
+    (ValueError("bad json"), "parse"),
+    (StreamAbort("prose"), "parse"),
+    (RuntimeError("boom"), "other"),
+])
+def test_classify_failure(exc, expected):
+    assert classify_failure(exc) == expected
+
+
+def test_jittered_backoff_is_bounded_by_capped_exponential():
+    rng = random.Random(1)
+    for attempt, ceiling in [(1, 1.0), (2, 2.0), (3, 4.0), (5, 10.0), (9, 10.0)]:
+        delays = [jittered_backoff(attempt, 1.0, 2.0, 10.0, rng) for _ in range(200)]
+        assert all(0.0 <= d <= ceiling for d in delays)
+        assert max(delays) > ceiling * 0.8
+    assert jittered_backoff(0, 1.0, 2.0, 10.0, rng) <= 1.0
+
+
+def test_budget_counts_failures_until_exhausted():
+    budget = RetryBudget(3)
+    tried = 0
+    while budget.can_try():
+        assert budget.begin() == tried + 1
+        tried += 1
+        budget.failed("transport")
+    assert tried == 3 and budget.failures == 3 and not budget.stopped
+
+
+def test_rate_limited_is_deferred_without_spending_attempts():
+    budget = RetryBudget(2, max_deferrals=3)
+    for _ in range(3):
+        budget.begin()
+        assert budget.failed("rate_limited")
+    assert budget.deferrals == 3 and budget.failures == 0
+    budget.begin()
+    assert budget.failed("rate_limited")   # 超过 max_deferrals 后按普通失败计
+    assert budget.failures == 1
+    assert not budget.failed("parse")
+    assert budget.attempts == 4
+
+
+def test_cancelled_stops_immediately():
+    budget = RetryBudget(5)
+    budget.begin()
+    assert not budget.failed("cancelled")
+    assert budget.stopped and budget.failures == 0 and not budget.can_try()
+
+
+def test_ledger_summary_and_format():
+    ledger = RetryLedger()
+    assert ledger.format() == "[RETRY] 没有失败"
+    ledger.record("parse", "local_repair", 2)
+    ledger.record("transport", "retry")
+    ledger.record("transport", "retry")
+    ledger.record("other", "retry", 0)
+    assert ledger.summary() == {"transport": {"retry": 2}, "parse": {"local_repair": 2}}
+    assert ledger.format() == "[RETRY] transport（retry=2）；parse（local_repair=2）"